@@ -0,0 +1,145 @@
+import threading
+import queue
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """
+    handle on a background job: lets the job report progress and check for cancellation.
+    """
+    def __init__(self, worker, key):
+        self._worker = worker
+        self.key = key
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def progress(self, value):
+        """ may be called from the background thread: value is given to on_progress in the main loop. """
+        self._worker.post(self, 'progress', value)
+
+
+class BackgroundWorker:
+    """
+    Run functions on background threads, and deliver their results back to the Tk main loop with after().
+    Only one job per key is current: submitting a new job cancels the previous one with the same key,
+    and results of cancelled jobs are dropped (a cancelled job may still be running, see is_alive).
+    """
+    def __init__(self, widget, poll_ms=50):
+        """
+        :param widget: any tk widget, used for after() calls.
+        :param poll_ms: period of result polling, while jobs are running.
+        """
+        self._widget = widget
+        self._poll_ms = poll_ms
+        self._queue = queue.Queue()
+        self._jobs = {}
+        self._callbacks = {}
+        self._debounced = {}
+        self._polling = False
+
+    def submit(self, key, func, on_done=None, on_error=None, on_progress=None, on_end=None):
+        """
+        run func(job) on a background thread.
+        :param key: job kind (eg. 'scan'), a previous job with the same key is cancelled.
+        :param func: callable(Job), its return value is given to on_done.
+        :param on_done: callable(result), called in the main loop.
+        :param on_error: callable(exception), called in the main loop.
+        :param on_progress: callable(value), called in the main loop for each job.progress(value).
+        :param on_end: callable(Job), called in the main loop once func returned or raised,
+            after on_done or on_error, even if the job was cancelled.
+        :return: Job
+        """
+        self.cancel(key)
+        job = Job(self, key)
+        self._jobs[key] = job
+        self._callbacks[job] = (on_done, on_error, on_progress, on_end)
+
+        def run():
+            try:
+                self.post(job, 'done', func(job))
+            except Exception as e:
+                self.post(job, 'error', e)
+
+        threading.Thread(target=run, name=f'debrother-{key}', daemon=True).start()
+        self._schedule_poll()
+        return job
+
+    def cancel(self, key):
+        job = self._jobs.pop(key, None)
+        if job is not None:
+            job.cancel()
+
+    def is_running(self, key):
+        return key in self._jobs
+
+    def is_alive(self, key):
+        """
+        :return: True if a job with that key did not return yet, even if cancelled (its thread still runs).
+        """
+        return any(job.key == key for job in self._callbacks)
+
+    def debounce(self, key, delay_ms, func):
+        """
+        call func in the main loop after delay_ms, unless debounce is called again with the same key before.
+        """
+        after_id = self._debounced.pop(key, None)
+        if after_id is not None:
+            self._widget.after_cancel(after_id)
+
+        def fire():
+            self._debounced.pop(key, None)
+            func()
+
+        self._debounced[key] = self._widget.after(delay_ms, fire)
+
+    def post(self, job, kind, value):
+        self._queue.put((job, kind, value))
+
+    def _schedule_poll(self):
+        if not self._polling:
+            self._polling = True
+            self._widget.after(self._poll_ms, self._poll)
+
+    def _poll(self):
+        self._polling = False
+        while True:
+            try:
+                job, kind, value = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job not in self._callbacks:
+                continue
+            if job.cancelled:  # drop results of stale jobs
+                if kind != 'progress':
+                    on_end = self._callbacks.pop(job)[3]
+                    if on_end:
+                        on_end(job)
+                continue
+            on_done, on_error, on_progress, on_end = self._callbacks[job]
+            if kind == 'progress':
+                if on_progress:
+                    on_progress(value)
+                continue
+            # job is over
+            del self._callbacks[job]
+            if self._jobs.get(job.key) is job:
+                del self._jobs[job.key]
+            if kind == 'done' and on_done:
+                on_done(value)
+            elif kind == 'error':
+                if on_error:
+                    on_error(value)
+                else:
+                    logger.error(f'background job {job.key} failed: {value}')
+            if on_end:
+                on_end(job)
+        if self._callbacks:
+            self._schedule_poll()
@@ -2,43 +2,31 @@ from tkinter import filedialog, messagebox
 import tkinter as tk
 from tkinter import ttk
 import os.path as path
-import configparser
-from core import populate_pages, sort_policy, get_output_filepaths, rectoverso
+from collections import OrderedDict
+from core import AUTO_SORTING, scan_pages, make_plan, save_plan, apply_plan, compile_output_pattern, find_duplicate_outputs
+from naming import default_matcher
+from scanindex import ScanIndex, default_cache_filepath
+import blankpage
+from blankpage import BlankCache
+import thumbnails
+from thumbnails import ThumbnailCache
+from copyengine import throughput
+from BackgroundWorker import BackgroundWorker
+from PageListView import PageListView
+from config import Config, is_pil_available
+from profiling import span
 import logging
 import sys
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.StreamHandler(sys.stdout))
 logger.setLevel(logging.DEBUG)
 
-
-class Config:
-    def __init__(self, filepath, **kwargs):
-        self._filepath = filepath
-        self._data = kwargs
-        assert all(kw in kwargs for kw in ['input', 'output', 'pattern'])
-
-    def set_default(self):
-        self._data['input'].set('./')
-        self._data['output'].set('./')
-        self._data['pattern'].set('{page:03}')
-
-    def load(self):
-        logger.info(f'loading from {self._filepath}')
-        config = configparser.ConfigParser()
-        config.read(self._filepath)
-        for k in self._data:
-            value = config['DEFAULT'].get(k)
-            if value:
-                self._data[k].set(value)
-
-    def save(self):
-        logger.info(f'saving to {self._filepath}')
-        config = configparser.ConfigParser()
-        for k in self._data:
-            val = self._data[k].get()
-            config['DEFAULT'][k] = str(val)
-        with open(self._filepath, 'w') as configfile:
-            config.write(configfile)
+# delay without option change before the list is refreshed
+REFRESH_DELAY_MS = 300
+# delay without scrolling or selection change before thumbnails are loaded
+THUMBNAIL_DELAY_MS = 100
+# thumbnails kept in memory, so that scrolling back is instant
+MAX_THUMBNAIL_PHOTOS = 256
 
 
 class DebrotherMainWindow(tk.Frame):
@@ -57,7 +45,12 @@ class DebrotherMainWindow(tk.Frame):
         self.is_numbering_checked = tk.IntVar()
         self.is_flip_checked = tk.IntVar()
         self.is_reversed_checked = tk.IntVar()
+        self.is_auto_checked = tk.IntVar()
         self.do_delete_checked = tk.IntVar()
+        self.do_pdf_checked = tk.IntVar()
+        self.do_skip_blank_checked = tk.IntVar()
+        self.do_skip_duplicates_checked = tk.IntVar()
+        self.do_sessions_checked = tk.IntVar()
         self.column_sort = tk.IntVar()
         self.status = tk.StringVar()
 
@@ -70,11 +63,33 @@ class DebrotherMainWindow(tk.Frame):
             numbering=self.is_numbering_checked,
             flip=self.is_flip_checked,
             reversed=self.is_reversed_checked,
+            auto=self.is_auto_checked,
             move=self.do_delete_checked,
+            pdf=self.do_pdf_checked,
+            blank=self.do_skip_blank_checked,
+            duplicates=self.do_skip_duplicates_checked,
+            sessions=self.do_sessions_checked,
         )
         self._config.set_default()
         self._config.load()
 
+        # scan index, reused between refreshes and sessions
+        self._scan_index = ScanIndex(default_matcher(), default_cache_filepath())
+        self._scan_index.load()
+        # blankness scores, reused as long as files do not change
+        self._blank_cache = BlankCache(blankpage.default_cache_filepath())
+        self._blank_cache.load()
+        # thumbnails on disk (None without PIL), and the most recently shown ones in memory
+        self._thumbnail_cache = ThumbnailCache(thumbnails.default_cache_dirpath()) if is_pil_available() else None
+        self._thumbnail_photos = OrderedDict()  # file path -> PhotoImage
+        # scan, sort and copy run in background
+        self._worker = BackgroundWorker(self)
+        self._output_pattern = None
+        self._has_duplicates = False
+        # what proceed will do, as previewed in the list (None while refreshing)
+        self._plan = None
+        self._plan_generation = 0
+
         # GUIS
         PAD = 10
         LABEL_OPT = {'width': 10, 'anchor': tk.W}
@@ -99,9 +114,18 @@ class DebrotherMainWindow(tk.Frame):
         label.pack(fill=tk.X, expand=tk.FALSE, side=tk.LEFT)
         button = tk.Checkbutton(current_frame, text="numbering", variable=self.is_numbering_checked)
         button.pack(side=tk.LEFT)
-        button = tk.Checkbutton(current_frame, text="flip", variable=self.is_flip_checked)
+        self.flip_button = tk.Checkbutton(current_frame, text="flip", variable=self.is_flip_checked)
+        self.flip_button.pack(side=tk.LEFT)
+        self.reversed_button = tk.Checkbutton(current_frame, text="backward verso", variable=self.is_reversed_checked)
+        self.reversed_button.pack(side=tk.LEFT)
+        button = tk.Checkbutton(current_frame, text="auto", variable=self.is_auto_checked)
+        button.pack(side=tk.LEFT)
+        button = tk.Checkbutton(current_frame, text="skip blank", variable=self.do_skip_blank_checked)
         button.pack(side=tk.LEFT)
-        button = tk.Checkbutton(current_frame, text="backward verso", variable=self.is_reversed_checked)
+        if not is_pil_available():  # blank page detection needs PIL
+            self.do_skip_blank_checked.set(0)
+            button.config(state=tk.DISABLED)
+        button = tk.Checkbutton(current_frame, text="skip duplicates", variable=self.do_skip_duplicates_checked)
         button.pack(side=tk.LEFT)
         # output
         output_frame = tk.Frame(settings_frame)
@@ -127,21 +151,41 @@ class DebrotherMainWindow(tk.Frame):
 
         # list
         self.input_file_cols = ['page', 'original', 'renamed']
-        self.input_file_view = ttk.Treeview(self, columns=self.input_file_cols)
-        self.input_file_view.pack(fill=tk.BOTH, expand=tk.TRUE, side=tk.TOP, padx=PAD//2, pady=PAD//2)
+        list_frame = tk.Frame(self)
+        list_frame.pack(fill=tk.BOTH, expand=tk.TRUE, side=tk.TOP, padx=PAD//2, pady=PAD//2)
+        self.input_file_view = ttk.Treeview(list_frame, columns=self.input_file_cols)
+        self.input_file_view.pack(fill=tk.BOTH, expand=tk.TRUE, side=tk.LEFT)
+        # preview of the selected page
+        if self._thumbnail_cache:  # needs PIL
+            preview_frame = tk.Frame(list_frame, width=thumbnails.THUMBNAIL_SIZE[0])
+            preview_frame.pack_propagate(False)
+            preview_frame.pack(fill=tk.Y, expand=tk.FALSE, side=tk.LEFT, padx=PAD//2)
+            self.preview_label = tk.Label(preview_frame, anchor=tk.N)
+            self.preview_label.pack(fill=tk.BOTH, expand=tk.TRUE)
+            self.input_file_view.bind('<<TreeviewSelect>>', lambda e: self.on_view_change())
+            self.input_file_view.configure(yscrollcommand=lambda first, last: self.on_view_change())
         for i, col_name in enumerate(['#0'] + self.input_file_cols):
             self.input_file_view.heading(col_name, text=col_name, anchor=tk.W, command=self.sort_col_factory(i))
         # '#0' is special
         self.input_file_view.heading('#0', text='#')
         self.input_file_view.column('#0', minwidth=40, width=40, stretch=tk.NO)
+        self.list_view = PageListView(self.input_file_view)
 
         # proceed
         current_frame = tk.LabelFrame(self, text='proceed', padx=PAD//2, pady=PAD//2)
         current_frame.pack(padx=PAD//2, pady=PAD//2, fill=tk.X, expand=tk.FALSE, side=tk.TOP)
         self.proceed_button = tk.Button(current_frame, text="copy", command=self.on_proceed)
         self.proceed_button.pack(side=tk.RIGHT, padx=PAD//2, pady=PAD//2)
+        button = tk.Button(current_frame, text="save plan", command=self.on_save_plan)
+        button.pack(side=tk.RIGHT, padx=PAD//2, pady=PAD//2)
         button = tk.Checkbutton(current_frame, text="delete originals", variable=self.do_delete_checked)
         button.pack(side=tk.RIGHT, padx=PAD//2, pady=PAD//2)
+        button = tk.Checkbutton(current_frame, text="pdf", variable=self.do_pdf_checked)
+        button.pack(side=tk.RIGHT, padx=PAD//2, pady=PAD//2)
+        button = tk.Checkbutton(current_frame, text="per session", variable=self.do_sessions_checked)
+        button.pack(side=tk.RIGHT, padx=PAD//2, pady=PAD//2)
+        self.progress_bar = ttk.Progressbar(current_frame, orient=tk.HORIZONTAL, mode='determinate')
+        self.progress_bar.pack(fill=tk.X, expand=tk.TRUE, side=tk.LEFT, padx=PAD//2, pady=PAD//2)
 
         # status
         current_frame = tk.Label(self, bd=1, relief=tk.SUNKEN, anchor=tk.W,
@@ -154,28 +198,43 @@ class DebrotherMainWindow(tk.Frame):
         self.is_numbering_checked.trace("w", lambda a, b, c: self.on_option_change())
         self.is_flip_checked.trace("w", lambda a, b, c: self.on_option_change())
         self.is_reversed_checked.trace("w", lambda a, b, c: self.on_option_change())
+        self.is_auto_checked.trace("w", lambda a, b, c: self.on_option_change())
         self.do_delete_checked.trace("w", lambda a, b, c: self.on_option_change())
-        self.column_sort.trace("w", lambda a, b, c: self.on_option_change())
+        self.do_skip_blank_checked.trace("w", lambda a, b, c: self.on_option_change())
+        self.do_skip_duplicates_checked.trace("w", lambda a, b, c: self.on_option_change())
+        self.do_sessions_checked.trace("w", lambda a, b, c: self.on_option_change())
+        self.do_pdf_checked.trace("w", lambda a, b, c: self.on_option_change())
+        self.column_sort.trace("w", lambda a, b, c: self.list_view.sort(self.column_sort.get()))
         # force update on startup
         self.on_option_change()
 
     def quit(self):
+        self._worker.cancel('scan')
+        self._worker.cancel('proceed')
+        self._worker.cancel('thumbnails')
         self._config.save()
+        try:
+            self._scan_index.save()
+        except OSError as e:
+            logger.warning(f'unable to save scan index: {e}')
+        try:
+            self._blank_cache.save()
+        except OSError as e:
+            logger.warning(f'unable to save blank score cache: {e}')
+        blankpage.shutdown_executor()
         self.master.destroy()
 
     def sort_col_factory(self, i):
         return lambda: self.column_sort.set(i)
 
     def on_populate(self):
-        self.populate()
+        self.populate(fresh=True)
 
     def on_browse_input(self):
         browse_dirpath = tk.filedialog.askdirectory(title="Select scanned directory",
                                                     initialdir=self.input_dirpath.get(),)
         if browse_dirpath:
             self.input_dirpath.set(browse_dirpath)
-            self.populate()
-            self.show_status('{} files listed'.format(len(self.input_file_view.get_children())))
 
     def on_browse_output(self):
         browse_dirpath = tk.filedialog.askdirectory(title="Select output directory",
@@ -198,8 +257,11 @@ class DebrotherMainWindow(tk.Frame):
         tk.messagebox.showinfo("Naming syntax", usage)
 
     def on_option_change(self):
+        self._plan = None
+        self._plan_generation += 1
         self.do_validate_options()
-        self.do_refresh()
+        # wait for the user to stop typing before scanning again
+        self._worker.debounce('refresh', REFRESH_DELAY_MS, self.do_refresh)
 
     def do_validate_options(self):
         everything_is_fine = True
@@ -214,16 +276,25 @@ class DebrotherMainWindow(tk.Frame):
             self.input_dirpath_entry.config(background=RED)
             everything_is_fine = False
 
-        # name syntax
+        # sorting: flip and backward verso are inferred from scan times in auto mode
+        state = tk.DISABLED if self.is_auto_checked.get() else tk.NORMAL
+        self.flip_button.config(state=state)
+        self.reversed_button.config(state=state)
+
+        # name syntax: compiled once, and reused to populate
         try:
-            get_output_filepaths([r'sample\sample.png'], 'tmp', self.output_pattern.get())
-            self.output_rename_entry.config(background=NOR)
+            self._output_pattern = compile_output_pattern(self.output_dirpath.get(), self.output_pattern.get())
+            self.output_rename_entry.config(background=ORANGE if self._has_duplicates else NOR)
         except (ValueError, KeyError, IndexError) as e:
+            self._output_pattern = None
             self.output_rename_entry.config(background=RED)
             everything_is_fine = False
+        if self._has_duplicates:
+            everything_is_fine = False
 
-        # proceed authorized
-        self.proceed_button.config(state=tk.NORMAL if everything_is_fine else tk.DISABLED)
+        # proceed authorized (or cancel), not before a cancelled copy actually stopped
+        if not self._worker.is_alive('proceed'):
+            self.proceed_button.config(state=tk.NORMAL if everything_is_fine else tk.DISABLED)
 
     def do_refresh(self):
         self.populate()
@@ -235,45 +306,227 @@ class DebrotherMainWindow(tk.Frame):
         self.show_status('Error: ' + message)
         tk.messagebox.showerror("Error", message)
 
+    def get_flip(self):
+        return AUTO_SORTING if self.is_auto_checked.get() else self.is_flip_checked.get()
+
+    def get_reversed(self):
+        return AUTO_SORTING if self.is_auto_checked.get() else self.is_reversed_checked.get()
+
     def on_proceed(self):
-        try:
-            rectoverso(self.input_dirpath.get(),
-                       self.output_dirpath.get() or self.input_dirpath.get(),
-                       self.output_pattern.get(),
-                       self.is_numbering_checked.get(),
-                       self.is_flip_checked.get(),
-                       self.is_reversed_checked.get(),
-                       self.do_delete_checked.get()
-                       )
+        if self._worker.is_running('proceed'):
+            # the copy stops at its next check: a new one must not start before (same staging directory)
+            self._worker.cancel('proceed')
+            self.proceed_button.config(state=tk.DISABLED)
+            self.show_status('cancelling ...')
+            return
+        if self._worker.is_alive('proceed'):  # still cancelling
+            return
+        if self._plan is None:
+            self.show_status('wait for the list to be refreshed')
+            return
+
+        plan = self._plan
+        if plan['pdf'] and not self.do_sessions_checked.get():
+            # a single multipage pdf, instead of renamed files
+            default_filepath = self.get_default_pdf_filepath()
+            pdf_filepath = tk.filedialog.asksaveasfilename(title="Save pdf as",
+                                                           initialdir=path.dirname(default_filepath),
+                                                           initialfile=path.basename(default_filepath),
+                                                           defaultextension='.pdf',
+                                                           filetypes=[('pdf', '*.pdf')])
+            if not pdf_filepath:
+                return
+            destination = path.relpath(pdf_filepath, plan['output'])
+            plan = dict(plan, files=[dict(entry, destination=destination) if entry['destination'] else entry
+                                     for entry in plan['files']])
+        if any(entry['skipped'] == 'blank' for entry in plan['files']):
+            # let a later refresh reuse scores computed for the list
+            try:
+                self._blank_cache.save()
+            except OSError as e:
+                logger.warning(f'unable to save blank score cache: {e}')
+
+        def proceed(job):
+            return apply_plan(plan, progress=job.progress, cancel=job.cancel_event)
+
+        self._worker.cancel('scan')
+        self._worker.submit('proceed', proceed,
+                            on_done=self.on_proceed_success,
+                            on_error=self.on_proceed_error,
+                            on_progress=self.on_proceed_progress,
+                            on_end=self.on_proceed_end)
+        self.proceed_button.config(text='cancel', state=tk.NORMAL)
+        self.progress_bar.config(value=0)
+        self.show_status('copying ...')
+
+    def on_save_plan(self):
+        if self._plan is None:
+            self.show_status('wait for the list to be refreshed')
+            return
+        plan_filepath = tk.filedialog.asksaveasfilename(title="Save plan as",
+                                                        initialdir=self.output_dirpath.get(),
+                                                        defaultextension='.json',
+                                                        filetypes=[('json', '*.json')])
+        if plan_filepath:
+            save_plan(self._plan, plan_filepath)
+            self.show_status(f'plan saved: apply it with --apply {plan_filepath}')
+
+    def get_default_pdf_filepath(self):
+        output_dirpath = self.output_dirpath.get() or self.input_dirpath.get()
+        return path.join(output_dirpath, path.basename(path.normpath(self.input_dirpath.get())) + '.pdf')
+
+    def on_proceed_progress(self, progress):
+        self.progress_bar.config(maximum=max(1, progress.bytes_total), value=progress.bytes_done)
+        rate = throughput(progress)
+        eta = (progress.bytes_total - progress.bytes_done) / rate if rate else 0
+        self.show_status(f'{progress.files_done}/{progress.files_total} files, '
+                         f'{rate / 1e6:.1f} MB/s, {eta:.0f}s left')
+
+    def on_proceed_success(self, result):
+        if result['up_to_date']:
+            self.show_status(f'success: {result["copied"]} files done, {result["up_to_date"]} already up to date')
+        else:
             self.show_status('success')
-        except FileNotFoundError as e:
+
+    def on_proceed_error(self, e):
+        if isinstance(e, InterruptedError):
+            self.show_status('cancelled')
+        elif isinstance(e, (FileNotFoundError, IndexError, ValueError)):
             self.show_error(str(e))
-        finally:
-            self.on_option_change()
-
-    def populate(self):
-        # sort
-        input_filepaths = populate_pages(self.input_dirpath.get())
-        input_filepaths = sort_policy(input_filepaths,
-                                      self.is_numbering_checked.get(),
-                                      self.is_flip_checked.get(),
-                                      self.is_reversed_checked.get())
-
-        output_filepaths = get_output_filepaths(input_filepaths,
-                                                self.output_dirpath.get(),
-                                                self.output_pattern.get())
-        # only life names
-        if True:
-            page_numbers = (f'{p+1:04}' for p, _ in enumerate(input_filepaths))
-            input_filepaths = (path.relpath(f, self.input_dirpath.get()) for f in input_filepaths)
-            output_filepaths = (path.relpath(f, self.output_dirpath.get()) for f in output_filepaths)
-
-        columns = [(i, p, ip, op) for i, (p, ip, op) in enumerate(zip(page_numbers, input_filepaths, output_filepaths))]
-
-        # resort for display
-        columns = sorted(columns, key=lambda x : x[self.column_sort.get()])
-
-        # display
-        self.input_file_view.delete(*self.input_file_view.get_children())
-        for i, cols in enumerate(columns):
-            self.input_file_view.insert('', 'end', text=cols[0], values=cols[1:])
+        else:
+            self.show_error(repr(e))
+
+    def on_proceed_end(self, job):
+        if job.cancelled:
+            self.show_status('cancelled')
+        self.proceed_button.config(text='copy')
+        self.progress_bar.config(value=0)
+        self.on_option_change()
+
+    def populate(self, fresh=False):
+        """
+        scan and plan in background (any previous scan is cancelled), then display the plan.
+        :param fresh: stat every file again (see ScanIndex.scan), as auto sorting and duplicate detection always do.
+        """
+        options = dict(input_dirpath=self.input_dirpath.get(),
+                       output_dirpath=self.output_dirpath.get() or self.input_dirpath.get(),
+                       output_filepattern=self.output_pattern.get(),
+                       sorting_brother=self.is_numbering_checked.get(),
+                       sort_windows=self.get_flip(),
+                       sort_reversed=self.get_reversed(),
+                       delete_after_success=self.do_delete_checked.get(),
+                       pdf_filepath=self.get_default_pdf_filepath() if self.do_pdf_checked.get() else None,
+                       skip_blank=bool(self.do_skip_blank_checked.get()),
+                       skip_duplicates=bool(self.do_skip_duplicates_checked.get()),
+                       sessions=bool(self.do_sessions_checked.get()))
+        # auto sorting compares file times, and duplicates are grouped by size: both need current ones
+        fresh = fresh or options['sort_windows'] == AUTO_SORTING or options['skip_duplicates']
+        valid_pattern = self._output_pattern is not None
+        generation = self._plan_generation
+        scan_index = self._scan_index
+        blank_cache = self._blank_cache
+
+        def scan(job):
+            with span('scan') as scan_span:
+                pages = scan_pages(options['input_dirpath'], scan_index, job.cancel_event, fresh)
+                scan_span.count(files=len(pages))
+            if not valid_pattern and not options['pdf_filepath']:
+                # nothing can be planned: only show pages
+                rows = [(ip, i, '', ip, '') for i, ip in enumerate(
+                    path.relpath(page.filepath, options['input_dirpath']) for page in pages)]
+                return rows, {}, None, generation
+            plan = make_plan(pages, blank_cache=blank_cache, cancel=job.cancel_event, **options)
+            destinations = [entry['destination'] for entry in plan['files'] if entry['destination']]
+            duplicates = {} if plan['pdf'] else find_duplicate_outputs(destinations)
+            # rows are identified by original file path, only life names
+            rows = []
+            for i, entry in enumerate(plan['files']):
+                copy = f' (copy of {entry["duplicate_of"]})' if entry['duplicate_of'] else ''
+                if entry['destination']:
+                    rows.append((entry['source'], i, f'{entry["index"] + 1:04}', entry['source'],
+                                 entry['destination'] + copy))
+                elif entry['skipped'] == 'blank':
+                    rows.append((entry['source'], i, '', entry['source'], 'skipped (blank)'))
+                elif entry['skipped'] == 'duplicate':
+                    rows.append((entry['source'], i, '', entry['source'], f'skipped{copy}'))
+                else:
+                    rows.append((entry['source'], i, '', entry['source'], f'error: {entry["skipped"]}{copy}'))
+            return rows, duplicates, plan, generation
+
+        self._worker.submit('scan', scan, on_done=self.display, on_error=self.on_populate_error)
+
+    def on_view_change(self):
+        if self._thumbnail_cache:
+            self._worker.debounce('thumbnails', THUMBNAIL_DELAY_MS, self.load_thumbnails)
+
+    def load_thumbnails(self):
+        """
+        show the thumbnail of the selected page, and generate in background the missing ones:
+        selected pages first, then the visible ones (so that selecting them next is instant).
+        """
+        input_dirpath = self.input_dirpath.get()
+        keys = list(dict.fromkeys(self.list_view.selected_keys() + self.list_view.visible_keys()))
+        filepaths = [path.join(input_dirpath, key) for key in keys]
+        for filepath in filepaths:
+            if filepath in self._thumbnail_photos:
+                self._thumbnail_photos.move_to_end(filepath)
+        self.show_preview()
+        missing = [filepath for filepath in filepaths if filepath not in self._thumbnail_photos]
+        if not missing:
+            return
+        cache = self._thumbnail_cache
+
+        def generate(job):
+            for filepath in missing:
+                if job.cancelled:
+                    break
+                try:
+                    job.progress((filepath, cache.thumbnail(filepath)))
+                except OSError as e:  # unreadable or not an image
+                    logger.debug(f'no thumbnail for {filepath}: {e}')
+
+        self._worker.submit('thumbnails', generate, on_progress=self.on_thumbnail)
+
+    def on_thumbnail(self, thumbnail):
+        filepath, thumbnail_filepath = thumbnail
+        try:
+            self._thumbnail_photos[filepath] = tk.PhotoImage(file=thumbnail_filepath)
+        except tk.TclError as e:
+            logger.debug(f'unable to load thumbnail of {filepath}: {e}')
+            return
+        while len(self._thumbnail_photos) > MAX_THUMBNAIL_PHOTOS:
+            self._thumbnail_photos.popitem(last=False)
+        self.show_preview()
+
+    def show_preview(self):
+        selected = self.list_view.selected_keys()
+        photo = None
+        if selected:
+            photo = self._thumbnail_photos.get(path.join(self.input_dirpath.get(), selected[0]))
+        self.preview_label.configure(image=photo or '', text='' if photo or not selected else '…')
+
+    def on_populate_error(self, e):
+        self.list_view.update([])
+        self.show_status(f'Error: {e}')
+
+    def display(self, result):
+        rows, duplicates, plan, generation = result
+        nb_blanks = sum(1 for row in rows if row[-1] == 'skipped (blank)')
+        errors = [row for row in rows if row[-1].startswith('error: ')]
+        copies = [row for row in rows if ' (copy of ' in row[-1]]
+        # only apply differences with the displayed list
+        self.list_view.update(rows, self.column_sort.get())
+        self.on_view_change()
+        self._has_duplicates = bool(duplicates)
+        self.do_validate_options()
+        if generation == self._plan_generation:  # options did not change meanwhile
+            self._plan = plan
+        if duplicates:
+            self.show_status('{} pages share the same output name, eg. {}'.format(
+                sum(len(ix) for ix in duplicates.values()), path.basename(next(iter(duplicates)))))
+        elif errors:
+            self.show_status(f'{len(errors)} pages cannot be sorted, eg. {errors[0][0]}: {errors[0][-1]}')
+        elif copies:
+            self.show_status(f'{len(copies)} pages were scanned twice, eg. {copies[0][0]}')
+        elif nb_blanks:
+            self.show_status(f'{nb_blanks} blank pages will be skipped')
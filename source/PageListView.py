@@ -0,0 +1,114 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# number of rows inserted at once, before giving the hand back to the main loop
+CHUNK_SIZE = 500
+
+
+def diff_rows(displayed, rows):
+    """
+    compare displayed rows with new rows, both keyed by their first value.
+    :param displayed: dict key -> row of currently displayed rows.
+    :param rows: list of new rows.
+    :return: (removed keys, inserted rows, updated rows)
+    """
+    keys = {row[0] for row in rows}
+    removed = [key for key in displayed if key not in keys]
+    inserted = [row for row in rows if row[0] not in displayed]
+    updated = [row for row in rows if row[0] in displayed and displayed[row[0]] != row]
+    return removed, inserted, updated
+
+
+class PageListView:
+    """
+    Keep a model of the rows displayed in a ttk.Treeview, and only apply differences:
+    rows are removed, inserted or updated in place, and sorting only moves existing items.
+    New rows are inserted by chunks, so the first screen shows up immediately on large lists.
+
+    A row is (key, text, *values), where key identifies the row (eg. the original file path).
+    """
+    def __init__(self, treeview):
+        self._view = treeview
+        self._rows = {}  # key -> row
+        self._iids = {}  # key -> treeview item id
+        self._keys = {}  # treeview item id -> key
+        self._sort_column = 0
+        self._generation = 0
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _sort_key(self):
+        # column 0 is the text, next are values: skip the key
+        column = self._sort_column + 1
+        return lambda row: row[column]
+
+    def _sorted_keys(self):
+        return [row[0] for row in sorted(self._rows.values(), key=self._sort_key())]
+
+    def update(self, rows, sort_column=None):
+        """
+        display rows, applying only the differences with the rows currently displayed.
+        :param rows: list of (key, text, *values)
+        :param sort_column: displayed column to sort on, 0 is the text (keep current sort if None).
+        """
+        self._generation += 1
+        if sort_column is not None:
+            self._sort_column = sort_column
+        removed, inserted, updated = diff_rows(self._rows, rows)
+        logger.debug(f'list: {len(removed)} removed, {len(inserted)} inserted, {len(updated)} updated.')
+
+        if removed:
+            iids = [self._iids.pop(key) for key in removed]
+            self._view.delete(*iids)
+            for key, iid in zip(removed, iids):
+                del self._rows[key]
+                del self._keys[iid]
+        for row in updated:
+            self._view.item(self._iids[row[0]], text=row[1], values=row[2:])
+            self._rows[row[0]] = row
+
+        inserted = sorted(inserted, key=self._sort_key())
+        self._insert_chunk(inserted, 0, self._generation)
+
+    def _insert_chunk(self, inserted, start, generation):
+        if generation != self._generation:  # a newer update took over
+            return
+        for row in inserted[start:start + CHUNK_SIZE]:
+            iid = self._view.insert('', 'end', text=row[1], values=row[2:])
+            self._iids[row[0]] = iid
+            self._keys[iid] = row[0]
+            self._rows[row[0]] = row
+        if start + CHUNK_SIZE < len(inserted):
+            self._view.after(1, self._insert_chunk, inserted, start + CHUNK_SIZE, generation)
+        else:
+            self._reorder()
+
+    def visible_keys(self):
+        """
+        :return: keys of the rows currently scrolled into view, top to bottom.
+        """
+        keys = []
+        iid = self._view.identify_row(1)
+        while iid and self._view.bbox(iid):
+            if iid in self._keys:
+                keys.append(self._keys[iid])
+            iid = self._view.next(iid)
+        return keys
+
+    def selected_keys(self):
+        return [self._keys[iid] for iid in self._view.selection() if iid in self._keys]
+
+    def sort(self, sort_column):
+        """
+        sort displayed rows on the given displayed column (0 is the text), moving existing items.
+        """
+        self._sort_column = sort_column
+        self._reorder()
+
+    def _reorder(self):
+        iids = [self._iids[key] for key in self._sorted_keys()]
+        if list(self._view.get_children()) != iids:
+            # reorder all existing items in a single call
+            self._view.set_children('', *iids)
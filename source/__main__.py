@@ -4,9 +4,7 @@
 import argparse
 import os.path as path
 import logging, sys
-import tkinter as tk
-from core import rectoverso
-from DebrotherMainWindow import DebrotherMainWindow
+# keep imports light: headless runs (--nogui, --watch, --verify) must not load tkinter nor the GUI.
 
 logger = logging.getLogger('deborther')
 logger.addHandler(logging.StreamHandler(sys.stdout))
@@ -23,6 +21,67 @@ class VerbosityParsor(argparse.Action):
         setattr(namespace, self.dest, values)
 
 
+def get_pipeline_options(args, config=None):
+    """
+    rectoverso keyword arguments from the command line, falling back to config file values for
+    options not given.
+    :param args: parsed command line.
+    :param config: dict as given by config.read_config (default: read args.config).
+    :return: dict of rectoverso keyword arguments.
+    """
+    from core import AUTO_SORTING
+    if config is None:
+        from config import read_config
+        config = read_config(args.config)
+
+    def pick(name):
+        value = getattr(args, name)
+        return config[name] if value is None else value
+
+    options = {
+        'sorting_brother': pick('numbering'),
+        'sort_windows': AUTO_SORTING if pick('auto') else pick('flip'),
+        'sort_reversed': AUTO_SORTING if pick('auto') else pick('reversed'),
+        'delete_after_success': pick('move'),
+        'skip_blank': pick('blank'),
+        'skip_duplicates': pick('duplicates'),
+        'pdf_filepath': args.pdf,
+        'checksum': args.checksum,
+    }
+    if args.workers:
+        options['max_workers'] = args.workers
+    return options
+
+
+def get_batch_settings(args):
+    """
+    batch (and job) settings from debrother.ini, then the command line, input and output excepted.
+    :param args: parsed command line.
+    :return: dict of settings, as in a batch file.
+    """
+    from config import read_config
+    settings = {}
+    if path.isfile(args.config):
+        settings.update((k, v) for k, v in read_config(args.config).items() if k not in ('input', 'output'))
+    for k in ['pattern', 'numbering', 'flip', 'reversed', 'auto', 'move', 'blank', 'duplicates', 'sessions']:
+        if getattr(args, k) is not None:
+            settings[k] = getattr(args, k)
+    if args.checksum:
+        settings['checksum'] = True
+    return settings
+
+
+def parse_address(address):
+    """ 'host:port' or 'port' -> (host, port), anything else is a unix socket path, None -> default address """
+    from jobqueue import default_address, DEFAULT_TCP_ADDRESS
+    if address is None:
+        return default_address()
+    host, _, port = address.rpartition(':')
+    if not port.isdigit():
+        return path.abspath(address)
+    return host or DEFAULT_TCP_ADDRESS[0], int(port)
+
+
 def rectoverso_main():
     try:
         cli_parser = argparse.ArgumentParser(
@@ -41,8 +100,55 @@ def rectoverso_main():
                                 help='path to config file[debrother.ini]')
         cli_parser.add_argument('--pattern',
                                 help='output file name syntax.')
+        cli_parser.add_argument('--numbering', action=argparse.BooleanOptionalAction,
+                                help='sort pages by scan number [config, or yes]')
+        cli_parser.add_argument('--flip', action=argparse.BooleanOptionalAction,
+                                help='interleave recto and verso series [config, or yes]')
+        cli_parser.add_argument('--reversed', action=argparse.BooleanOptionalAction,
+                                help='verso series was scanned backward [config, or yes]')
+        cli_parser.add_argument('--auto', action=argparse.BooleanOptionalAction,
+                                help='infer flip and backward verso from file times [config, or no]')
+        cli_parser.add_argument('--move', action=argparse.BooleanOptionalAction,
+                                help='remove original files once done [config, or no]')
+        cli_parser.add_argument('--skip-blank', dest='blank', action=argparse.BooleanOptionalAction,
+                                help='do not output blank pages, needs PIL [config, or no]')
+        cli_parser.add_argument('--skip-duplicates', dest='duplicates', action=argparse.BooleanOptionalAction,
+                                help='do not output pages scanned twice (same content) [config, or no]')
+        cli_parser.add_argument('--sessions', action=argparse.BooleanOptionalAction,
+                                help='sort and output each scan session on its own, in its own sub directory '
+                                     '(or pdf, with --pdf) [config, or no]')
+        cli_parser.add_argument('--workers', type=int,
+                                help='number of files copied concurrently')
+        cli_parser.add_argument('--pdf', metavar='FILE',
+                                help='write pages into a single multipage pdf (jpeg pages only), instead of renaming')
+        cli_parser.add_argument('--checksum', action='store_true',
+                                help='hash pages while copying, into a manifest next to the outputs')
+        cli_parser.add_argument('--verify', metavar='MANIFEST',
+                                help='check output files against a manifest, and exit')
+        cli_parser.add_argument('--profile', metavar='FILE',
+                                help='write a json report of time spent (and files, bytes) in each phase')
+        cli_parser.add_argument('--plan', metavar='FILE',
+                                help='write what would be done (json) without touching any file, and exit')
+        cli_parser.add_argument('--apply', metavar='FILE',
+                                help='do what a plan file says (-i and -o move its input and output roots), '
+                                     'skipping pages already up to date, and exit')
+        cli_parser.add_argument('--batch', metavar='FILE',
+                                help='process every input root listed in a json batch file, and exit')
+        cli_parser.add_argument('--summary', metavar='FILE',
+                                help='batch mode: write the json summary to this file [stdout]')
+        cli_parser.add_argument('--serve', action='store_true',
+                                help='run the local job queue service, for shared workstations')
+        cli_parser.add_argument('--submit', action='store_true',
+                                help='submit the job to the local job queue service instead, and wait for it')
+        cli_parser.add_argument('--service', metavar='SOCKET|HOST:PORT',
+                                help='address of the job queue service, a unix socket or a local tcp port '
+                                     '[~/.local/state/debrother/jobs.sock]')
         cli_parser.add_argument('--nogui', action='store_true',
                                 help='no gui')
+        cli_parser.add_argument('--watch', nargs='+', metavar='DIR',
+                                help='daemon mode: watch scanner drop folders, and process each batch once complete')
+        cli_parser.add_argument('--settle', type=float, default=10.,
+                                help='daemon mode: seconds without change before a batch is complete [10]')
         cli_parser.add_argument('--debug', action='store_true', default=False,
                                 help='debug mode on')
         args = cli_parser.parse_args()
@@ -55,14 +161,112 @@ def rectoverso_main():
             'config:\n' + '\n'.join(f'\t--{k:10} {v}' for k, v in args.__dict__.items())
         )
 
-        if args.nogui:
-            rectoverso(args.input, args.output, args.pattern)
+        if args.profile:
+            from profiling import Profile, subscribe
+            profile = Profile()
+            subscribe(profile)
         else:
-            logger.debug('init GUI')
-            root = tk.Tk()
-            my_gui = DebrotherMainWindow(root, **vars(args))
-            root.mainloop()
-            logger.debug('exiting')
+            profile = None
+        try:
+            if args.verify:
+                from manifest import verify_manifest
+                report = verify_manifest(args.verify)
+                for status in ['corrupted', 'missing']:
+                    for filepath in report[status]:
+                        logger.critical(f'{status}: {filepath}')
+                sys.exit(1 if report['corrupted'] or report['missing'] else 0)
+            elif args.plan:
+                from config import read_config
+                from core import scan_pages, make_plan, save_plan
+                config = read_config(args.config)
+                options = get_pipeline_options(args, config)
+                options.pop('checksum')
+                options.pop('max_workers', None)
+                input_dirpath = args.input or config['input']
+                sessions = args.sessions if args.sessions is not None else config['sessions']
+                plan = make_plan(scan_pages(input_dirpath), input_dirpath, args.output or config['output'],
+                                 args.pattern or config['pattern'], sessions=sessions, **options)
+                save_plan(plan, args.plan)
+                skipped = [entry for entry in plan['files'] if entry['skipped']]
+                duplicates = [entry for entry in plan['files'] if entry['duplicate_of']]
+                logger.info(f'{len(plan["files"]) - len(skipped)} files planned, {len(skipped)} skipped, '
+                            f'{len(duplicates)} duplicates.')
+            elif args.apply:
+                from core import load_plan, apply_plan, DEFAULT_MAX_WORKERS
+                result = apply_plan(load_plan(args.apply), args.input, args.output,
+                                    max_workers=args.workers or DEFAULT_MAX_WORKERS, checksum=args.checksum)
+                logger.info(f'{result["copied"]} files copied, {result["up_to_date"]} already up to date.')
+            elif args.batch:
+                from batch import batch_main, DEFAULT_IO_WORKERS
+                # debrother.ini then command line options, as defaults for every root
+                sys.exit(batch_main(args.batch, args.summary, get_batch_settings(args),
+                                    io_workers=args.workers or DEFAULT_IO_WORKERS))
+            elif args.serve:
+                from jobqueue import serve, DEFAULT_IO_WORKERS
+                serve(parse_address(args.service), io_workers=args.workers or DEFAULT_IO_WORKERS)
+            elif args.submit:
+                from config import read_config
+                from jobqueue import submit_job, wait_job
+                config = read_config(args.config)
+                settings = get_batch_settings(args)
+                settings.update(input=path.abspath(args.input or config['input']),
+                                output=path.abspath(args.output or config['output']))
+                if args.pdf:
+                    settings['pdf'] = path.abspath(args.pdf)
+                address = parse_address(args.service)
+                job = submit_job(settings, address)
+                logger.info(f'job {job["id"]} submitted.')
+
+                def on_progress(job):
+                    progress = job['progress']
+                    if progress:
+                        logger.info(f'{job["status"]}: {progress["files_done"]}/{progress["files_total"]} files')
+
+                job = wait_job(job['id'], address, on_progress=on_progress)
+                report = job['report'] or {}
+                logger.info(f'job {job["id"]} {job["status"]}: {report.get("files", 0)} files.')
+                if report.get('error'):
+                    logger.critical(report['error'])
+                sys.exit(0 if job['status'] == 'ok' else 1)
+            elif args.watch:
+                from watcher import watch_folders
+                options = get_pipeline_options(args)
+                options.pop('pdf_filepath')  # one pdf per batch is not supported in daemon mode
+                watch_folders(args.watch, args.output, args.pattern or '{page:03d}.{ext}', settle_delay=args.settle,
+                              **options)
+            elif args.nogui:
+                from config import read_config
+                from core import rectoverso, rectoverso_sessions
+                config = read_config(args.config)
+                options = get_pipeline_options(args, config)
+                if args.sessions if args.sessions is not None else config['sessions']:
+                    # one pdf per session, named after it
+                    options['pdf'] = bool(options.pop('pdf_filepath'))
+                    report = rectoverso_sessions(args.input or config['input'],
+                                                 args.output or config['output'],
+                                                 args.pattern or config['pattern'],
+                                                 **options)
+                    for session in report:
+                        logger.info(f'{session["status"]:9} {session["files"]:5} files {session["duplicates"]:3} '
+                                    f'duplicates  {session["session"]}')
+                        if session['error']:
+                            logger.critical(f'{session["session"]}: {session["error"]}')
+                    sys.exit(0 if all(session['status'] == 'ok' for session in report) else 1)
+                rectoverso(args.input or config['input'],
+                           args.output or config['output'],
+                           args.pattern or config['pattern'],
+                           **options)
+            else:
+                logger.debug('init GUI')
+                import tkinter as tk
+                from DebrotherMainWindow import DebrotherMainWindow
+                root = tk.Tk()
+                my_gui = DebrotherMainWindow(root, **vars(args))
+                root.mainloop()
+                logger.debug('exiting')
+        finally:
+            if profile:
+                profile.save(args.profile)
 
     except Exception as e:
         logger.critical(e)
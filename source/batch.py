@@ -0,0 +1,217 @@
+import os
+import os.path as path
+import sys
+import json
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from core import AUTO_SORTING, DEFAULT_MAX_WORKERS, scan_pages, process_pages, process_sessions
+from naming import default_matcher
+from config import CONFIG_DEFAULTS
+from scanindex import ScanIndex, default_cache_filepath
+from profiling import span
+
+logger = logging.getLogger(__name__)
+
+# number of roots processed concurrently
+DEFAULT_MAX_ROOTS = 4
+# number of files copied concurrently, all roots together
+DEFAULT_IO_WORKERS = 2 * DEFAULT_MAX_WORKERS
+# batch file keys, besides the debrother.ini ones
+BATCH_DEFAULTS = dict(CONFIG_DEFAULTS, output=None, pattern='{page:03d}.{ext}', checksum=False)
+
+
+def roots_overlap(a, b):
+    """
+    :return: True if directories a and b are the same, or one is inside the other.
+    """
+    a, b = path.normcase(path.abspath(a)), path.normcase(path.abspath(b))
+    return a == b or a.startswith(b.rstrip(os.sep) + os.sep) or b.startswith(a.rstrip(os.sep) + os.sep)
+
+
+def get_root_dirpaths(settings):
+    """
+    :return: directories a root reads from or writes to: its input, and output.
+    """
+    return [settings['input'], settings['output'] or settings['input']]
+
+
+def group_overlapping(roots):
+    """
+    :param roots: list of root settings.
+    :return: list of lists of indices in roots: roots sharing (or nesting) an input or output directory,
+        directly or through other roots, are in the same group, in order.
+    """
+    groups = []
+    for i, settings in enumerate(roots):
+        dirpaths = get_root_dirpaths(settings)
+        overlapping = [group for group in groups
+                       if any(roots_overlap(a, b) for j in group for a in get_root_dirpaths(roots[j]) for b in dirpaths)]
+        merged = sorted([i] + [j for group in overlapping for j in group])
+        groups = [group for group in groups if group not in overlapping] + [merged]
+    return sorted(groups)
+
+
+def load_batch(batch_filepath, defaults=None):
+    """
+    read a batch file: a json list of roots, each with its own settings (same keys as debrother.ini,
+    plus checksum). pdf is either a file path, or true for a pdf named after the input (one per session with
+    sessions). Settings not given come from a "defaults" entry, then from defaults:
+
+        {"defaults": {"pattern": "{yyyy}{mm}{dd}_{page:03}.{ext}", "move": true},
+         "roots": [{"input": "/scans/alice", "output": "/archive/alice"},
+                   {"input": "/scans/bob", "output": "/archive/bob", "auto": true}]}
+
+    :param batch_filepath: path to the json batch file.
+    :param defaults: dict of settings (eg. as given by config.read_config), BATCH_DEFAULTS if None.
+    :return: list of dict, complete settings of each root.
+    :raise ValueError: if two roots would write the same output files.
+    """
+    with open(batch_filepath, encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        data = {'roots': data}
+    base = dict(BATCH_DEFAULTS, **(defaults or {}), **data.get('defaults', {}))
+    roots = []
+    for root in data['roots']:
+        if isinstance(root, str):
+            root = {'input': root}
+        unknown = set(root) - set(base)
+        if unknown:
+            raise KeyError(f'unknown batch settings: {", ".join(sorted(unknown))}')
+        roots.append(dict(base, **root))
+    # pages of one root would overwrite pages of the other
+    for i, a in enumerate(roots):
+        for b in roots[:i]:
+            a_output, b_output = (path.normcase(path.abspath(r['output'] or r['input'])) for r in (a, b))
+            if a_output == b_output and a['pattern'] == b['pattern'] and not a['sessions'] and not a['pdf']:
+                raise ValueError(f'{b["input"]} and {a["input"]} have the same output and pattern.')
+    return roots
+
+
+def get_root_options(settings, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    :param settings: dict of root settings, as given by load_batch.
+    :return: process_pages keyword arguments.
+    """
+    return {
+        'sorting_brother': bool(settings['numbering']),
+        'sort_windows': AUTO_SORTING if settings['auto'] else bool(settings['flip']),
+        'sort_reversed': AUTO_SORTING if settings['auto'] else bool(settings['reversed']),
+        'delete_after_success': bool(settings['move']),
+        'skip_blank': bool(settings['blank']),
+        'skip_duplicates': bool(settings['duplicates']),
+        'checksum': bool(settings['checksum']),
+        'max_workers': max_workers,
+    }
+
+
+def process_root(settings, max_workers=DEFAULT_MAX_WORKERS, scan_index=None, cancel=None, progress=None):
+    """
+    scan and process a single input root.
+    :param settings: dict of root settings, as given by load_batch.
+    :param max_workers: number of files copied concurrently.
+    :param scan_index: ScanIndex (optional).
+    :param cancel: threading.Event, once set, the root is cancelled (optional).
+    :param progress: callable(CopyProgress), called while copying (optional).
+    :return: report dict: input, output, status ('ok', 'failed' or 'cancelled'), files, bytes, duplicates,
+        duration, error.
+    """
+    input_dirpath = settings['input']
+    output_dirpath = settings['output'] or input_dirpath
+    report = {'input': input_dirpath, 'output': output_dirpath, 'status': 'ok',
+              'files': 0, 'bytes': 0, 'duplicates': 0, 'error': None}
+    start = time.perf_counter()
+    try:
+        if cancel is not None and cancel.is_set():
+            raise InterruptedError('batch cancelled.')
+        with span('scan') as scan_span:
+            # current sizes and times: they are planned, checked before deleting originals, and used by auto sorting
+            pages = scan_pages(input_dirpath, scan_index, cancel, fresh=True)
+            scan_span.count(files=len(pages))
+        report['files'] = len(pages)
+        report['bytes'] = sum(page.size or 0 for page in pages)
+        options = get_root_options(settings, max_workers)
+        if settings['sessions']:
+            sessions = process_sessions(pages, input_dirpath, output_dirpath, settings['pattern'],
+                                        cancel=cancel, pdf=bool(settings['pdf']), progress=progress, **options)
+            report['sessions'] = sessions
+            report['duplicates'] = sum(session['duplicates'] for session in sessions)
+            failed = [session for session in sessions if session['status'] != 'ok']
+            if failed:
+                report.update(status='failed', error=f'{len(failed)} of {len(sessions)} sessions failed.')
+        else:
+            pdf_filepath = settings['pdf'] or None
+            if pdf_filepath is True:  # named after the input root
+                pdf_filepath = path.join(output_dirpath, path.basename(path.normpath(input_dirpath)) + '.pdf')
+            plan = process_pages(pages, output_dirpath, settings['pattern'], cancel=cancel,
+                                 pdf_filepath=pdf_filepath, progress=progress, **options)
+            if plan:
+                report['duplicates'] = sum(1 for entry in plan['files'] if entry['duplicate_of'])
+    except InterruptedError as e:
+        report.update(status='cancelled', error=str(e))
+    except (OSError, ValueError, IndexError, KeyError) as e:
+        logger.error('%s failed: %s', input_dirpath, e)
+        report.update(status='failed', error=str(e))
+    report['duration'] = time.perf_counter() - start
+    return report
+
+
+def run_batch(roots, max_roots=DEFAULT_MAX_ROOTS, io_workers=DEFAULT_IO_WORKERS, scan_index=None, cancel=None):
+    """
+    process many input roots in one go, several at a time.
+    Each root is scanned once, and a failing root does not stop the others.
+    Roots sharing an input or output directory run one after the other, in order.
+
+    :param roots: list of root settings, as given by load_batch.
+    :param max_roots: number of roots processed concurrently.
+    :param io_workers: number of files copied concurrently, shared between running roots.
+    :param scan_index: ScanIndex shared by all roots (optional).
+    :param cancel: threading.Event, once set, roots not done are cancelled (optional).
+    :return: summary dict: totals, and a report per root (see process_root).
+    """
+    groups = group_overlapping(roots)
+    max_roots = max(1, min(max_roots, len(groups)))
+    max_workers = max(1, io_workers // max_roots)
+    scan_index = scan_index or ScanIndex(default_matcher())
+    start = time.perf_counter()
+
+    def process_group(group):
+        return [(i, process_root(roots[i], max_workers, scan_index, cancel)) for i in group]
+
+    with ThreadPoolExecutor(max_workers=max_roots) as executor:
+        reports = dict(item for items in executor.map(process_group, groups) for item in items)
+    reports = [reports[i] for i in range(len(roots))]
+    totals = {
+        'roots': len(reports),
+        'ok': sum(1 for report in reports if report['status'] == 'ok'),
+        'failed': sum(1 for report in reports if report['status'] == 'failed'),
+        'cancelled': sum(1 for report in reports if report['status'] == 'cancelled'),
+        'files': sum(report['files'] for report in reports),
+        'bytes': sum(report['bytes'] for report in reports),
+        'duplicates': sum(report['duplicates'] for report in reports),
+    }
+    return {'totals': totals, 'duration': time.perf_counter() - start, 'roots': reports}
+
+
+def batch_main(batch_filepath, summary_filepath=None, defaults=None, max_roots=DEFAULT_MAX_ROOTS,
+               io_workers=DEFAULT_IO_WORKERS):
+    """
+    run a batch file, and write its summary as json (to stdout if no summary_filepath).
+    :return: process exit code: 0 if every root succeeded, 1 otherwise.
+    """
+    roots = load_batch(batch_filepath, defaults)
+    scan_index = ScanIndex(default_matcher(), default_cache_filepath())
+    scan_index.load()
+    summary = run_batch(roots, max_roots, io_workers, scan_index)
+    try:
+        scan_index.save()
+    except OSError as e:
+        logger.warning(f'unable to save scan index: {e}')
+    if summary_filepath:
+        with open(summary_filepath, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+    else:
+        json.dump(summary, sys.stdout, indent=2)
+        print()
+    return 0 if summary['totals']['ok'] == summary['totals']['roots'] else 1
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf8
+"""
+benchmark debɹother pipeline steps on synthetic Brother scan trees.
+
+    python3 benchmark.py --files 100 10000 --json bench.json
+    python3 benchmark.py --files 100 10000 --baseline bench_baseline.json
+"""
+
+import argparse
+import os
+import os.path as path
+import sys
+import json
+import time
+import random
+import platform
+import tempfile
+from core import populate_pages, sort_policy, get_output_filepaths, rename_files
+from naming import default_matcher
+from scanindex import ScanIndex
+
+# default relative slow down tolerated before a run is considered a regression
+DEFAULT_TOLERANCE = 0.25
+
+
+def generate_scan_tree(root_dirpath, nb_files, file_size=1024, nb_sessions=4, nb_dirs=2, seed=0):
+    """
+    create a tree of files named like a Brother scanner does, with several duplex sessions spread in sub directories:
+        root/dir_0/Numérisation_20190412.jpg
+        root/dir_0/Numérisation_20190412 (2).jpg
+        root/dir_0/Numérisation_20190412_2.jpg
+        ...
+
+    :param root_dirpath: where to create the tree.
+    :param nb_files: total number of files (rounded down to an even number per session).
+    :param file_size: size of each file in bytes.
+    :param nb_sessions: number of scan sessions (distinct dates).
+    :param nb_dirs: number of nested directories sessions are spread in.
+    :param seed: random seed, for file contents: every file gets its own content (as scanned pages do),
+        the same for the same seed.
+    :return: list of created file paths.
+    """
+    rng = random.Random(seed)
+    nb_sheets = max(1, nb_files // (2 * nb_sessions))
+    filepaths = []
+    for session in range(nb_sessions):
+        dirpath = path.join(root_dirpath, *[f'dir_{d}' for d in range(session % (nb_dirs + 1))])
+        os.makedirs(dirpath, exist_ok=True)
+        base = f'Numérisation_201904{session + 1:02d}'
+        for sheet in range(1, nb_sheets + 1):
+            number = '' if sheet == 1 else f'_{sheet}'
+            for suffix in ['', ' (2)']:
+                filepath = path.join(dirpath, f'{base}{number}{suffix}.jpg')
+                with open(filepath, 'wb') as f:
+                    f.write(rng.randbytes(file_size))
+                filepaths.append(filepath)
+    return filepaths
+
+
+def timed(func, *args, repeat=1, **kwargs):
+    """
+    :return: (best duration in seconds over repeat runs, result of the last run)
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best, result
+
+
+def run_benchmark(nb_files, file_size=1024, nb_sessions=4, repeat=3):
+    """
+    time each step of the pipeline on a fresh synthetic tree.
+    :return: dict step name -> best duration in seconds.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dirpath:
+        input_dirpath = path.join(tmp_dirpath, 'input')
+        generate_scan_tree(input_dirpath, nb_files, file_size, nb_sessions)
+        # like an old share: directories are too old to be considered still changing by the scan index
+        old = time.time() - 3600
+        for dirpath, _, _ in os.walk(input_dirpath):
+            os.utime(dirpath, (old, old))
+
+        results['populate_pages'], filepaths = timed(populate_pages, input_dirpath, repeat=repeat)
+        scan_index = ScanIndex(default_matcher())
+        populate_pages(input_dirpath, scan_index)
+        results['populate_pages_indexed'], _ = timed(populate_pages, input_dirpath, scan_index, repeat=repeat)
+        results['sort_policy'], filepaths = timed(sort_policy, filepaths, True, True, True, repeat=repeat)
+        output_dirpath = path.join(tmp_dirpath, 'output')
+        os.makedirs(output_dirpath)
+        results['get_output_filepaths'], output_filepaths = timed(
+            get_output_filepaths, filepaths, output_dirpath, '{page:06d}.{ext}', repeat=repeat)
+        # files can only be renamed once
+        results['rename_files'], _ = timed(rename_files, filepaths, output_filepaths)
+    return results
+
+
+def find_regressions(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    :param results: dict nb_files -> {step: duration}
+    :param baseline: same structure, reference durations.
+    :return: list of (nb_files, step, duration, reference) slower than reference * (1 + tolerance).
+    """
+    regressions = []
+    for nb_files, steps in results.items():
+        for step, duration in steps.items():
+            reference = baseline.get(nb_files, {}).get(step)
+            if reference is not None and duration > reference * (1 + tolerance):
+                regressions.append((nb_files, step, duration, reference))
+    return regressions
+
+
+def benchmark_main():
+    parser = argparse.ArgumentParser(description='benchmark debɹother on synthetic scan trees.')
+    parser.add_argument('--files', type=int, nargs='+', default=[10, 1000, 10000],
+                        help='number of files of each generated tree [10 1000 10000]')
+    parser.add_argument('--size', type=int, default=1024, help='size of each file in bytes [1024]')
+    parser.add_argument('--sessions', type=int, default=4, help='number of scan sessions [4]')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per step, best is kept [3]')
+    parser.add_argument('--json', help='write results to this json file (default: stdout)')
+    parser.add_argument('--baseline', help='json results to compare with: fails on regression')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help=f'relative slow down tolerated against baseline [{DEFAULT_TOLERANCE}]')
+    args = parser.parse_args()
+
+    results = {str(nb_files): run_benchmark(nb_files, args.size, args.sessions, args.repeat)
+               for nb_files in args.files}
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'file_size': args.size,
+        'sessions': args.sessions,
+        'results': results,
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for nb_files, step, duration, reference in regressions:
+            print(f'regression: {step} on {nb_files} files: {duration:.4f}s (baseline {reference:.4f}s)',
+                  file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(benchmark_main())
@@ -0,0 +1,175 @@
+import os
+import os.path as path
+import json
+import threading
+import multiprocessing
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from config import default_cache_dirpath
+
+logger = logging.getLogger(__name__)
+
+# process pool shared by every score_pages call (see get_executor)
+_executor = None
+_executor_workers = None
+_executor_lock = threading.Lock()
+
+BLANK_CACHE_VERSION = 1
+# pages are decoded at reduced resolution: the jpeg decoder skips the finer DCT scales (draft mode)
+DRAFT_SIZE = (256, 256)
+# a gray level below that is ink (0: black, 255: white)
+INK_LEVEL = 160
+# a page with less ink than that (ratio of pixels) is blank
+DEFAULT_BLANK_THRESHOLD = 0.002
+# files scored per task sent to a worker process
+CHUNK_SIZE = 8
+
+
+def default_cache_filepath():
+    """
+    :return: path of the blank score cache file ($XDG_CACHE_HOME/debrother/blankscores.json)
+    """
+    return path.join(default_cache_dirpath(), 'blankscores.json')
+
+
+def ink_ratio(filepath):
+    """
+    score a page for blankness, decoding the jpeg at reduced resolution only.
+    :param filepath: path to an image file.
+    :return: ratio of ink pixels, from 0. (blank) to 1.
+    """
+    from PIL import Image
+    with Image.open(filepath) as image:
+        image.draft('L', DRAFT_SIZE)
+        image = image.convert('L')
+        histogram = image.histogram()
+    total = sum(histogram)
+    return sum(histogram[:INK_LEVEL]) / total if total else 0.
+
+
+class BlankCache:
+    """
+    ink ratio of already scored files, keyed by path, and only valid while the file size and mtime
+    do not change. Can be persisted in a small json cache file.
+    """
+    def __init__(self, cache_filepath=None):
+        self._cache_filepath = cache_filepath
+        self._scores = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        if not self._cache_filepath or not path.isfile(self._cache_filepath):
+            return
+        try:
+            with open(self._cache_filepath, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f'ignoring invalid blank score cache {self._cache_filepath}: {e}')
+            return
+        if data.get('version') != BLANK_CACHE_VERSION or data.get('ink_level') != INK_LEVEL:
+            logger.info(f'ignoring outdated blank score cache {self._cache_filepath}')
+            return
+        self._scores = data.get('scores', {})
+
+    def save(self):
+        if not self._cache_filepath:
+            return
+        with self._lock:
+            # forget files that are gone
+            scores = {k: v for k, v in self._scores.items() if path.exists(k)}
+        data = {'version': BLANK_CACHE_VERSION, 'ink_level': INK_LEVEL, 'scores': scores}
+        os.makedirs(path.dirname(self._cache_filepath) or '.', exist_ok=True)
+        tmp_filepath = self._cache_filepath + '.tmp'
+        with open(tmp_filepath, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_filepath, self._cache_filepath)
+
+    def get(self, filepath, st):
+        """
+        :param st: os.stat_result of filepath.
+        :return: cached score, or None if unknown or outdated.
+        """
+        entry = self._scores.get(path.abspath(filepath))
+        if entry is not None and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+            return entry[2]
+        return None
+
+    def set(self, filepath, st, score):
+        with self._lock:
+            self._scores[path.abspath(filepath)] = [st.st_size, st.st_mtime_ns, score]
+
+
+def _score_chunk(filepaths):
+    return [ink_ratio(filepath) for filepath in filepaths]
+
+
+def get_executor(max_workers=None):
+    """
+    :param max_workers: number of worker processes (default: number of CPUs).
+    :return: the process pool scoring pages, created on first use, then reused (until max_workers changes).
+        Workers are spawned, not forked: forking a process running threads (eg. the GUI) may deadlock the child.
+    """
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers != max_workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+            _executor_workers = max_workers
+        return _executor
+
+
+def shutdown_executor():
+    """
+    stop the worker processes, if any (a later score_pages starts new ones).
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def score_pages(filepaths, cache=None, max_workers=None, cancel=None):
+    """
+    ink ratio of each file: cached ones are reused, others are scored in the process pool (see get_executor).
+
+    :param filepaths: list of image file paths.
+    :param cache: BlankCache (optional).
+    :param max_workers: number of worker processes (default: number of CPUs).
+    :param cancel: threading.Event, once set, scoring stops with InterruptedError (optional).
+    :return: list of scores, in the same order as filepaths.
+    """
+    cache = cache or BlankCache()
+    stats = [os.stat(f) for f in filepaths]
+    scores = [cache.get(f, st) for f, st in zip(filepaths, stats)]
+    todo = [i for i, score in enumerate(scores) if score is None]
+    logger.debug('blank pages: %d cached, %d to score.', len(filepaths) - len(todo), len(todo))
+    if not todo:
+        return scores
+    chunks = [todo[i:i + CHUNK_SIZE] for i in range(0, len(todo), CHUNK_SIZE)]
+    executor = get_executor(max_workers)
+    futures = [executor.submit(_score_chunk, [filepaths[i] for i in chunk]) for chunk in chunks]
+    try:
+        for chunk, future in zip(chunks, futures):
+            for i, score in zip(chunk, future.result()):
+                scores[i] = score
+                cache.set(filepaths[i], stats[i], score)
+            if cancel is not None and cancel.is_set():
+                raise InterruptedError('blank page detection cancelled.')
+    except BrokenProcessPool:  # a worker died: start a new pool next time
+        shutdown_executor()
+        raise
+    finally:  # the pool is shared: only drop the tasks of this call
+        for future in futures:
+            future.cancel()
+    return scores
+
+
+def find_blank_pages(filepaths, threshold=DEFAULT_BLANK_THRESHOLD, cache=None, max_workers=None, cancel=None):
+    """
+    :return: set of indices (in filepaths) of blank pages.
+    """
+    scores = score_pages(filepaths, cache, max_workers, cancel)
+    return {i for i, score in enumerate(scores) if score < threshold}
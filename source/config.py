@@ -0,0 +1,94 @@
+import os
+import os.path as path
+import configparser
+import importlib.util
+import logging
+
+logger = logging.getLogger(__name__)
+
+# values used when debrother.ini does not set them (same as the GUI defaults)
+CONFIG_DEFAULTS = {
+    'input': './',
+    'output': './',
+    'pattern': '{page:03}',
+    'numbering': True,
+    'flip': True,
+    'reversed': True,
+    'auto': False,
+    'move': False,
+    'pdf': False,
+    'blank': False,
+    'duplicates': False,
+    'sessions': False,
+}
+
+
+def default_cache_dirpath():
+    """
+    :return: path of the cache directory ($XDG_CACHE_HOME/debrother, ~/.cache/debrother by default)
+    """
+    cache_dirpath = os.environ.get('XDG_CACHE_HOME') or path.join(path.expanduser('~'), '.cache')
+    return path.join(cache_dirpath, 'debrother')
+
+
+def is_pil_available():
+    """
+    :return: True if PIL can be imported (blank page detection and thumbnails need it).
+    """
+    return importlib.util.find_spec('PIL') is not None
+
+
+class Config:
+    def __init__(self, filepath, **kwargs):
+        self._filepath = filepath
+        self._data = kwargs
+        assert all(kw in kwargs for kw in ['input', 'output', 'pattern'])
+
+    def set_default(self):
+        self._data['input'].set('./')
+        self._data['output'].set('./')
+        self._data['pattern'].set('{page:03}')
+
+    def load(self):
+        logger.info(f'loading from {self._filepath}')
+        config = configparser.ConfigParser()
+        config.read(self._filepath)
+        for k in self._data:
+            value = config['DEFAULT'].get(k)
+            if value:
+                self._data[k].set(value)
+
+    def save(self):
+        logger.info(f'saving to {self._filepath}')
+        config = configparser.ConfigParser()
+        for k in self._data:
+            val = self._data[k].get()
+            config['DEFAULT'][k] = str(val)
+        with open(self._filepath, 'w') as configfile:
+            config.write(configfile)
+
+
+def read_config(filepath):
+    """
+    read the options saved by the GUI, without tkinter.
+    :param filepath: path to debrother.ini (missing file or keys fall back to CONFIG_DEFAULTS).
+    :return: dict key -> value, flags as bool.
+    """
+    options = dict(CONFIG_DEFAULTS)
+    if not path.isfile(filepath):
+        return options
+    config = configparser.ConfigParser()
+    config.read(filepath)
+    section = config['DEFAULT']
+    for k, default in CONFIG_DEFAULTS.items():
+        value = section.get(k)
+        if not value:
+            continue
+        if isinstance(default, bool):
+            try:  # the GUI saves checkboxes as 0/1
+                options[k] = bool(int(value))
+            except ValueError:
+                options[k] = section.getboolean(k)
+        else:
+            options[k] = value
+    return options
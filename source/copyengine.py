@@ -0,0 +1,186 @@
+import os
+import sys
+import time
+import threading
+import hashlib
+import logging
+from shutil import copyfileobj
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
+
+try:
+    import fcntl
+except ImportError:  # not on windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = 4
+COPY_BUFSIZE = 1024 * 1024
+# linux ioctl to share extents between files (btrfs, xfs, ...), see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+# snapshot of a copy job, given to progress callbacks.
+CopyProgress = namedtuple('CopyProgress', ['files_done', 'files_total', 'bytes_done', 'bytes_total', 'elapsed'])
+
+
+def throughput(progress):
+    """
+    :param progress: CopyProgress
+    :return: bytes per second (0 if nothing measured yet).
+    """
+    return progress.bytes_done / progress.elapsed if progress.elapsed > 0 else 0
+
+
+def _reflink(fd_in, fd_out, size):
+    fcntl.ioctl(fd_out, FICLONE, fd_in)
+
+
+def _copy_file_range(fd_in, fd_out, size):
+    while os.copy_file_range(fd_in, fd_out, COPY_BUFSIZE * 64):
+        pass
+
+
+def _sendfile(fd_in, fd_out, size):
+    offset = 0
+    while True:
+        sent = os.sendfile(fd_out, fd_in, offset, COPY_BUFSIZE * 64)
+        if not sent:
+            break
+        offset += sent
+
+
+def _kernel_copy_methods():
+    """
+    :return: list of the kernel side copy methods available on this platform, fastest first.
+    """
+    methods = []
+    if fcntl is not None and sys.platform.startswith('linux'):
+        methods.append(_reflink)
+    if hasattr(os, 'copy_file_range'):
+        methods.append(_copy_file_range)
+    if hasattr(os, 'sendfile') and sys.platform.startswith('linux'):
+        methods.append(_sendfile)
+    return methods
+
+
+KERNEL_COPY_METHODS = _kernel_copy_methods()
+
+
+def copy_file(src, dst):
+    """
+    copy file content from src to dst, using reflink, copy_file_range or sendfile when available,
+    so bytes do not go through python. Falls back to a buffered copy.
+    :param src: source file path
+    :param dst: destination file path (overwritten)
+    :return: number of bytes copied
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        fd_in, fd_out = fsrc.fileno(), fdst.fileno()
+        size = os.fstat(fd_in).st_size
+        for method in KERNEL_COPY_METHODS:
+            try:
+                method(fd_in, fd_out, size)
+                return size
+            except OSError:
+                # not supported by this file system (or failed halfway): start over with the next one
+                os.lseek(fd_in, 0, os.SEEK_SET)
+                os.lseek(fd_out, 0, os.SEEK_SET)
+                os.ftruncate(fd_out, 0)
+        copyfileobj(fsrc, fdst, COPY_BUFSIZE)
+    return size
+
+
+def copy_file_hashed(src, dst, algorithm='sha256'):
+    """
+    copy file content from src to dst, and compute its hash in the same read pass.
+    :param src: source file path
+    :param dst: destination file path (overwritten)
+    :param algorithm: hashlib algorithm name.
+    :return: (number of bytes copied, hex digest)
+    """
+    digest = hashlib.new(algorithm)
+    buffer = bytearray(COPY_BUFSIZE)
+    view = memoryview(buffer)
+    size = 0
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        while True:
+            n = fsrc.readinto(buffer)
+            if not n:
+                break
+            digest.update(view[:n])
+            fdst.write(view[:n])
+            size += n
+    return size, digest.hexdigest()
+
+
+def copy_files(jobs, max_workers=DEFAULT_MAX_WORKERS, progress=None, on_done=None, keep_done=False, cancel=None,
+               checksum=None):
+    """
+    copy files on a bounded pool of worker threads.
+    All or nothing: if any copy fails, pending copies are cancelled,
+    every destination already written is removed, and the error is raised.
+
+    :param jobs: list of (source, destination) file paths.
+    :param max_workers: maximum number of concurrent copies.
+    :param progress: callable(CopyProgress), called (from worker threads) after each file.
+    :param on_done: callable(job_index, digest), called (from worker threads, one at a time) after each file.
+    :param keep_done: on failure, only remove partially written destinations, keep complete ones.
+    :param cancel: threading.Event, once set, remaining copies fail with InterruptedError (optional).
+    :param checksum: hashlib algorithm name: hash contents while copying (kernel side copies are not used then).
+        Otherwise, digest given to on_done is None.
+    :return: CopyProgress of the whole job.
+    """
+    jobs = list(jobs)
+    bytes_total = sum(os.stat(src).st_size for src, _ in jobs)
+    lock = threading.Lock()
+    started = []
+    finished = set()
+    state = {'files_done': 0, 'bytes_done': 0}
+    start_time = time.perf_counter()
+
+    def snapshot():
+        return CopyProgress(state['files_done'], len(jobs), state['bytes_done'], bytes_total,
+                            time.perf_counter() - start_time)
+
+    def copy_one(index, src, dst):
+        if cancel is not None and cancel.is_set():
+            raise InterruptedError('copy cancelled.')
+        with lock:
+            started.append(dst)
+        if checksum:
+            size, digest = copy_file_hashed(src, dst, checksum)
+        else:
+            size, digest = copy_file(src, dst), None
+        with lock:
+            if on_done:
+                on_done(index, digest)
+            finished.add(dst)
+            state['files_done'] += 1
+            state['bytes_done'] += size
+            current = snapshot()
+        if progress:
+            progress(current)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+    try:
+        futures = [executor.submit(copy_one, i, src, dst) for i, (src, dst) in enumerate(jobs)]
+        done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+        failed = [f for f in done if f.exception() is not None]
+        if failed:
+            executor.shutdown(wait=True, cancel_futures=True)
+            for dst in started:
+                if keep_done and dst in finished:
+                    continue
+                try:
+                    os.remove(dst)
+                except OSError:
+                    pass
+            raise failed[0].exception()
+    finally:
+        executor.shutdown(wait=True)
+
+    result = snapshot()
+    logger.info(f'copied {result.files_done} files ({result.bytes_done / 1e6:.1f} MB) '
+                f'in {result.elapsed:.2f}s: {throughput(result) / 1e6:.1f} MB/s')
+    return result
@@ -1,15 +1,69 @@
 import os
 import os.path as path
 import re
-import tempfile
-from shutil import copyfile, move
 import logging
 import datetime
+import string
+import functools
+import time
+import json
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from scanindex import ScanIndex
+from naming import NAMING_PROFILES, default_matcher
+from copyengine import copy_files, DEFAULT_MAX_WORKERS
+from renameplan import same_filesystem, plan_renames, apply_renames, revert_renames
+from staging import Staging, RenameJournal, recover_staging, get_staging_root
+from pdfwriter import write_pdf
+from profiling import span
+from duplicates import find_duplicates
+from blankpage import BlankCache, find_blank_pages, default_cache_filepath as default_blank_cache_filepath
+from manifest import MANIFEST_FILENAME, SOURCES_FILENAME, CHECKSUM_ALGORITHM, hash_file, hash_files, \
+    make_manifest_entry, update_manifest, load_sources, update_sources
 
-windows_scan_naming_convention = re.compile(r'(?P<base>.+_(\d){8})(_(?P<page>\d+))?(\s\((?P<batch>\d+)\))?\.\w+$')
+# Brother naming profile only, scans match all profiles given by naming.default_matcher()
+windows_scan_naming_convention = re.compile(NAMING_PROFILES[0].pattern)
 
+# a scanned page, with the fields parsed from its file name:
+#  - base: the scan session prefix (eg. 'Numérisation_20190412'),
+#  - page: the page number in the batch (the scanner omits 1),
+#  - batch: the batch number (the scanner appends ' (2)' to the verso batch),
+# and, when known from the directory scan, its size and mtime (in ns).
+Page = namedtuple('Page', ['filepath', 'base', 'page', 'batch', 'size', 'mtime'], defaults=(None, None))
 
-def populate_pages(input_dirpath):
+# number of scan sessions processed concurrently by rectoverso_sessions
+DEFAULT_MAX_SESSIONS = 2
+
+# version of the plans written by save_plan
+PLAN_VERSION = 1
+
+# sorting strategy value: infer flip and backward verso from file modification times
+AUTO_SORTING = 'auto'
+
+
+def make_page(filepath, groups, size=None, mtime=None):
+    """
+    :param filepath: full path to the file.
+    :param groups: fields given by NamingMatcher.match (or None if no match).
+    :param size: file size in bytes (optional).
+    :param mtime: file modification time in ns (optional).
+    :return: Page
+    """
+    groups = groups or {}
+    return Page(filepath, groups.get('base'), int(groups.get('page') or 1), int(groups.get('batch') or 1),
+                size, mtime)
+
+
+def parse_page(filepath):
+    """
+    parse file name once, using the naming profiles.
+    :param filepath: full path to the file.
+    :return: Page
+    """
+    return make_page(filepath, default_matcher().match(path.basename(filepath)))
+
+
+def populate_pages(input_dirpath, scan_index=None):
     """
     input_dirpath:
         Numérisation_20190412 (2).jpg
@@ -21,13 +75,27 @@ def populate_pages(input_dirpath):
         ...
         Numérisation_20190412_1 (2).jpg
         Numérisation_20190412_1.jpg
+
+    :param input_dirpath: input root directory.
+    :param scan_index: ScanIndex to reuse between calls (optional), only changed directories are listed again.
+    :return: sorted list of scan file paths.
     """
-    file_list = [path.join(p, filename)
-                 for p, sd, fs in os.walk(input_dirpath)
-                 for filename in fs
-                 if windows_scan_naming_convention.match(filename)]
+    return [page.filepath for page in scan_pages(input_dirpath, scan_index)]
 
-    return sorted(file_list)
+
+def scan_pages(input_dirpath, scan_index=None, cancel=None, fresh=False):
+    """
+    same as populate_pages, but keep the fields parsed from file names.
+    :param input_dirpath: input root directory.
+    :param scan_index: ScanIndex to reuse between calls (optional).
+    :param cancel: threading.Event to interrupt the scan (optional).
+    :param fresh: stat every file again, instead of using sizes and times of the index (see ScanIndex.scan).
+    :return: list of Page, sorted by file path.
+    """
+    if scan_index is None:
+        scan_index = ScanIndex(default_matcher())
+    pages = [make_page(*record) for record in scan_index.scan(input_dirpath, cancel, fresh)]
+    return sorted(pages, key=lambda p: p.filepath)
 
 
 def sort_lexicographical(file_list):
@@ -44,12 +112,7 @@ def sort_brother_numbering(file_list):
     :param file_list:
     :return:
     """
-    brother_numbering_template = re.compile(r'_(?P<date>\d{8})(_(?P<num>\d+))?')
-
-    def get_brother_number(filepath):
-        return int(brother_numbering_template.search(filepath).groupdict()['num'] or '1')
-
-    return sorted(file_list, key=get_brother_number)
+    return sorted(file_list, key=lambda filepath: parse_page(filepath).page)
 
 
 def sort_flip_recto_verso(file_list):
@@ -89,6 +152,43 @@ def sort_backward_verso(file_list):
     return reorderd_list
 
 
+def detect_recto_verso(pages):
+    """
+    infer sort_flip_recto_verso and sort_backward_verso from the file modification times,
+    the scanner writing files in physical scan order:
+     - batches scanned one after the other (the stack was turned over): the first scanned batch is recto,
+       and the verso batch is backward.
+     - recto and verso of each sheet scanned in a row (duplex feeder): the first of each pair is recto,
+       and versos are in order.
+
+    :param pages: list of Page, with mtime.
+    :return: (flip, backward) to use for sorting.
+    :raise ValueError: if times do not tell (missing, equal or mixed).
+    """
+    batches = {}
+    for page in pages:
+        if page.mtime is None:
+            raise ValueError('auto sorting needs file modification times.')
+        batches.setdefault(page.batch, []).append(page)
+    if sorted(batches) != [1, 2] or len(batches[1]) != len(batches[2]):
+        raise ValueError('auto sorting needs a recto and a verso batch of the same size.')
+    starts = {batch: min(p.mtime for p in batch_pages) for batch, batch_pages in batches.items()}
+    if starts[1] == starts[2]:
+        raise ValueError('scan times are ambiguous: both batches start at the same time.')
+    first, second = sorted(batches.values(), key=lambda b: starts[b[0].batch])
+    # after numbering, verso (batch 2) comes first in each pair: flip if recto is batch 1
+    flip = first[0].batch == 1
+    first_end, second_start = max(p.mtime for p in first), min(p.mtime for p in second)
+    if first_end < second_start:
+        return flip, True
+    by_time = sorted(pages, key=lambda p: p.mtime)
+    if all(a.mtime < b.mtime for a, b in zip(by_time, by_time[1:])) and \
+            all(a.batch == first[0].batch and (a.base, a.page) == (b.base, b.page)
+                for a, b in zip(by_time[::2], by_time[1::2])):
+        return flip, False
+    raise ValueError('scan times are ambiguous: choose flip and backward verso manually.')
+
+
 def sort_policy(filepaths, sorting_numbering, sorting_flip_recto_verso, sorting_backward_verso):
     """
     apply all sorting in the correct order.
@@ -98,77 +198,596 @@ def sort_policy(filepaths, sorting_numbering, sorting_flip_recto_verso, sorting_
     :param sorting_backward_verso: apply sort_backward_verso
     :return:
     """
-    filepaths = sort_lexicographical(filepaths)
+    pages = sort_pages([parse_page(filepath) for filepath in filepaths],
+                       sorting_numbering, sorting_flip_recto_verso, sorting_backward_verso)
+    return [page.filepath for page in pages]
+
+
+def sort_order(pages, sorting_numbering, sorting_flip_recto_verso, sorting_backward_verso):
+    """
+    turn the enabled sorting strategies into a single permutation, computed from parsed fields.
+    Gives the same order as sort_lexicographical, then sort_brother_numbering, sort_flip_recto_verso
+    and sort_backward_verso, with a single sort.
+    :param pages: list of Page
+    :param sorting_flip_recto_verso: bool or AUTO_SORTING.
+    :param sorting_backward_verso: bool or AUTO_SORTING.
+    :return: list of indices in pages, in the sorted order.
+    """
+    if pages and AUTO_SORTING in (sorting_flip_recto_verso, sorting_backward_verso):
+        flip, backward = detect_recto_verso(pages)
+        if sorting_flip_recto_verso == AUTO_SORTING:
+            sorting_flip_recto_verso = flip
+        if sorting_backward_verso == AUTO_SORTING:
+            sorting_backward_verso = backward
     if sorting_numbering:
-        filepaths = sort_brother_numbering(filepaths)
+        # lexicographical then (stable) numbering is the same as sorting on (number, path)
+        order = sorted(range(len(pages)), key=lambda i: (pages[i].page, pages[i].filepath))
+    else:
+        order = sorted(range(len(pages)), key=lambda i: pages[i].filepath)
+    # flip and backward are permutations of positions, they apply to indices as well.
     if sorting_flip_recto_verso:
-        filepaths = sort_flip_recto_verso(filepaths)
+        order = sort_flip_recto_verso(order)
     if sorting_backward_verso:
-        filepaths = sort_backward_verso(filepaths)
-    return filepaths
+        order = sort_backward_verso(order)
+    return order
+
+
+def sort_pages(pages, sorting_numbering, sorting_flip_recto_verso, sorting_backward_verso):
+    """
+    same as sort_policy, but on Page records.
+    :param pages: list of Page
+    :return: sorted list of Page
+    """
+    order = sort_order(pages, sorting_numbering, sorting_flip_recto_verso, sorting_backward_verso)
+    return [pages[i] for i in order]
+
+
+# how to compute each field available in output file name syntax, from (filepath, index, now)
+OUTPUT_PATTERN_FIELDS = {
+    'original': lambda filepath, index, now: filepath,
+    'index': lambda filepath, index, now: index,
+    'page': lambda filepath, index, now: index + 1,
+    'yyyy': lambda filepath, index, now: now.year,
+    'mm': lambda filepath, index, now: now.month,
+    'dd': lambda filepath, index, now: now.day,
+    'filename': lambda filepath, index, now: path.basename(filepath),
+    'basename': lambda filepath, index, now: path.splitext(path.basename(filepath))[0],
+    'ext': lambda filepath, index, now: path.splitext(filepath)[1][1:],
+}
+
+
+class OutputPattern:
+    """
+    output file name syntax, compiled once: it knows which fields it references,
+    and only computes those for each page.
+    Raises KeyError, IndexError or ValueError if the syntax is invalid.
+    """
+    def __init__(self, output_dirpath, output_pattern):
+        self.template = path.join(output_dirpath, output_pattern)
+        self.fields = set()
+        for _, field_name, _, _ in string.Formatter().parse(self.template):
+            if field_name is None:
+                continue
+            name = re.match(r'[^.\[]*', field_name).group()
+            if not name or name.isdigit():
+                raise IndexError('positional fields are not supported.')
+            if name not in OUTPUT_PATTERN_FIELDS:
+                raise KeyError(name)
+            self.fields.add(name)
+        self._getters = [(name, OUTPUT_PATTERN_FIELDS[name]) for name in sorted(self.fields)]
+        # invalid format specs only show up when formatting
+        self.render([path.join('sample', 'sample.png')])
+
+    def render(self, filepaths):
+        """
+        :param filepaths: sorted list of input file paths.
+        :return: list of output file paths.
+        """
+        now = datetime.datetime.now()
+        template, getters = self.template, self._getters
+        return [template.format(**{name: get(filepath, index, now) for name, get in getters})
+                for index, filepath in enumerate(filepaths)]
+
+
+@functools.lru_cache(maxsize=32)
+def compile_output_pattern(output_dirpath, output_pattern):
+    """
+    :return: OutputPattern, cached.
+    """
+    return OutputPattern(output_dirpath, output_pattern)
+
+
+def find_duplicate_outputs(output_filepaths):
+    """
+    find files that would be written to the same output (eg. a syntax without {page}).
+    :param output_filepaths: list of output file paths.
+    :return: dict output file path -> list of indices of inputs, for outputs used more than once.
+    """
+    indices = {}
+    for index, filepath in enumerate(output_filepaths):
+        indices.setdefault(path.normcase(filepath), []).append(index)
+    return {output_filepaths[ix[0]]: ix for ix in indices.values() if len(ix) > 1}
 
 
 def get_output_filepaths(filepaths, output_dirpath, output_pattern):
-    now = datetime.datetime.now()
-    input_infos_list = [{
-        'original': filepath,
-        'index': index,
-        'page': index+1,
-        'yyyy': now.year,
-        'mm': now.month,
-        'dd': now.day,
-        'filename': path.basename(filepath),
-        'basename': path.splitext(path.basename(filepath))[0],
-        'ext': path.splitext(path.basename(filepath))[1][1:],
-    } for index, filepath in enumerate(filepaths)]
-    output_filepath = path.join(output_dirpath, output_pattern)
-    return [output_filepath.format(**infos) for infos in input_infos_list]
-
-
-def rename_files(input_filepaths, output_filepaths, delete_after_success=False):
+    return compile_output_pattern(output_dirpath, output_pattern).render(filepaths)
+
+
+def rename_files(input_filepaths, output_filepaths, delete_after_success=False,
+                 max_workers=DEFAULT_MAX_WORKERS, progress=None, cancel=None, checksum=False):
+    """
+    :param input_filepaths: list of source file paths.
+    :param output_filepaths: list of destination file paths (same length).
+    :param delete_after_success: remove input files once everything is in place.
+        If inputs and outputs are on the same file system, files are only renamed (no data copy).
+    :param max_workers: maximum number of concurrent copies.
+    :param progress: callable(CopyProgress), called after each copied file (see copyengine.copy_files).
+    :param cancel: threading.Event, once set, the copy stops and raises InterruptedError (optional).
+        Pages already copied are kept in the staging directory, a later run of the same job resumes.
+    :param checksum: hash contents in the same read pass as the copy, and write them in a manifest
+        (debrother-manifest.json) next to the outputs (see manifest.verify_manifest).
+        Files only renamed are hashed before being renamed. With delete_after_success, inputs are deleted
+        only if they did not change since their copy (same size and mtime), and their outputs still hash
+        to the digest computed during the copy.
+    """
     assert len(input_filepaths) == len(output_filepaths)
-    # - copy into a temp location
-    # - move to actual location
+    duplicates = find_duplicate_outputs(output_filepaths)
+    if duplicates:
+        raise ValueError('{} output files would be overwritten, eg. {}'.format(
+            sum(len(ix) - 1 for ix in duplicates.values()), next(iter(duplicates))))
+    if delete_after_success and same_filesystem(input_filepaths, output_filepaths):
+        # inplace: a rename plan is enough, no need to copy
+        logging.debug('same file system: renaming in place')
+        if checksum:  # nothing is read by a rename: hash contents before
+            with span('hash', files=len(input_filepaths)):
+                digests = hash_files(input_filepaths, max_workers)
+        # journaled, so that a killed job is reverted by the next one on the same output
+        root_dirpath = get_staging_root(output_filepaths)
+        recover_staging(root_dirpath)
+        renames = plan_renames(input_filepaths, output_filepaths)
+        journal = RenameJournal(root_dirpath, renames)
+        journal.open()
+        try:
+            with span('rename', files=len(input_filepaths)):
+                apply_renames(renames, on_done=journal.mark_renamed)
+            journal.close()
+        except BaseException as e:
+            # nothing left to revert, unless the roll back of apply_renames failed
+            revert_renames(renames, journal.nb_done)
+            journal.close()
+            if isinstance(e, OSError):
+                raise FileNotFoundError('failed to rename one or more files.')
+            raise
+        finally:
+            journal.release()
+        if checksum:
+            with span('manifest', files=len(output_filepaths)):
+                entries = [make_manifest_entry(src, dst, digest)
+                           for src, dst, digest in zip(input_filepaths, output_filepaths, digests)]
+                update_manifest(path.join(root_dirpath, MANIFEST_FILENAME), entries)
+        return
+
+    # - copy into a hidden staging directory, on the output file system
+    # - rename to actual location
     # - delete input (if requested)
     # - if errors: roll back
+    # every completed step is journaled: an interrupted job is resumed (or rolled back) by the next run.
+    staging = Staging(input_filepaths, output_filepaths, delete_after_success)
+    recover_staging(staging.root_dirpath, keep=path.basename(staging.dirpath))
+    copied = staging.open()
+    try:
+        if staging.step == 'copy':
+            try:  # copy into the staging location
+                logging.debug('creating temp files in %s', staging.dirpath)
+                todo = [i for i in range(len(input_filepaths)) if i not in copied]
+                stats = {}
+                if checksum:  # originals must not change between their copy and their deletion
+                    for i in todo:
+                        st = os.stat(input_filepaths[i])
+                        stats[i] = [st.st_size, st.st_mtime_ns]
+                with span('copy', files=len(todo)) as copy_span:
+                    copied_progress = copy_files([(input_filepaths[i], staging.tmp_filepaths[i]) for i in todo],
+                                                 max_workers=max_workers, progress=progress,
+                                                 on_done=lambda k, digest: staging.mark_copied(todo[k], digest,
+                                                                                               stats.get(todo[k])),
+                                                 keep_done=True, cancel=cancel,
+                                                 checksum=CHECKSUM_ALGORITHM if checksum else None)
+                    copy_span.count(bytes=copied_progress.bytes_done)
+            except InterruptedError:
+                logging.warning('copy cancelled')
+                raise
+            except Exception:
+                logging.critical('failed to read one or more files')
+                raise FileNotFoundError('failed to read one or more files.')
+
+        if staging.step != 'published':
+            try:  # rename to actual location
+                logging.debug('moving to actual locations')
+                with span('move', files=len(output_filepaths)):
+                    staging.commit()
+            except OSError:
+                logging.critical('failed to create one or more files: roll back actually moved')
+                raise FileNotFoundError('failed to create one or more files.')
 
-    with tempfile.TemporaryDirectory() as tmp_dirname:
-        jobs = [
-            (
-                source,
-                dest,
-                path.join(tmp_dirname, '{:05d}.{}'.format(i, path.splitext(dest)[1]))
-            )
-            for i, (source, dest) in enumerate(zip(input_filepaths, output_filepaths))
-        ]
-
-        try:  # copy into a temp location
-            logging.debug('creating temp files in {}'.format(tmp_dirname))
-            for src, dst, tmp in jobs:
-                logging.debug('copy:\n\tfrom: {i}\n\tto  : {o}'.format(i=src, o=tmp))
-                copyfile(src, tmp)
-
-        except:
-            logging.critical('failed to read one or more files')
-            raise FileNotFoundError('failed to read one or more files.')
-
-        try:  # move to actual location
-            actually_moved = []
-            logging.debug('moving to actual locations')
-            for src, dst, tmp in jobs:
-                logging.debug('move:\n\tfrom: {i}\n\tto  : {o}'.format(i=tmp, o=dst))
-                move(tmp, dst)
-                actually_moved.append(dst)
-        except:
-            logging.critical('failed to create one or more files: roll back actually moved')
-            for f in actually_moved:
-                os.remove(f)
-            raise FileNotFoundError('failed to create one or more files.')
+        if checksum:
+            with span('manifest', files=len(output_filepaths)):
+                digests = [staging.digests.get(i) for i in range(len(output_filepaths))]
+                # copied by an earlier run without checksum: hash the copy
+                unhashed = [i for i, digest in enumerate(digests) if digest is None]
+                for i, digest in zip(unhashed, hash_files([output_filepaths[i] for i in unhashed], max_workers)):
+                    digests[i] = digest
+                entries = [make_manifest_entry(src, dst, digest)
+                           for src, dst, digest in zip(input_filepaths, output_filepaths, digests)]
+                update_manifest(path.join(staging.root_dirpath, MANIFEST_FILENAME), entries)
+            if delete_after_success:
+                with span('verify', files=len(input_filepaths)):
+                    # originals did not change since they were copied (same size and mtime), and copies still
+                    # hash to the digest of the copy: only copies are read again
+                    mismatches, to_hash = [], []
+                    for i, src in enumerate(input_filepaths):
+                        try:
+                            st = os.stat(src)
+                        except FileNotFoundError:  # deleted by an interrupted run, once verified
+                            continue
+                        if digests[i] != staging.digests.get(i) or \
+                                staging.source_stats.get(i) != [st.st_size, st.st_mtime_ns]:
+                            mismatches.append(src)  # not copied with a checksum, or changed since
+                        else:
+                            to_hash.append(i)
+                    mismatches += [input_filepaths[i] for i, digest in
+                                   zip(to_hash, hash_files([output_filepaths[i] for i in to_hash], max_workers))
+                                   if digest != digests[i]]
+                if mismatches:
+                    staging.close()
+                    raise FileNotFoundError(f'{len(mismatches)} copies do not match originals, eg. {mismatches[0]}: '
+                                            'originals are kept.')
 
         if delete_after_success:
-            for src, dst, tmp in jobs:
-                logging.debug('delete:\n\t{i}'.format(i=src))
-                move(src, tmp)
+            with span('delete', files=len(input_filepaths)):
+                staging.delete_sources()
+        staging.close()
+    finally:  # on failure, the staging directory is kept (unlocked) for a later run to resume
+        staging.release()
+
+
+def detect_blank_pages(filepaths, cache=None, max_workers=None, cancel=None):
+    """
+    :param filepaths: list of image file paths.
+    :param cache: BlankCache (default: the one in user cache directory).
+    :return: set of indices (in filepaths) of blank pages.
+    """
+    if cache is None:
+        cache = BlankCache(default_blank_cache_filepath())
+        cache.load()
+    with span('blank', files=len(filepaths)) as blank_span:
+        blanks = find_blank_pages(filepaths, cache=cache, max_workers=max_workers, cancel=cancel)
+        blank_span.count(skipped=len(blanks))
+    try:
+        cache.save()
+    except OSError as e:
+        logging.warning('unable to save blank score cache: %s', e)
+    logging.info('blank pages skipped: %d.', len(blanks))
+    return blanks
+
+
+def detect_duplicate_pages(pages, max_workers=None, cancel=None):
+    """
+    :param pages: list of Page.
+    :return: dict index (in pages) of a duplicate page -> index of the page it is a copy of.
+    """
+    sizes = None if any(page.size is None for page in pages) else [page.size for page in pages]
+    with span('duplicates', files=len(pages)) as duplicates_span:
+        duplicates = find_duplicates([page.filepath for page in pages], sizes,
+                                     max_workers=max_workers or DEFAULT_MAX_WORKERS, cancel=cancel)
+        duplicates_span.count(duplicates=len(duplicates))
+    for i, original in sorted(duplicates.items()):
+        logging.warning('duplicate page: %s is a copy of %s.', pages[i].filepath, pages[original].filepath)
+    return duplicates
+
+
+def make_plan(pages,
+              input_dirpath,
+              output_dirpath,
+              output_filepattern,
+              sorting_brother=True,
+              sort_windows=True,
+              sort_reversed=True,
+              delete_after_success=False,
+              pdf_filepath=None,
+              skip_blank=False,
+              sessions=False,
+              skip_duplicates=False,
+              blank_cache=None,
+              cancel=None):
+    """
+    decide where every page goes, without touching any file.
+    The plan is plain data (see save_plan): it can be reviewed, stored, and applied later with apply_plan,
+    possibly on another host, as paths are kept relative to input and output roots.
+
+    :param pages: list of Page, as given by scan_pages(input_dirpath).
+    :param input_dirpath: input root directory.
+    :param output_dirpath: output root directory.
+    :param output_filepattern: output file name syntax.
+    :param pdf_filepath: write pages into this pdf, instead of renamed files.
+        With sessions, any true value writes one pdf per session (see get_session_output).
+    :param sessions: sort and number each scan session on its own (see split_sessions).
+        A session that cannot be sorted is skipped, instead of failing the whole plan.
+    :param skip_duplicates: leave pages with the same content as another one in input, before sorting.
+        Duplicates are detected anyway, and flagged in the plan.
+    :param blank_cache: BlankCache, for skip_blank (optional).
+    :return: dict: input, output, delete_after_success, pdf, and files, a list of dict for each page, in order:
+        source (relative to input), size, mtime (ns), destination (relative to output, None if skipped),
+        index (in its output document), skipped (reason, or None) and duplicate_of (source, or None).
+    """
+    input_dirpath = path.abspath(input_dirpath)
+    output_dirpath = path.abspath(output_dirpath)
+    if sessions:
+        groups = [(get_session_output(input_dirpath, output_dirpath, session), session_pages)
+                  for session, session_pages in split_sessions(pages).items()]
+    else:
+        groups = [(output_dirpath, pages)]
+    files = []
+
+    def add(page, destination=None, index=None, skipped=None, duplicate_of=None):
+        size, mtime = page.size, page.mtime
+        if size is None or mtime is None:
+            st = os.stat(page.filepath)
+            size, mtime = st.st_size, st.st_mtime_ns
+        files.append({
+            'source': path.relpath(page.filepath, input_dirpath),
+            'size': size,
+            'mtime': mtime,
+            'destination': destination and path.relpath(destination, output_dirpath),
+            'index': index,
+            'skipped': skipped,
+            'duplicate_of': duplicate_of and path.relpath(duplicate_of.filepath, input_dirpath),
+        })
+
+    for group_dirpath, group_pages in groups:
+        # a sheet scanned twice would shift every following page
+        duplicates = detect_duplicate_pages(group_pages, cancel=cancel)
+        originals = {group_pages[i]: group_pages[original] for i, original in duplicates.items()}
+        skipped_copies = {}  # page -> its skipped copies
+        if skip_duplicates:
+            for copy, original in originals.items():
+                skipped_copies.setdefault(original, []).append(copy)
+            group_pages = [page for page in group_pages if page not in originals]
+        try:
+            with span('sort', files=len(group_pages)):
+                group_pages = sort_pages(group_pages, sorting_brother, sort_windows, sort_reversed)
+            # blank pages are left untouched in input, and not numbered
+            blanks = detect_blank_pages([page.filepath for page in group_pages], blank_cache,
+                                        cancel=cancel) if skip_blank else set()
+        except (IndexError, ValueError) as e:
+            if not sessions:
+                raise
+            logging.error('session %s skipped: %s', path.relpath(group_dirpath, output_dirpath), e)
+            for page in group_pages:
+                add(page, skipped=str(e), duplicate_of=originals.get(page))
+                for copy in skipped_copies.get(page, []):
+                    add(copy, skipped=str(e), duplicate_of=page)
+            continue
+        kept = [page for i, page in enumerate(group_pages) if i not in blanks]
+        if pdf_filepath:
+            destinations = [group_dirpath + '.pdf' if sessions else pdf_filepath] * len(kept)
+        else:
+            with span('naming', files=len(kept)):
+                destinations = get_output_filepaths([page.filepath for page in kept], group_dirpath,
+                                                    output_filepattern)
+        destinations = iter(enumerate(destinations))
+        for i, page in enumerate(group_pages):
+            if i in blanks:
+                add(page, skipped='blank', duplicate_of=originals.get(page))
+            else:
+                index, destination = next(destinations)
+                add(page, destination, index, duplicate_of=originals.get(page))
+            for copy in skipped_copies.get(page, []):
+                add(copy, skipped='duplicate', duplicate_of=page)
+    return {
+        'version': PLAN_VERSION,
+        'input': input_dirpath,
+        'output': output_dirpath,
+        'delete_after_success': bool(delete_after_success),
+        'pdf': bool(pdf_filepath),
+        'files': files,
+    }
+
+
+def save_plan(plan, plan_filepath):
+    tmp_filepath = plan_filepath + '.tmp'
+    with open(tmp_filepath, 'w', encoding='utf-8') as f:
+        json.dump(plan, f, indent=1)
+    os.replace(tmp_filepath, plan_filepath)
+
+
+def load_plan(plan_filepath):
+    with open(plan_filepath, encoding='utf-8') as f:
+        plan = json.load(f)
+    if plan.get('version') != PLAN_VERSION:
+        raise ValueError(f'unsupported plan version: {plan_filepath}')
+    return plan
+
+
+def apply_plan(plan,
+               input_dirpath=None,
+               output_dirpath=None,
+               max_workers=DEFAULT_MAX_WORKERS,
+               progress=None,
+               cancel=None,
+               checksum=False):
+    """
+    do what a plan says. Can be run again after a failure: pages whose destination is already
+    up to date are not copied again. What each destination is made of is recorded in .debrother-sources.json,
+    in the output root: a destination is up to date if it was written from the same sources (same path,
+    size and modification time), and not modified since.
+
+    :param plan: dict, as given by make_plan (or load_plan).
+    :param input_dirpath: input root, if not the planned one (eg. on another host).
+    :param output_dirpath: output root, if not the planned one.
+    :param progress: callable(CopyProgress) (optional).
+    :param cancel: threading.Event, once set, stops with InterruptedError (optional).
+    :param checksum: see rename_files.
+    :return: dict: number of files 'copied' and already 'up_to_date'.
+    :raise ValueError: if a source changed since the plan was made.
+    """
+    input_dirpath = input_dirpath or plan['input']
+    output_dirpath = output_dirpath or plan['output']
+    delete_after_success = plan['delete_after_success']
+    destinations = [path.join(output_dirpath, entry['destination']) for entry in plan['files'] if entry['destination']]
+    if destinations and not plan['pdf']:
+        # finish commits interrupted by a crash first, so that the pages they published are up to date below
+        recover_staging(get_staging_root(destinations), keep_uncommitted=True)
+    pairs = []  # (source, destination, source still exists, planned entry)
+    for entry in plan['files']:
+        if entry['destination'] is None:
+            continue
+        source = path.join(input_dirpath, entry['source'])
+        try:
+            st = os.stat(source)
+        except FileNotFoundError:
+            st = None  # already moved, if its destination is up to date
+        if st is not None and (st.st_size, st.st_mtime_ns) != (entry['size'], entry['mtime']):
+            raise ValueError(f'{source} changed since the plan was made.')
+        pairs.append((source, path.join(output_dirpath, entry['destination']), st is not None, entry))
+    # what every existing destination was made of
+    sources_filepath = path.join(output_dirpath, SOURCES_FILENAME)
+    records = load_sources(sources_filepath)
+    if plan['pdf']:
+        return _apply_pdf_plan(pairs, records, sources_filepath, delete_after_success, progress, cancel, checksum)
+
+    # in place renames: a destination that is still a planned source is not an output yet
+    sources = {path.normcase(source) for source, _, _, _ in pairs}
+    todo, done, pending = [], [], {}
+    for source, destination, exists, entry in pairs:
+        up_to_date = False
+        st = None
+        if path.normcase(destination) not in sources:
+            try:
+                st = os.stat(destination)
+                up_to_date = _is_up_to_date(records.get(entry['destination']), [_source_record(entry)], st)
+            except FileNotFoundError:
+                pass
+        if up_to_date:
+            done.append((source, destination, exists))
+        else:
+            todo.append((source, destination, exists))
+            pending[entry['destination']] = {'sources': [_source_record(entry)], 'written': False,
+                                             'stat': None if st is None else [st.st_size, st.st_mtime_ns]}
+    missing = [source for source, _, exists in todo if not exists]
+    if missing:
+        raise FileNotFoundError(f'{len(missing)} files are missing, eg. {missing[0]}')
+    logging.info('files to copy: %d, already up to date: %d.', len(todo), len(done))
+    if todo:
+        # recorded before, so that pages published by a crashed commit are known to come from these sources
+        update_sources(sources_filepath, pending)
+        rename_files([source for source, _, _ in todo], [destination for _, destination, _ in todo],
+                     delete_after_success, max_workers, progress, cancel, checksum)
+        for relpath, record in pending.items():
+            st = os.stat(path.join(output_dirpath, relpath))
+            record.update(written=True, stat=[st.st_size, st.st_mtime_ns])
+        update_sources(sources_filepath, pending)
+    if delete_after_success:
+        # copied by a previous run, that stopped before deleting originals
+        for source, destination, exists in done:
+            if not exists or path.samefile(source, destination):
+                continue
+            if checksum and hash_file(source) != hash_file(destination):
+                logging.warning('%s does not match its copy %s: original is kept.', source, destination)
+                continue
+            os.remove(source)
+    return {'copied': len(todo), 'up_to_date': len(done)}
+
+
+def _source_record(entry):
+    return [entry['source'], entry['size'], entry['mtime']]
+
+
+def _is_up_to_date(record, sources, st):
+    """
+    :param record: what the sources record says about a destination (see manifest.update_sources), or None.
+    :param sources: list of [source, size, mtime_ns] the destination is planned from, in page order.
+    :param st: os.stat_result of the destination.
+    :return: whether the destination was written from these sources (and not modified since).
+    """
+    if record is None or record['sources'] != sources:
+        return False
+    stat = [st.st_size, st.st_mtime_ns]
+    if record['written']:
+        return record['stat'] == stat
+    # recorded before a copy that did not finish: its page may have been published by a recovered commit
+    return (record['stat'] != stat and len(sources) == 1
+            and st.st_size == sources[0][1] and st.st_mtime_ns >= sources[0][2])
+
+
+def _apply_pdf_plan(pairs, records, sources_filepath, delete_after_success, progress, cancel, checksum=False):
+    """
+    write each pdf of a plan, unless it was already written from the same pages.
+    :param pairs: list of (source, pdf file path, source still exists, planned entry), in page order.
+    :param records: what existing pdfs were made of (see manifest.load_sources).
+    :param sources_filepath: where to record what written pdfs are made of.
+    :param checksum: hash each pdf while writing it, and add it to the manifest next to it.
+        With delete_after_success, pages are deleted only if the pdf still hashes to that digest.
+    """
+    documents = {}
+    for pair in pairs:
+        documents.setdefault(pair[1], []).append(pair)
+    written, done = [], []
+    for pdf_filepath, document in documents.items():
+        relpath = document[0][3]['destination']
+        page_records = [_source_record(entry) for _, _, _, entry in document]
+        if path.exists(pdf_filepath) and _is_up_to_date(records.get(relpath), page_records, os.stat(pdf_filepath)):
+            done.extend(document)
+            continue
+        os.makedirs(path.dirname(pdf_filepath) or '.', exist_ok=True)
+        sources = [source for source, _, _, _ in document]
+        with span('pdf', files=len(document)):
+            digest = write_pdf(sources, pdf_filepath, progress, cancel, CHECKSUM_ALGORITHM if checksum else None)
+        st = os.stat(pdf_filepath)
+        update_sources(sources_filepath, {relpath: {'sources': page_records, 'written': True,
+                                                    'stat': [st.st_size, st.st_mtime_ns]}})
+        if checksum:
+            with span('manifest', files=1):
+                update_manifest(path.join(path.dirname(pdf_filepath), MANIFEST_FILENAME),
+                                [make_manifest_entry(sources, pdf_filepath, digest)])
+            if delete_after_success and hash_file(pdf_filepath) != digest:
+                raise FileNotFoundError(f'{pdf_filepath} does not match what was written: pages are kept.')
+        written.extend(document)
+    if delete_after_success:
+        with span('delete', files=len(pairs)):
+            for source, _, exists, _ in pairs:
+                if exists:
+                    os.remove(source)
+    return {'copied': len(written), 'up_to_date': len(done)}
+
+
+def process_pages(pages,
+                  output_dirpath,
+                  output_filepattern,
+                  sorting_brother=True,
+                  sort_windows=True,
+                  sort_reversed=True,
+                  delete_after_success=False,
+                  max_workers=DEFAULT_MAX_WORKERS,
+                  progress=None,
+                  cancel=None,
+                  pdf_filepath=None,
+                  checksum=False,
+                  skip_blank=False,
+                  skip_duplicates=False):
+    """
+    sort pages, and output them as renamed files (or a single pdf): make_plan then apply_plan.
+    :param pages: list of Page, as given by scan_pages.
+    :return: the applied plan (None if no pages).
+    """
+    if not pages:
+        return None
+    input_dirpath = path.commonpath([path.dirname(path.abspath(page.filepath)) for page in pages])
+    output_dirpath = output_dirpath or path.dirname(path.abspath(pdf_filepath))
+    plan = make_plan(pages, input_dirpath, output_dirpath, output_filepattern, sorting_brother, sort_windows,
+                     sort_reversed, delete_after_success, pdf_filepath, skip_blank,
+                     skip_duplicates=skip_duplicates, cancel=cancel)
+    apply_plan(plan, max_workers=max_workers, progress=progress, cancel=cancel, checksum=checksum)
+    return plan
 
 
 def rectoverso(input_dirpath,
@@ -177,11 +796,113 @@ def rectoverso(input_dirpath,
                sorting_brother=True,
                sort_windows=True,
                sort_reversed=True,
-               delete_after_success=False):
-    input_filepath_list = populate_pages(input_dirpath)
-    nb_files = len(input_filepath_list)
-    logging.info('files to rename: {}.'.format(nb_files))
-
-    input_filepath_list = sort_policy(input_filepath_list, sorting_brother, sort_windows, sort_reversed)
-    output_filepath_list = get_output_filepaths(input_filepath_list, output_dirpath, output_filepattern)
-    rename_files(input_filepath_list, output_filepath_list, delete_after_success)
+               delete_after_success=False,
+               max_workers=DEFAULT_MAX_WORKERS,
+               progress=None,
+               cancel=None,
+               pdf_filepath=None,
+               checksum=False,
+               skip_blank=False,
+               skip_duplicates=False):
+    with span('scan') as scan_span:
+        pages = scan_pages(input_dirpath, cancel=cancel)
+        scan_span.count(files=len(pages))
+    logging.info('files to rename: %d.', len(pages))
+    process_pages(pages, output_dirpath, output_filepattern, sorting_brother, sort_windows, sort_reversed,
+                  delete_after_success, max_workers, progress, cancel, pdf_filepath, checksum, skip_blank,
+                  skip_duplicates)
+
+
+def split_sessions(pages):
+    """
+    group pages by scan session: the scanner gives every page of a session (recto and verso batches)
+    the same base name, in the same directory.
+    :param pages: list of Page
+    :return: dict (dirpath, base) -> list of Page, sessions and pages in path order.
+    """
+    sessions = {}
+    for page in sorted(pages, key=lambda p: p.filepath):
+        sessions.setdefault((path.dirname(page.filepath), page.base), []).append(page)
+    return dict(sorted(sessions.items()))
+
+
+def get_session_output(input_dirpath, output_dirpath, session):
+    """
+    :param session: (dirpath, base) as given by split_sessions.
+    :return: where the session is output: output_dirpath / sub directory (relative to input) / base
+    """
+    dirpath, base = session
+    return path.normpath(path.join(output_dirpath, path.relpath(dirpath, input_dirpath), base))
+
+
+def rectoverso_sessions(input_dirpath,
+                        output_dirpath,
+                        output_filepattern,
+                        max_sessions=DEFAULT_MAX_SESSIONS,
+                        cancel=None,
+                        pdf=False,
+                        **options):
+    """
+    like rectoverso, but each scan session is sorted and output on its own, in its own directory
+    (or pdf), several sessions at a time. A failing session does not stop the others.
+
+    :param input_dirpath: input root directory.
+    :param output_dirpath: output root directory, each session goes in get_session_output.
+    :param output_filepattern: output file name syntax (within a session).
+    :param max_sessions: number of sessions processed concurrently.
+    :param cancel: threading.Event, once set, sessions not done are cancelled (optional).
+    :param pdf: write each session as get_session_output + '.pdf', instead of renamed files.
+    :param options: other process_pages parameters (sorting, delete_after_success, ...),
+        max_workers being shared by the sessions running concurrently.
+    :return: list of dict (session, output, files, duplicates, status, error, duration), status being 'ok',
+        'failed' or 'cancelled'.
+    """
+    with span('scan') as scan_span:
+        pages = scan_pages(input_dirpath, cancel=cancel)
+        scan_span.count(files=len(pages))
+    return process_sessions(pages, input_dirpath, output_dirpath, output_filepattern, max_sessions, cancel, pdf,
+                            **options)
+
+
+def process_sessions(pages,
+                     input_dirpath,
+                     output_dirpath,
+                     output_filepattern,
+                     max_sessions=DEFAULT_MAX_SESSIONS,
+                     cancel=None,
+                     pdf=False,
+                     **options):
+    """
+    same as rectoverso_sessions, on already scanned pages.
+    :param pages: list of Page, as given by scan_pages(input_dirpath).
+    """
+    sessions = split_sessions(pages)
+    logging.info('sessions to process: %d.', len(sessions))
+    max_sessions = max(1, min(max_sessions, len(sessions)))
+    options['max_workers'] = max(1, options.get('max_workers', DEFAULT_MAX_WORKERS) // max_sessions)
+
+    def process(session, session_pages):
+        session_output = get_session_output(input_dirpath, output_dirpath, session)
+        report = {'session': path.relpath(session_output, output_dirpath), 'output': session_output,
+                  'files': len(session_pages), 'duplicates': 0, 'status': 'ok', 'error': None}
+        start = time.perf_counter()
+        try:
+            if cancel is not None and cancel.is_set():
+                raise InterruptedError('session cancelled.')
+            if pdf:
+                plan = process_pages(session_pages, None, None, cancel=cancel, pdf_filepath=session_output + '.pdf',
+                                     **options)
+                report['output'] = session_output + '.pdf'
+            else:
+                plan = process_pages(session_pages, session_output, output_filepattern, cancel=cancel, **options)
+            report['duplicates'] = sum(1 for entry in plan['files'] if entry['duplicate_of'])
+        except InterruptedError as e:
+            report.update(status='cancelled', error=str(e))
+        except (OSError, ValueError, IndexError, KeyError) as e:
+            logging.error('session %s failed: %s', report['session'], e)
+            report.update(status='failed', error=str(e))
+        report['duration'] = time.perf_counter() - start
+        return report
+
+    with ThreadPoolExecutor(max_workers=max_sessions) as executor:
+        return list(executor.map(lambda item: process(*item), sessions.items()))
@@ -0,0 +1,71 @@
+import os
+import mmap
+import hashlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from copyengine import DEFAULT_MAX_WORKERS
+from manifest import hash_file
+
+# bytes hashed at each end of same size files, before hashing them entirely
+HEAD_TAIL_BYTES = 64 * 1024
+
+
+def partial_hash(filepath, size):
+    """
+    :return: hex digest of the first and last HEAD_TAIL_BYTES of the file (read through mmap).
+    """
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        digest.update(m[:HEAD_TAIL_BYTES])
+        if size > HEAD_TAIL_BYTES:
+            digest.update(m[max(HEAD_TAIL_BYTES, size - HEAD_TAIL_BYTES):])
+    return digest.hexdigest()
+
+
+def _refine(groups, key, max_workers, cancel):
+    """
+    split every group of indices by key(index), computed in parallel.
+    :return: list of groups still having several indices.
+    """
+    indices = [i for group in groups for i in group]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        keys = dict(zip(indices, executor.map(key, indices)))
+    if cancel is not None and cancel.is_set():
+        raise InterruptedError('duplicate detection cancelled.')
+    refined = []
+    for group in groups:
+        buckets = defaultdict(list)
+        for i in group:
+            buckets[keys[i]].append(i)
+        refined.extend(bucket for bucket in buckets.values() if len(bucket) > 1)
+    return refined
+
+
+def find_duplicates(filepaths, sizes=None, max_workers=DEFAULT_MAX_WORKERS, cancel=None):
+    """
+    find files with the same content (eg. a sheet fed twice after a paper jam), in 3 steps:
+    files are grouped by size (most of them are unique at this point, without reading any byte),
+    then by a hash of their head and tail, and only files still colliding are hashed entirely.
+    Empty files are ignored.
+
+    :param filepaths: list of file paths.
+    :param sizes: list of file sizes (optional, files are stat'ed if None).
+    :param max_workers: number of files hashed concurrently.
+    :param cancel: threading.Event, if set, InterruptedError is raised (optional).
+    :return: dict index of a duplicate -> index of the first file (in filepaths order) with the same content.
+    """
+    if sizes is None:
+        sizes = [os.stat(filepath).st_size for filepath in filepaths]
+    by_size = defaultdict(list)
+    for i, size in enumerate(sizes):
+        if size:
+            by_size[size].append(i)
+    groups = [group for group in by_size.values() if len(group) > 1]
+    if groups:
+        groups = _refine(groups, lambda i: partial_hash(filepaths[i], sizes[i]), max_workers, cancel)
+    # head and tail already cover small files entirely
+    small = [group for group in groups if sizes[group[0]] <= 2 * HEAD_TAIL_BYTES]
+    large = [group for group in groups if sizes[group[0]] > 2 * HEAD_TAIL_BYTES]
+    if large:
+        large = _refine(large, lambda i: hash_file(filepaths[i]), max_workers, cancel)
+    return {i: group[0] for group in small + large for i in group[1:]}
@@ -0,0 +1,460 @@
+import os
+import os.path as path
+import hmac
+import json
+import time
+import uuid
+import signal
+import socket
+import secrets
+import threading
+import socketserver
+import http.client
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+from batch import BATCH_DEFAULTS, DEFAULT_IO_WORKERS, process_root, roots_overlap, get_root_dirpaths
+from naming import default_matcher
+from scanindex import ScanIndex, default_cache_filepath
+
+logger = logging.getLogger(__name__)
+
+# tcp address of the service, where unix sockets are not available (it only listens on the local host)
+DEFAULT_TCP_ADDRESS = ('127.0.0.1', 7707)
+# Host headers accepted by the service (anything else is a web page trying to reach it, see dns rebinding)
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '::1')
+# number of jobs running concurrently
+DEFAULT_MAX_JOBS = 4
+# finished jobs kept in the queue file, for status queries
+MAX_FINISHED_JOBS = 100
+JOBS_VERSION = 1
+FINISHED = ('ok', 'failed', 'cancelled')
+
+
+def default_state_dirpath():
+    """
+    :return: path of the job queue service state directory ($XDG_STATE_HOME/debrother)
+    """
+    state_dirpath = os.environ.get('XDG_STATE_HOME') or path.join(path.expanduser('~'), '.local', 'state')
+    return path.join(state_dirpath, 'debrother')
+
+
+def default_jobs_filepath():
+    """
+    :return: path of the persistent job queue ($XDG_STATE_HOME/debrother/jobs.json)
+    """
+    return path.join(default_state_dirpath(), 'jobs.json')
+
+
+def default_token_filepath():
+    """
+    :return: path of the file holding the service token ($XDG_STATE_HOME/debrother/token)
+    """
+    return path.join(default_state_dirpath(), 'token')
+
+
+def default_address():
+    """
+    :return: address of the service: a unix socket ($XDG_STATE_HOME/debrother/jobs.sock) if supported,
+        else DEFAULT_TCP_ADDRESS.
+    """
+    if hasattr(socket, 'AF_UNIX'):
+        return path.join(default_state_dirpath(), 'jobs.sock')
+    return DEFAULT_TCP_ADDRESS
+
+
+class JobQueue:
+    """
+    Persistent queue of rectoverso jobs (one input root each, with batch settings), run on a worker pool.
+    Jobs touching the same input or output root (or a directory inside it) run one after the other,
+    in submission order, others run in parallel.
+    The queue is saved on every status change: jobs interrupted by a restart are queued again.
+    """
+    def __init__(self, jobs_filepath=None, max_jobs=DEFAULT_MAX_JOBS, io_workers=DEFAULT_IO_WORKERS,
+                 scan_index=None, paused=False):
+        """
+        :param jobs_filepath: json file where the queue is loaded from and saved to (optional).
+        :param max_jobs: number of jobs running concurrently.
+        :param io_workers: number of files copied concurrently, shared between running jobs.
+        :param scan_index: ScanIndex shared by all jobs (optional).
+        :param paused: if True, jobs are only queued until resume is called.
+        """
+        self._jobs_filepath = jobs_filepath
+        self._max_jobs = max(1, max_jobs)
+        self._max_workers = max(1, io_workers // self._max_jobs)
+        self._scan_index = scan_index or ScanIndex(default_matcher())
+        self._jobs = {}  # id -> job, in submission order
+        self._cancels = {}  # id -> threading.Event, of running jobs
+        self._paused = paused
+        self._closing = False
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self._max_jobs)
+
+    def load(self):
+        if not self._jobs_filepath or not path.isfile(self._jobs_filepath):
+            return
+        try:
+            with open(self._jobs_filepath, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f'ignoring invalid job queue {self._jobs_filepath}: {e}')
+            return
+        if data.get('version') != JOBS_VERSION:
+            logger.warning(f'ignoring outdated job queue {self._jobs_filepath}')
+            return
+        with self._lock:
+            for job in data['jobs']:
+                if job['status'] == 'running':  # interrupted: run it again (applying a plan is idempotent)
+                    job.update(status='queued', started=None, progress=None)
+                self._jobs[job['id']] = job
+            self._schedule()
+
+    def _save(self):
+        """ must be called with the lock held. """
+        if not self._jobs_filepath:
+            return
+        finished = [job_id for job_id, job in self._jobs.items() if job['status'] in FINISHED]
+        for job_id in finished[:-MAX_FINISHED_JOBS]:
+            del self._jobs[job_id]
+        os.makedirs(path.dirname(self._jobs_filepath) or '.', exist_ok=True)
+        tmp_filepath = self._jobs_filepath + '.tmp'
+        with open(tmp_filepath, 'w', encoding='utf-8') as f:
+            json.dump({'version': JOBS_VERSION, 'jobs': list(self._jobs.values())}, f)
+        os.replace(tmp_filepath, self._jobs_filepath)
+
+    def submit(self, settings):
+        """
+        :param settings: dict of root settings, as in a batch file (input is required, and must be absolute).
+        :return: the new job: dict id, settings, status ('queued', 'running', 'ok', 'failed' or 'cancelled'),
+            submitted, started, finished (times), progress (last CopyProgress, as dict) and report (see process_root).
+        """
+        unknown = set(settings) - set(BATCH_DEFAULTS)
+        if unknown:
+            raise KeyError(f'unknown job settings: {", ".join(sorted(unknown))}')
+        if not settings.get('input') or not path.isabs(settings['input']):
+            raise ValueError('job input must be an absolute path.')
+        if settings.get('output') and not path.isabs(settings['output']):
+            raise ValueError('job output must be an absolute path.')
+        job = {'id': uuid.uuid4().hex[:12], 'settings': dict(BATCH_DEFAULTS, **settings), 'status': 'queued',
+               'submitted': time.time(), 'started': None, 'finished': None, 'progress': None, 'report': None}
+        with self._lock:
+            self._jobs[job['id']] = job
+            logger.info(f'job {job["id"]} queued: {settings["input"]}')
+            self._schedule()
+            return dict(job)
+
+    def get(self, job_id):
+        """
+        :return: a copy of the job, or None if unknown.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list(self):
+        with self._lock:
+            return [dict(job) for job in self._jobs.values()]
+
+    def cancel(self, job_id):
+        """
+        cancel a queued job, or interrupt a running one.
+        :return: a copy of the job, or None if unknown.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job['status'] == 'queued':
+                job.update(status='cancelled', finished=time.time())
+                self._schedule()
+            elif job['status'] == 'running':
+                self._cancels[job_id].set()
+            return dict(job)
+
+    def resume(self):
+        """
+        start running queued jobs, if the queue was created paused.
+        """
+        with self._lock:
+            self._paused = False
+            self._schedule()
+
+    def close(self):
+        """
+        interrupt running jobs (they are queued again on next load), and wait for them.
+        """
+        with self._lock:
+            self._closing = True
+            for cancel in self._cancels.values():
+                cancel.set()
+        self._executor.shutdown(wait=True)
+        try:
+            self._scan_index.save()
+        except OSError as e:
+            logger.warning(f'unable to save scan index: {e}')
+
+    def _schedule(self):
+        """
+        start queued jobs whose roots are free, must be called with the lock held.
+        """
+        busy = [root for job in self._jobs.values() if job['status'] == 'running' for root in get_root_dirpaths(job['settings'])]
+        for job in self._jobs.values():
+            if self._paused or self._closing or len(self._cancels) >= self._max_jobs:
+                break
+            if job['status'] != 'queued':
+                continue
+            roots = get_root_dirpaths(job['settings'])
+            # a waiting job also holds its roots, so that jobs on the same roots keep their order
+            free = not any(roots_overlap(root, other) for root in roots for other in busy)
+            busy.extend(roots)
+            if free:
+                job.update(status='running', started=time.time())
+                self._cancels[job['id']] = threading.Event()
+                self._executor.submit(self._run, job)
+        self._save()
+
+    def _run(self, job):
+        def progress(copy_progress):
+            job['progress'] = copy_progress._asdict()
+
+        logger.info(f'job {job["id"]} started: {job["settings"]["input"]}')
+        cancel = self._cancels[job['id']]
+        try:
+            report = process_root(job['settings'], self._max_workers, self._scan_index, cancel, progress)
+        except Exception as e:  # never leave a job running
+            logger.exception(f'job {job["id"]} crashed')
+            report = {'status': 'failed', 'error': str(e)}
+        with self._lock:
+            del self._cancels[job['id']]
+            if self._closing and report['status'] == 'cancelled':  # interrupted by close: run it again next time
+                job.update(status='queued', started=None, progress=None)
+            else:
+                job.update(status=report['status'], report=report, finished=time.time())
+            logger.info(f'job {job["id"]} {job["status"]}')
+            self._schedule()
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    http server on a unix socket only its owner can connect to.
+    """
+    daemon_threads = True
+
+    def server_bind(self):
+        umask = os.umask(0o177)  # no window where the socket is open to others
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+        os.chmod(self.server_address, 0o600)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.remove(self.server_address)
+        except FileNotFoundError:
+            pass
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_filepath):
+        super().__init__('localhost')
+        self._socket_filepath = socket_filepath
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self._socket_filepath)
+
+
+def _remove_stale_socket(socket_filepath):
+    """
+    remove the socket left by a service that did not stop cleanly, raise OSError if a service still listens on it.
+    """
+    if not path.exists(socket_filepath):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        try:
+            s.connect(socket_filepath)
+        except ConnectionRefusedError:
+            os.remove(socket_filepath)
+            return
+    raise OSError(f'job queue service already running on {socket_filepath}')
+
+
+def make_server(queue, token, address=None):
+    """
+    json over http api of a JobQueue:
+     - GET /jobs: list of jobs,
+     - GET /jobs/<id>: a job (status, progress, report),
+     - POST /jobs: submit a job, the body being its settings, eg. {"input": "/scans/alice", "sessions": true},
+     - POST /jobs/<id>/cancel: cancel a job.
+
+    Every request needs an 'Authorization: Bearer <token>' header and a local Host header,
+    POST bodies must be application/json.
+
+    :param queue: JobQueue
+    :param token: secret shared with clients (see write_token).
+    :param address: unix socket path, or (host, port) to listen on (default: default_address()).
+    :return: server, to serve_forever.
+    """
+    class JobQueueHandler(BaseHTTPRequestHandler):
+        def reply(self, code, data):
+            body = json.dumps(data).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def check(self):
+            """
+            :return: True if the request may be handled, else an error is replied.
+            """
+            if urlsplit('//' + self.headers.get('Host', '')).hostname not in LOCAL_HOSTS:
+                self.reply(403, {'error': 'forbidden host.'})
+            elif not hmac.compare_digest(self.headers.get('Authorization', ''), f'Bearer {token}'):
+                self.reply(401, {'error': 'invalid token.'})
+            elif self.command == 'POST' and self.headers.get_content_type() != 'application/json':
+                self.reply(415, {'error': 'content type must be application/json.'})
+            else:
+                return True
+            return False
+
+        def do_GET(self):
+            if not self.check():
+                return
+            parts = self.path.strip('/').split('/')
+            if parts == ['jobs']:
+                self.reply(200, queue.list())
+            elif len(parts) == 2 and parts[0] == 'jobs' and queue.get(parts[1]):
+                self.reply(200, queue.get(parts[1]))
+            else:
+                self.reply(404, {'error': f'not found: {self.path}'})
+
+        def do_POST(self):
+            if not self.check():
+                return
+            parts = self.path.strip('/').split('/')
+            if parts == ['jobs']:
+                try:
+                    settings = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                    self.reply(201, queue.submit(settings))
+                except (ValueError, KeyError, TypeError, AttributeError) as e:
+                    self.reply(400, {'error': str(e)})
+            elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'cancel' and queue.get(parts[1]):
+                self.reply(200, queue.cancel(parts[1]))
+            else:
+                self.reply(404, {'error': f'not found: {self.path}'})
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+    address = address or default_address()
+    if isinstance(address, str):
+        os.makedirs(path.dirname(address) or '.', mode=0o700, exist_ok=True)
+        _remove_stale_socket(address)
+        return _UnixHTTPServer(address, JobQueueHandler)
+    return ThreadingHTTPServer(address, JobQueueHandler)
+
+
+def write_token(token_filepath):
+    """
+    write a new random token, readable by its owner only.
+    :return: the token.
+    """
+    token = secrets.token_hex(16)
+    os.makedirs(path.dirname(token_filepath) or '.', mode=0o700, exist_ok=True)
+    fd = os.open(token_filepath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with open(fd, 'w', encoding='utf-8') as f:
+        if hasattr(os, 'fchmod'):  # the file may already exist, with other permissions
+            os.fchmod(f.fileno(), 0o600)
+        f.write(token)
+    return token
+
+
+def read_token(token_filepath=None):
+    """
+    :param token_filepath: file written by the service (default: default_token_filepath()).
+    :return: the service token.
+    """
+    with open(token_filepath or default_token_filepath(), encoding='utf-8') as f:
+        return f.read().strip()
+
+
+def serve(address=None, jobs_filepath=None, max_jobs=DEFAULT_MAX_JOBS, io_workers=DEFAULT_IO_WORKERS,
+          token_filepath=None):
+    """
+    run the job queue service until interrupted (Ctrl+C or SIGTERM).
+    :param address: unix socket path, or (host, port) to listen on (default: default_address()).
+    :param token_filepath: where the token clients must send is written (default: default_token_filepath()).
+    """
+    scan_index = ScanIndex(default_matcher(), default_cache_filepath())
+    scan_index.load()
+    queue = JobQueue(jobs_filepath or default_jobs_filepath(), max_jobs, io_workers, scan_index)
+    queue.load()
+    token = write_token(token_filepath or default_token_filepath())
+    server = make_server(queue, token, address)
+    logger.info('job queue listening on %s', server.server_address)
+    # shutdown waits for serve_forever to return: it cannot be called from the serving thread
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        queue.close()
+
+
+def _request(route, data=None, address=None, token=None):
+    address = address or default_address()
+    if isinstance(address, str):
+        connection = _UnixHTTPConnection(address)
+    else:
+        connection = http.client.HTTPConnection(*address)
+    headers = {'Authorization': f'Bearer {token or read_token()}', 'Content-Type': 'application/json'}
+    body = None if data is None else json.dumps(data).encode('utf-8')
+    try:
+        connection.request('GET' if data is None else 'POST', route, body, headers)
+        response = connection.getresponse()
+        reply = json.load(response)
+    finally:
+        connection.close()
+    if response.status >= 400:
+        raise ValueError(reply.get('error', response.reason))
+    return reply
+
+
+def submit_job(settings, address=None, token=None):
+    """
+    submit a job to a running service.
+    :param settings: dict of root settings (see JobQueue.submit).
+    :param address: service unix socket path, or (host, port) (default: default_address()).
+    :param token: service token (default: read_token()).
+    :return: the job, as dict.
+    """
+    return _request('/jobs', settings, address, token)
+
+
+def get_job(job_id, address=None, token=None):
+    return _request(f'/jobs/{job_id}', None, address, token)
+
+
+def cancel_job(job_id, address=None, token=None):
+    return _request(f'/jobs/{job_id}/cancel', {}, address, token)
+
+
+def wait_job(job_id, address=None, token=None, poll_interval=1., on_progress=None):
+    """
+    poll a job until it is finished.
+    :param on_progress: callable(job), called at each poll (optional).
+    :return: the finished job.
+    """
+    while True:
+        job = get_job(job_id, address, token)
+        if job['status'] in FINISHED:
+            return job
+        if on_progress:
+            on_progress(job)
+        time.sleep(poll_interval)
@@ -0,0 +1,135 @@
+import os
+import os.path as path
+import json
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from copyengine import DEFAULT_MAX_WORKERS
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = 'debrother-manifest.json'
+SOURCES_FILENAME = '.debrother-sources.json'
+CHECKSUM_ALGORITHM = 'sha256'
+
+
+def hash_file(filepath, algorithm=CHECKSUM_ALGORITHM):
+    """
+    :return: hex digest of the file content.
+    """
+    digest = hashlib.new(algorithm)
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_files(filepaths, max_workers=DEFAULT_MAX_WORKERS, algorithm=CHECKSUM_ALGORITHM):
+    """
+    :return: list of hex digests, in the same order as filepaths (files are hashed in parallel).
+    """
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        return list(executor.map(lambda filepath: hash_file(filepath, algorithm), filepaths))
+
+
+def load_manifest(manifest_filepath):
+    """
+    :return: dict destination -> entry (source, destination, size, mtime_ns, algorithm, hash),
+        source being the list of pages for a pdf.
+    """
+    if not path.isfile(manifest_filepath):
+        return {}
+    with open(manifest_filepath, encoding='utf-8') as f:
+        return {entry['destination']: entry for entry in json.load(f)['files']}
+
+
+def update_manifest(manifest_filepath, entries):
+    """
+    add entries to the manifest (entries with the same destination are replaced).
+    :param manifest_filepath: json manifest file path.
+    :param entries: list of dict (source, destination, size, mtime_ns, algorithm, hash)
+    """
+    manifest = load_manifest(manifest_filepath)
+    manifest.update((entry['destination'], entry) for entry in entries)
+    tmp_filepath = manifest_filepath + '.tmp'
+    with open(tmp_filepath, 'w', encoding='utf-8') as f:
+        json.dump({'files': sorted(manifest.values(), key=lambda e: e['destination'])}, f, indent=1)
+    os.replace(tmp_filepath, manifest_filepath)
+
+
+def load_sources(sources_filepath):
+    """
+    :return: dict destination -> record (sources, stat, written), see update_sources.
+    """
+    if not path.isfile(sources_filepath):
+        return {}
+    with open(sources_filepath, encoding='utf-8') as f:
+        return json.load(f)['files']
+
+
+def update_sources(sources_filepath, records):
+    """
+    record which sources each destination is made of, so that a later run can tell whether
+    an existing destination is up to date (records with the same destination are replaced).
+    :param sources_filepath: json file path, in the output root.
+    :param records: dict destination (relative to the output root) -> dict:
+        sources: list of [source (relative to the input root), size, mtime_ns], in page order,
+        stat: [size, mtime_ns] of the destination once written, or before it is (None if missing),
+        written: False if recorded before the destination is written.
+    """
+    sources = load_sources(sources_filepath)
+    sources.update(records)
+    os.makedirs(path.dirname(sources_filepath) or '.', exist_ok=True)
+    tmp_filepath = sources_filepath + '.tmp'
+    with open(tmp_filepath, 'w', encoding='utf-8') as f:
+        json.dump({'files': dict(sorted(sources.items()))}, f, indent=1)
+    os.replace(tmp_filepath, sources_filepath)
+
+
+def make_manifest_entry(source, destination, digest, algorithm=CHECKSUM_ALGORITHM):
+    st = os.stat(destination)
+    return {
+        'source': source,
+        'destination': destination,
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'algorithm': algorithm,
+        'hash': digest,
+    }
+
+
+def verify_manifest(manifest_filepath, max_workers=DEFAULT_MAX_WORKERS, full=False):
+    """
+    check output files against the manifest.
+    Files whose size and mtime did not change since they were written are skipped (unless full),
+    others are hashed again, in parallel.
+
+    :param manifest_filepath: json manifest file path.
+    :param max_workers: number of files hashed concurrently.
+    :param full: hash every file, even unchanged ones.
+    :return: dict status -> list of destinations, status being 'unchanged', 'ok', 'corrupted' or 'missing'.
+    """
+    report = {'unchanged': [], 'ok': [], 'corrupted': [], 'missing': []}
+    to_hash = []
+    for destination, entry in load_manifest(manifest_filepath).items():
+        try:
+            st = os.stat(destination)
+        except FileNotFoundError:
+            report['missing'].append(destination)
+            continue
+        if st.st_size != entry['size']:
+            report['corrupted'].append(destination)
+        elif not full and st.st_mtime_ns == entry['mtime_ns']:
+            report['unchanged'].append(destination)
+        else:
+            to_hash.append(entry)
+
+    def check(entry):
+        return entry['hash'] == hash_file(entry['destination'], entry['algorithm'])
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        for entry, valid in zip(to_hash, executor.map(check, to_hash)):
+            report['ok' if valid else 'corrupted'].append(entry['destination'])
+    for status, destinations in report.items():
+        logger.info(f'{status}: {len(destinations)} files')
+    return report
@@ -0,0 +1,132 @@
+import os
+import os.path as path
+import re
+import json
+import functools
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# how a scanner (or scan software) names its files: pattern is a regex matched against the whole file name,
+# with optional named groups:
+#  - base: the scan session prefix (pages sharing it belong to the same session),
+#  - page: the page number in the batch (1 if missing),
+#  - batch: the batch number (1 if missing, 2 for the verso batch).
+NamingProfile = namedtuple('NamingProfile', ['name', 'pattern'])
+
+NAMING_FIELDS = ('base', 'page', 'batch')
+
+# built-in profiles, only DEFAULT_PROFILES are enabled unless profiles.json lists others:
+# their patterns are loose enough to catch unrelated files (eg. 'cover-1.jpg') next to scans.
+NAMING_PROFILES = [
+    # Brother ControlCenter on windows: 'Numérisation_20190412_10 (2).jpg'
+    NamingProfile('brother', r'(?P<base>.+_(\d){8})(_(?P<page>\d+))?(\s\((?P<batch>\d+)\))?\.\w+$'),
+    # GNOME simple-scan, pages saved as images: 'Scanned Document-2.jpg'
+    NamingProfile('simple_scan', r'(?P<base>.+?)-(?P<page>\d+)\.(jpe?g|png|tiff?)'),
+    # SANE scanimage --batch: 'out2.pnm'
+    NamingProfile('scanimage', r'(?P<base>out)(?P<page>\d+)\.(pnm|tiff?|png|jpe?g)'),
+]
+
+DEFAULT_PROFILES = ('brother',)
+
+
+def default_profiles_filepath():
+    """
+    :return: path of the user naming profiles ($XDG_CONFIG_HOME/debrother/profiles.json)
+    """
+    config_dirpath = os.environ.get('XDG_CONFIG_HOME') or path.join(path.expanduser('~'), '.config')
+    return path.join(config_dirpath, 'debrother', 'profiles.json')
+
+
+def load_profiles(profiles_filepath):
+    """
+    read naming profiles from a json list, each being the name of a built-in profile (eg. "simple_scan"),
+    or a {"name": ..., "pattern": ...} object.
+    :param profiles_filepath: path to the json file.
+    :return: list of NamingProfile
+    """
+    builtins = {profile.name: profile for profile in NAMING_PROFILES}
+    with open(profiles_filepath, encoding='utf-8') as f:
+        entries = json.load(f)
+    profiles = []
+    for entry in entries:
+        if isinstance(entry, str):
+            if entry not in builtins:
+                raise KeyError(f'unknown naming profile: {entry}')
+            profiles.append(builtins[entry])
+        else:
+            profiles.append(NamingProfile(entry['name'], entry['pattern']))
+    return profiles
+
+
+class NamingMatcher:
+    """
+    All naming profiles compiled into a single regex (one alternative per profile):
+    a file name is classified with one match, whatever the number of profiles.
+    A profile can also be tried first (eg. the one of the other files of the same directory).
+    Hidden files (eg. debrother intermediate files) never match.
+    """
+    def __init__(self, profiles):
+        """
+        :param profiles: list of NamingProfile, in priority order (the first matching one wins).
+        """
+        self.profiles = list(profiles)
+        names = [profile.name for profile in self.profiles]
+        if len(set(names)) != len(names):
+            raise ValueError('naming profile names must be unique.')
+        alternatives = []
+        self._groups = []  # per profile: combined group name -> field
+        for i, profile in enumerate(self.profiles):
+            regex = re.compile(profile.pattern)
+            unknown = set(regex.groupindex) - set(NAMING_FIELDS)
+            if unknown:
+                raise ValueError(f'naming profile {profile.name}: unknown groups {", ".join(sorted(unknown))}.')
+            # group names must be unique in the combined regex: prefix them with the profile position
+            alternatives.append(f'(?P<p{i}>' + re.sub(r'\(\?P<(\w+)>', rf'(?P<p{i}_\1>', profile.pattern) + ')')
+            self._groups.append({f'p{i}_{field}': field for field in regex.groupindex})
+        self.pattern = '|'.join(alternatives)
+        self._regex = re.compile(self.pattern)
+        self._profile_regexes = {profile.name: re.compile(profile.pattern) for profile in self.profiles}
+
+    def match(self, filename, profile=None):
+        """
+        :param filename: file name (without directory).
+        :param profile: name of the profile to try first (optional).
+        :return: dict of fields (base, page, batch, missing ones are None) plus profile name, or None if no match.
+        """
+        if filename.startswith('.'):
+            return None
+        fields = dict.fromkeys(NAMING_FIELDS)
+        regex = self._profile_regexes.get(profile)
+        if regex is not None:
+            match = regex.fullmatch(filename)
+            if match:
+                fields.update(match.groupdict(), profile=profile)
+                return fields
+        match = self._regex.fullmatch(filename)
+        if match is None:
+            return None
+        # the profile alternative encloses all its groups: it is the last one closed
+        i = int(match.lastgroup[1:])
+        fields.update({field: match.group(group) for group, field in self._groups[i].items()},
+                      profile=self.profiles[i].name)
+        return fields
+
+
+@functools.lru_cache(maxsize=None)
+def default_matcher():
+    """
+    :return: NamingMatcher of profiles listed in the user profiles (see default_profiles_filepath), if any,
+        then DEFAULT_PROFILES.
+    """
+    defaults = [profile for profile in NAMING_PROFILES if profile.name in DEFAULT_PROFILES]
+    profiles_filepath = default_profiles_filepath()
+    if path.isfile(profiles_filepath):
+        try:
+            profiles = load_profiles(profiles_filepath)
+            user_names = {profile.name for profile in profiles}
+            return NamingMatcher(profiles + [profile for profile in defaults if profile.name not in user_names])
+        except (OSError, ValueError, KeyError, TypeError, re.error) as e:
+            logger.warning(f'ignoring invalid naming profiles {profiles_filepath}: {e}')
+    return NamingMatcher(defaults)
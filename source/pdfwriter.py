@@ -0,0 +1,178 @@
+import os
+import os.path as path
+import time
+import struct
+import hashlib
+import logging
+from shutil import copyfileobj
+from collections import namedtuple
+from copyengine import CopyProgress
+
+logger = logging.getLogger(__name__)
+
+# what is needed from a jpeg file to embed it as is in a pdf.
+JpegInfo = namedtuple('JpegInfo', ['width', 'height', 'components', 'dpi_x', 'dpi_y', 'adobe'])
+
+DEFAULT_DPI = 72
+# start of frame markers (SOF0..SOF15, except DHT, JPG and DAC)
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+COLOR_SPACES = {1: '/DeviceGray', 3: '/DeviceRGB', 4: '/DeviceCMYK'}
+
+
+def read_jpeg_info(filepath):
+    """
+    read jpeg headers only (no decoding): size, number of components and resolution.
+    :param filepath: path to a jpeg file.
+    :return: JpegInfo
+    """
+    dpi_x = dpi_y = DEFAULT_DPI
+    adobe = False
+    with open(filepath, 'rb') as f:
+        if f.read(2) != b'\xff\xd8':
+            raise ValueError(f'not a jpeg file: {filepath}')
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                raise ValueError(f'invalid jpeg file: {filepath}')
+            if marker[1] in (0xFF, 0x01) or 0xD0 <= marker[1] <= 0xD7:  # padding or markers without length
+                if marker[1] == 0xFF:
+                    f.seek(-1, os.SEEK_CUR)
+                continue
+            length, = struct.unpack('>H', f.read(2))
+            segment = f.read(length - 2)
+            if marker[1] == 0xE0 and segment[:5] == b'JFIF\0':
+                units, x, y = struct.unpack('>BHH', segment[7:12])
+                if units and x and y:
+                    factor = 2.54 if units == 2 else 1  # dots per cm
+                    dpi_x, dpi_y = x * factor, y * factor
+            elif marker[1] == 0xEE and segment[:5] == b'Adobe':
+                adobe = True
+            elif marker[1] in SOF_MARKERS:
+                _, height, width, components = struct.unpack('>BHHB', segment[:6])
+                return JpegInfo(width, height, components, dpi_x, dpi_y, adobe)
+            elif marker[1] == 0xDA:  # start of scan without frame header
+                raise ValueError(f'invalid jpeg file: {filepath}')
+
+
+class PdfWriter:
+    """
+    write a multipage pdf, one jpeg image per page, streaming:
+    jpeg files are embedded as is (DCTDecode, no re-encoding), and written page by page,
+    so memory stays bounded whatever the number of pages.
+    """
+    CATALOG_ID = 1
+    PAGES_ID = 2
+
+    def __init__(self, fileobj):
+        self._file = fileobj
+        self._offsets = {}
+        self._page_ids = []
+        self._next_id = 3
+        self._file.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def _begin_object(self, object_id):
+        self._offsets[object_id] = self._file.tell()
+        self._file.write(f'{object_id} 0 obj\n'.encode())
+
+    def _write_object(self, object_id, content):
+        self._begin_object(object_id)
+        self._file.write(content.encode() + b'\nendobj\n')
+
+    def add_jpeg_page(self, filepath):
+        """
+        :return: size of the embedded jpeg in bytes.
+        """
+        info = read_jpeg_info(filepath)
+        if info.components not in COLOR_SPACES:
+            raise ValueError(f'unsupported jpeg ({info.components} components): {filepath}')
+        image_id, content_id, page_id = self._next_id, self._next_id + 1, self._next_id + 2
+        self._next_id += 3
+
+        # image: the jpeg file, as is
+        decode = ' /Decode [1 0 1 0 1 0 1 0]' if info.components == 4 and info.adobe else ''
+        with open(filepath, 'rb') as jpeg:
+            size = os.fstat(jpeg.fileno()).st_size
+            self._begin_object(image_id)
+            self._file.write(f'<< /Type /XObject /Subtype /Image /Width {info.width} /Height {info.height} '
+                             f'/ColorSpace {COLOR_SPACES[info.components]} /BitsPerComponent 8{decode} '
+                             f'/Filter /DCTDecode /Length {size} >>\nstream\n'.encode())
+            copyfileobj(jpeg, self._file, 1024 * 1024)
+        self._file.write(b'\nendstream\nendobj\n')
+
+        # page: image scaled to its physical size
+        width = info.width * 72 / info.dpi_x
+        height = info.height * 72 / info.dpi_y
+        content = f'q {width:.2f} 0 0 {height:.2f} 0 0 cm /Im0 Do Q'
+        self._write_object(content_id, f'<< /Length {len(content)} >>\nstream\n{content}\nendstream')
+        self._write_object(page_id, f'<< /Type /Page /Parent {self.PAGES_ID} 0 R '
+                                    f'/MediaBox [0 0 {width:.2f} {height:.2f}] '
+                                    f'/Resources << /XObject << /Im0 {image_id} 0 R >> >> '
+                                    f'/Contents {content_id} 0 R >>')
+        self._page_ids.append(page_id)
+        return size
+
+    def close(self):
+        kids = ' '.join(f'{page_id} 0 R' for page_id in self._page_ids)
+        self._write_object(self.PAGES_ID, f'<< /Type /Pages /Kids [{kids}] /Count {len(self._page_ids)} >>')
+        self._write_object(self.CATALOG_ID, f'<< /Type /Catalog /Pages {self.PAGES_ID} 0 R >>')
+        xref_offset = self._file.tell()
+        self._file.write(f'xref\n0 {self._next_id}\n0000000000 65535 f \n'.encode())
+        for object_id in range(1, self._next_id):
+            self._file.write(f'{self._offsets[object_id]:010d} 00000 n \n'.encode())
+        self._file.write(f'trailer\n<< /Size {self._next_id} /Root {self.CATALOG_ID} 0 R >>\n'
+                         f'startxref\n{xref_offset}\n%%EOF\n'.encode())
+
+
+class _HashingFile:
+    """
+    file wrapper hashing what is written through it (PdfWriter only writes sequentially).
+    """
+    def __init__(self, fileobj, algorithm):
+        self._file = fileobj
+        self.digest = hashlib.new(algorithm)
+
+    def write(self, data):
+        self.digest.update(data)
+        return self._file.write(data)
+
+    def tell(self):
+        return self._file.tell()
+
+
+def write_pdf(input_filepaths, pdf_filepath, progress=None, cancel=None, checksum=None):
+    """
+    write jpeg files, in the given order, as a multipage pdf.
+    The pdf is written next to its final location, and renamed once complete.
+
+    :param input_filepaths: sorted list of jpeg file paths.
+    :param pdf_filepath: output pdf file path.
+    :param progress: callable(CopyProgress), called after each page (optional).
+    :param cancel: threading.Event, once set, writing stops with InterruptedError (optional).
+    :param checksum: hashlib algorithm name: hash the pdf while writing it (optional).
+    :return: hex digest of the pdf if checksum, else None.
+    """
+    tmp_filepath = path.join(path.dirname(pdf_filepath), '.' + path.basename(pdf_filepath) + '.tmp')
+    bytes_total = sum(os.stat(f).st_size for f in input_filepaths)
+    bytes_done = 0
+    start_time = time.perf_counter()
+    debug = logger.isEnabledFor(logging.DEBUG)
+    try:
+        with open(tmp_filepath, 'wb') as f:
+            out = _HashingFile(f, checksum) if checksum else f
+            writer = PdfWriter(out)
+            for i, filepath in enumerate(input_filepaths):
+                if cancel is not None and cancel.is_set():
+                    raise InterruptedError('pdf cancelled.')
+                if debug:
+                    logger.debug('pdf page: %s', filepath)
+                bytes_done += writer.add_jpeg_page(filepath)
+                if progress:
+                    progress(CopyProgress(i + 1, len(input_filepaths), bytes_done, bytes_total,
+                                          time.perf_counter() - start_time))
+            writer.close()
+        os.replace(tmp_filepath, pdf_filepath)
+        return out.digest.hexdigest() if checksum else None
+    except BaseException:
+        if path.exists(tmp_filepath):
+            os.remove(tmp_filepath)
+        raise
@@ -0,0 +1,91 @@
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+_subscribers = []
+_lock = threading.Lock()
+
+
+class Span:
+    """
+    a timed phase (eg. 'scan', 'copy'), with counters (eg. files, bytes).
+    """
+    __slots__ = ('name', 'start', 'duration', 'counters')
+
+    def __init__(self, name, counters):
+        self.name = name
+        self.start = time.time()
+        self.duration = None
+        self.counters = counters
+
+    def count(self, **counters):
+        """ add to counters, eg. span.count(files=1, bytes=1024) """
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+
+def subscribe(callback):
+    """
+    :param callback: callable(Span), called at the end of every span, from the thread that ran it.
+    """
+    with _lock:
+        _subscribers.append(callback)
+
+
+def unsubscribe(callback):
+    with _lock:
+        _subscribers.remove(callback)
+
+
+@contextmanager
+def span(name, **counters):
+    """
+    time the enclosed block, and report it to subscribers:
+
+        with span('copy', files=len(jobs)) as s:
+            ...
+            s.count(bytes=size)
+    """
+    record = Span(name, counters)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record.duration = time.perf_counter() - start
+        for callback in list(_subscribers):
+            callback(record)
+
+
+class Profile:
+    """
+    subscriber that aggregates spans per phase: number of calls, total duration and counters.
+    """
+    def __init__(self):
+        self._phases = {}
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    def __call__(self, record):
+        with self._lock:
+            phase = self._phases.setdefault(record.name, {'calls': 0, 'duration': 0.})
+            phase['calls'] += 1
+            phase['duration'] += record.duration
+            for key, value in record.counters.items():
+                phase[key] = phase.get(key, 0) + value
+
+    def __enter__(self):
+        subscribe(self)
+        return self
+
+    def __exit__(self, *exc):
+        unsubscribe(self)
+
+    def report(self):
+        with self._lock:
+            return {'elapsed': time.perf_counter() - self._start,
+                    'phases': {name: dict(phase) for name, phase in self._phases.items()}}
+
+    def save(self, filepath):
+        with open(filepath, 'w') as f:
+            json.dump(self.report(), f, indent=2)
@@ -0,0 +1,106 @@
+import os
+import os.path as path
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _key(filepath):
+    return path.normcase(path.abspath(filepath))
+
+
+def _existing_ancestor(filepath):
+    dirpath = path.abspath(filepath)
+    while not path.exists(dirpath):
+        parent = path.dirname(dirpath)
+        if parent == dirpath:
+            break
+        dirpath = parent
+    return dirpath
+
+
+def same_filesystem(source_filepaths, output_filepaths):
+    """
+    :return: True if all sources and destinations are on the same file system (ie. a rename is enough).
+    """
+    devices = {os.stat(f).st_dev for f in source_filepaths}
+    devices |= {os.stat(_existing_ancestor(path.dirname(f))).st_dev for f in output_filepaths}
+    return len(devices) <= 1
+
+
+def plan_renames(input_filepaths, output_filepaths):
+    """
+    compute the list of renames that moves every input to its output, in two phases:
+    a source whose destination is the path of another source (collisions, cycles like a <-> b) is first
+    renamed to an intermediate unique name next to it, then every direct rename is done, and finally
+    intermediate files are renamed to their destination.
+    It takes at most 2 renames per file, and never overwrite a source before it has been moved.
+
+    :param input_filepaths: list of source file paths.
+    :param output_filepaths: list of destination file paths (same length, no duplicates).
+    :return: list of (from, to) renames, to be applied in order with os.replace.
+    """
+    assert len(input_filepaths) == len(output_filepaths)
+    destinations = [_key(f) for f in output_filepaths]
+    if len(set(destinations)) != len(destinations):
+        raise ValueError('several files would be renamed to the same destination.')
+    pairs = [(src, dst) for src, dst in zip(input_filepaths, output_filepaths) if _key(src) != _key(dst)]
+    sources = {_key(src) for src, _ in pairs}
+    token = uuid.uuid4().hex[:8]
+    staging, direct, unstaging = [], [], []
+    for i, (src, dst) in enumerate(pairs):
+        if _key(dst) in sources:
+            tmp = path.join(path.dirname(src), f'.debrother-{token}-{i:05d}{path.splitext(src)[1]}')
+            staging.append((src, tmp))
+            unstaging.append((tmp, dst))
+        else:
+            direct.append((src, dst))
+    return staging + direct + unstaging
+
+
+def apply_renames(renames, on_done=None):
+    """
+    apply renames in order with os.replace, creating destination directories if needed.
+    If one fails (or the job is interrupted, eg. by Ctrl+C), renames already done are reverted,
+    and the error is raised.
+    :param renames: list of (from, to), as given by plan_renames.
+    :param on_done: optional callable, called with the index of each rename once done.
+    """
+    nb_done = 0
+    dirpaths = set()
+    debug = logger.isEnabledFor(logging.DEBUG)
+    try:
+        for src, dst in renames:
+            if debug:
+                logger.debug('rename: %s -> %s', src, dst)
+            dst_dirpath = path.dirname(dst)
+            if dst_dirpath and dst_dirpath not in dirpaths:
+                os.makedirs(dst_dirpath, exist_ok=True)
+                dirpaths.add(dst_dirpath)
+            os.replace(src, dst)
+            nb_done += 1
+            if on_done is not None:
+                on_done(nb_done - 1)
+    except BaseException:
+        logger.critical('failed to rename one or more files: roll back actually renamed')
+        revert_renames(renames, nb_done)
+        raise
+
+
+def revert_renames(renames, nb_done):
+    """
+    revert the first renames of a plan, eg. those done by a killed job.
+    Reverting twice is harmless: a rename already reverted has its source back.
+    :param renames: list of (from, to), as given by plan_renames.
+    :param nb_done: number of renames known to be done. The next one may be done too
+        (killed before it was counted): it is, if its source, which existed before, is gone
+        and its destination exists.
+    """
+    if nb_done < len(renames):
+        src, dst = renames[nb_done]
+        if not path.exists(src) and path.exists(dst):
+            nb_done += 1
+    for src, dst in reversed(renames[:nb_done]):
+        if not path.exists(src) and path.exists(dst):
+            os.replace(dst, src)
@@ -0,0 +1,169 @@
+import os
+import os.path as path
+import json
+import time
+import threading
+import logging
+from collections import Counter
+from naming import NAMING_FIELDS, NamingProfile, NamingMatcher
+from config import default_cache_dirpath
+
+logger = logging.getLogger(__name__)
+
+SCAN_INDEX_VERSION = 5
+# a directory (or file) modified less than that before the scan may still change within the same mtime tick.
+RACY_DELAY_NS = 2 * 10**9
+# number of input roots kept in the cache file
+MAX_CACHED_ROOTS = 16
+
+
+def default_cache_filepath():
+    """
+    :return: path of the scan index cache file ($XDG_CACHE_HOME/debrother/scanindex.json)
+    """
+    return path.join(default_cache_dirpath(), 'scanindex.json')
+
+
+class ScanIndex:
+    """
+    Remembers, for every directory below an input root, its mtime and the scan files it contains
+    (with the fields parsed by the naming profiles, and their size and mtime), and the naming profile
+    of most of its files. On the next scan, only directories whose mtime changed are listed again,
+    trying that profile first.
+    Writing to a file does not change its directory mtime: files modified just before they were listed
+    (maybe still being written) are stat'ed again on every scan, others only if asked (see scan).
+
+    The index is keyed by absolute input root, and can be persisted in a small json cache file.
+    """
+    def __init__(self, matcher, cache_filepath=None):
+        """
+        :param matcher: NamingMatcher, or a compiled regex (a single naming profile), matched against file names.
+        :param cache_filepath: json file where the index is loaded from and saved to (optional).
+        """
+        if not isinstance(matcher, NamingMatcher):
+            matcher = NamingMatcher([NamingProfile('custom', matcher.pattern)])
+        self._matcher = matcher
+        self._cache_filepath = cache_filepath
+        self._roots = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        if not self._cache_filepath or not path.isfile(self._cache_filepath):
+            return
+        try:
+            with open(self._cache_filepath, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f'ignoring invalid scan index {self._cache_filepath}: {e}')
+            return
+        if data.get('version') != SCAN_INDEX_VERSION or data.get('pattern') != self._matcher.pattern:
+            logger.info(f'ignoring outdated scan index {self._cache_filepath}')
+            return
+        self._roots = data.get('roots', {})
+
+    def save(self):
+        if not self._cache_filepath:
+            return
+        # only keep most recently used roots
+        with self._lock:
+            roots = list(self._roots.items())
+        roots = sorted(roots, key=lambda kv: kv[1]['used'], reverse=True)
+        data = {
+            'version': SCAN_INDEX_VERSION,
+            'pattern': self._matcher.pattern,
+            'roots': dict(roots[:MAX_CACHED_ROOTS]),
+        }
+        os.makedirs(path.dirname(self._cache_filepath) or '.', exist_ok=True)
+        tmp_filepath = self._cache_filepath + '.tmp'
+        with open(tmp_filepath, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_filepath, self._cache_filepath)
+
+    def scan(self, input_dirpath, cancel=None, fresh=False):
+        """
+        list all files matching the naming convention below input_dirpath,
+        only listing again directories that changed since previous scan.
+
+        :param input_dirpath: input root directory.
+        :param cancel: threading.Event, if set while scanning, InterruptedError is raised (optional).
+        :param fresh: stat again files of directories not listed again, when sizes and mtimes must be current
+            (eg. to sort by time, or before deleting originals), instead of using those of the index.
+        :return: list of (filepath, fields, size, mtime_ns) where fields is the dict given by NamingMatcher.match.
+        """
+        if not path.isdir(input_dirpath):
+            return []
+        root_key = path.abspath(input_dirpath)
+        cached = self._roots.get(root_key, {}).get('dirs', {})
+        racy_limit = time.time_ns() - RACY_DELAY_NS
+        field_names = NAMING_FIELDS + ('profile',)
+        dirs = {}
+        nb_listed = 0
+        results = []
+        pending = ['']
+        while pending:
+            if cancel is not None and cancel.is_set():
+                raise InterruptedError('scan cancelled.')
+            subpath = pending.pop()
+            dirpath = path.join(input_dirpath, subpath) if subpath else input_dirpath
+            try:
+                mtime = os.stat(dirpath).st_mtime_ns
+            except OSError:
+                continue
+            entry = cached.get(subpath)
+            listed = entry is None or entry['mtime'] != mtime
+            if listed:
+                profile = entry.get('profile') if entry else None
+                entry = self._list_dir(dirpath, mtime if mtime < racy_limit else None, profile)
+                if entry is None:
+                    continue
+                nb_listed += 1
+            dirs[subpath] = entry
+            pending.extend(path.join(subpath, d) for d in entry['subdirs'])
+            for record in entry['files']:
+                name, *fields, size, file_mtime = record
+                filepath = path.join(dirpath, name)
+                if file_mtime is None or (fresh and not listed):
+                    try:
+                        st = os.stat(filepath)
+                    except OSError:  # removed meanwhile
+                        continue
+                    size, file_mtime = st.st_size, st.st_mtime_ns
+                # a file modified just before the scan may still be written: stat it again next time
+                record[-2:] = [size, file_mtime] if file_mtime < racy_limit else [None, None]
+                results.append((filepath, dict(zip(field_names, fields)), size, file_mtime))
+
+        logger.debug(f'scan index: {len(dirs)} directories, {nb_listed} listed again.')
+        with self._lock:
+            self._roots[root_key] = {'used': time.time(), 'dirs': dirs}
+        return results
+
+    def _list_dir(self, dirpath, mtime, profile=None):
+        """
+        :param profile: naming profile to try first (the one of the previous listing).
+        :return: a fresh index entry for dirpath, or None if not readable.
+        """
+        subdirs, files = [], []
+        profiles = Counter()
+        try:
+            with os.scandir(dirpath) as it:
+                for dir_entry in it:
+                    if dir_entry.is_dir():
+                        # like os.walk, do not follow symlinks to directories
+                        if not dir_entry.is_symlink():
+                            subdirs.append(dir_entry.name)
+                        continue
+                    fields = self._matcher.match(dir_entry.name, profile)
+                    if fields:
+                        try:  # free with the listing on Windows, a single stat otherwise
+                            st = dir_entry.stat()
+                        except OSError:  # removed meanwhile
+                            continue
+                        files.append([dir_entry.name] + [fields[f] for f in NAMING_FIELDS]
+                                     + [fields['profile'], st.st_size, st.st_mtime_ns])
+                        profiles[fields['profile']] += 1
+                        # files of a directory usually come from the same device
+                        profile = profile or fields['profile']
+        except OSError:
+            return None
+        profile = profiles.most_common(1)[0][0] if profiles else None
+        return {'mtime': mtime, 'subdirs': subdirs, 'files': files, 'profile': profile}
@@ -0,0 +1,351 @@
+import os
+import os.path as path
+import json
+import hashlib
+import shutil
+import time
+import threading
+import logging
+from renameplan import revert_renames
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+STAGING_PREFIX = '.debrother-'
+JOURNAL_FILENAME = 'journal.jsonl'
+# held by the job using a staging directory, recovery skips locked directories
+LOCK_FILENAME = 'lock'
+# a staging directory can be locked briefly by a recovery: wait that long before giving up
+LOCK_TIMEOUT = 2.
+
+
+def _try_lock(lock_filepath):
+    """
+    :return: the open lock file, or None if it is locked by another job (of this process or another one).
+    """
+    f = open(lock_filepath, 'a+b')
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+def _remove_locked(dirpath, lock):
+    """
+    remove a staging directory, then release its lock.
+    """
+    shutil.rmtree(dirpath, ignore_errors=True)
+    lock.close()
+    if fcntl is None:  # windows cannot remove a locked file
+        shutil.rmtree(dirpath, ignore_errors=True)
+
+
+def _open_locked(dirpath):
+    """
+    create a staging directory (or reuse an existing one), and lock it.
+    :return: the open lock file.
+    :raise BlockingIOError: if a running job holds the lock.
+    """
+    lock_filepath = path.join(dirpath, LOCK_FILENAME)
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while True:
+        os.makedirs(dirpath, exist_ok=True)
+        try:
+            lock = _try_lock(lock_filepath)
+        except FileNotFoundError:  # removed by a recovery meanwhile
+            continue
+        if lock is None:
+            if time.monotonic() > deadline:
+                raise BlockingIOError(f'job {path.basename(dirpath)[len(STAGING_PREFIX):]} is already running.')
+            time.sleep(0.05)
+        elif path.exists(lock_filepath) and path.samestat(os.stat(lock_filepath), os.fstat(lock.fileno())):
+            return lock
+        else:  # removed by a recovery before it was locked: start over
+            lock.close()
+
+
+class Journal:
+    """
+    append-only journal of completed steps, one json record per line.
+    A truncated last line (crash while writing) is ignored when reading.
+    """
+    def __init__(self, filepath):
+        self._filepath = filepath
+        self._lock = threading.Lock()
+
+    def read(self):
+        if not path.isfile(self._filepath):
+            return []
+        records = []
+        with open(self._filepath, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+        return records
+
+    def append(self, sync=False, **record):
+        with self._lock, open(self._filepath, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            if sync:
+                os.fsync(f.fileno())
+
+
+def _tmp_filepath(staging_dirpath, index, output_filepath):
+    return path.join(staging_dirpath, f'{index:05d}{path.splitext(output_filepath)[1]}')
+
+
+def get_staging_root(output_filepaths):
+    """
+    :return: the directory holding staging directories: the common directory of all outputs.
+    """
+    return path.commonpath([path.dirname(path.abspath(f)) for f in output_filepaths])
+
+
+class Staging:
+    """
+    stage copies in a hidden directory of the output directory (same file system as the outputs),
+    so that publishing a page is an atomic rename. Every completed step is written in a journal,
+    so that an interrupted job can be resumed without copying finished pages again.
+
+    steps:
+     - copy: sources are copied into the staging directory (journal: `copied`),
+     - commit: staged copies are renamed to their destinations (journal: `commit`, `moved`),
+     - publish: all destinations are in place (journal: `published`), sources can be deleted (`deleted`).
+    """
+    def __init__(self, input_filepaths, output_filepaths, delete_after_success=False):
+        assert len(input_filepaths) == len(output_filepaths)
+        self.input_filepaths = list(input_filepaths)
+        self.output_filepaths = list(output_filepaths)
+        self.delete_after_success = bool(delete_after_success)
+        job = json.dumps([self.input_filepaths, self.output_filepaths, self.delete_after_success])
+        self.job_id = hashlib.sha1(job.encode('utf-8')).hexdigest()[:16]
+        self.root_dirpath = get_staging_root(self.output_filepaths)
+        self.dirpath = path.join(self.root_dirpath, STAGING_PREFIX + self.job_id)
+        self.journal = Journal(path.join(self.dirpath, JOURNAL_FILENAME))
+        self.tmp_filepaths = [_tmp_filepath(self.dirpath, i, dst) for i, dst in enumerate(self.output_filepaths)]
+        # step reached: 'copy', 'commit' or 'published'
+        self.step = 'copy'
+        # index -> content hash of copied pages (if computed)
+        self.digests = {}
+        # index -> [size, mtime_ns] of sources, taken before they were copied (if recorded)
+        self.source_stats = {}
+        self._lock = None
+
+    def open(self):
+        """
+        create the staging directory, or resume the one of a previous interrupted run of the same job,
+        and lock it until close.
+        :return: set of indices of pages already copied.
+        :raise BlockingIOError: if the same job is running.
+        """
+        self._lock = _open_locked(self.dirpath)
+        records = self.journal.read()
+        self.digests = {r['copied']: r['hash'] for r in records if r.get('hash')}
+        self.source_stats = {r['copied']: r['stat'] for r in records if r.get('stat')}
+        if any('published' in r for r in records):
+            self.step = 'published'
+        elif any('commit' in r for r in records):
+            self.step = 'commit'
+        if self.step != 'copy':
+            logger.info(f'resuming job {self.job_id} at step {self.step}.')
+            return set(range(len(self.input_filepaths)))
+        if not records:
+            self.journal.append(sync=True, begin={
+                'inputs': self.input_filepaths,
+                'outputs': self.output_filepaths,
+                'delete': self.delete_after_success,
+            })
+            return set()
+        copied = {r['copied'] for r in records if 'copied' in r}
+        # only trust copies that are still complete
+        copied = {i for i in copied
+                  if path.isfile(self.tmp_filepaths[i])
+                  and os.stat(self.tmp_filepaths[i]).st_size == os.stat(self.input_filepaths[i]).st_size}
+        logger.info(f'resuming job {self.job_id}: {len(copied)} pages already copied.')
+        return copied
+
+    def mark_copied(self, index, digest=None, stat=None):
+        """
+        :param index: index of the page copied.
+        :param digest: content hash computed while copying (optional).
+        :param stat: [size, mtime_ns] of the source before it was copied (optional).
+        """
+        self.journal.append(copied=index, hash=digest, stat=stat)
+        if digest:
+            self.digests[index] = digest
+        if stat:
+            self.source_stats[index] = stat
+
+    def commit(self):
+        """
+        rename every staged copy to its destination. If one fails, roll back (renamed files go back
+        into the staging directory, so a later run does not copy them again), and raise.
+        """
+        self.step = 'commit'
+        self.journal.append(sync=True, commit=True)
+        moved = []
+        dirpaths = set()
+        debug = logger.isEnabledFor(logging.DEBUG)
+        try:
+            for i, (tmp, dst) in enumerate(zip(self.tmp_filepaths, self.output_filepaths)):
+                if not path.exists(tmp):  # already moved by an interrupted run
+                    continue
+                if debug:
+                    logger.debug('move: %s -> %s', tmp, dst)
+                dst_dirpath = path.dirname(dst)
+                if dst_dirpath and dst_dirpath not in dirpaths:
+                    os.makedirs(dst_dirpath, exist_ok=True)
+                    dirpaths.add(dst_dirpath)
+                os.replace(tmp, dst)
+                moved.append(i)
+                self.journal.append(moved=i)
+        except OSError:
+            for i in reversed(moved):
+                os.replace(self.output_filepaths[i], self.tmp_filepaths[i])
+                self.journal.append(unmoved=i)
+            raise
+        self.journal.append(sync=True, published=True)
+        self.step = 'published'
+
+    def delete_sources(self):
+        debug = logger.isEnabledFor(logging.DEBUG)
+        for i, src in enumerate(self.input_filepaths):
+            if debug:
+                logger.debug('delete: %s', src)
+            if path.exists(src):
+                os.remove(src)
+            self.journal.append(deleted=i)
+
+    def release(self):
+        """
+        unlock the staging directory, keeping it so that a later run can resume the job.
+        """
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
+
+    def close(self):
+        if self._lock is None:
+            shutil.rmtree(self.dirpath, ignore_errors=True)
+        else:
+            _remove_locked(self.dirpath, self._lock)
+            self._lock = None
+
+
+class RenameJournal:
+    """
+    journal of an in place rename plan (see renameplan.plan_renames), in a staging directory:
+    it is written before the first rename, so that recover_staging can revert the renames of a job
+    killed before it was done (pages would be left under hidden intermediate names otherwise).
+    """
+    def __init__(self, root_dirpath, renames):
+        """
+        :param root_dirpath: directory holding the staging directory (see get_staging_root).
+        :param renames: list of (from, to), as given by plan_renames.
+        """
+        self.renames = [list(rename) for rename in renames]
+        self.job_id = hashlib.sha1(json.dumps(self.renames).encode('utf-8')).hexdigest()[:16]
+        self.dirpath = path.join(root_dirpath, STAGING_PREFIX + self.job_id)
+        self.journal = Journal(path.join(self.dirpath, JOURNAL_FILENAME))
+        self.nb_done = 0
+        self._lock = None
+
+    def open(self):
+        self._lock = _open_locked(self.dirpath)
+        self.journal.append(sync=True, renames=self.renames)
+
+    def mark_renamed(self, index):
+        """
+        record that a rename is done (not synced: recovery checks the one after the last recorded).
+        :param index: index of the rename in the plan.
+        """
+        self.journal.append(renamed=index)
+        self.nb_done = index + 1
+
+    def release(self):
+        """
+        unlock the staging directory, keeping it for a later recovery.
+        """
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
+
+    def close(self):
+        """
+        every rename is done: drop the journal.
+        """
+        _remove_locked(self.dirpath, self._lock)
+        self._lock = None
+
+
+def recover_staging(root_dirpath, keep=None, keep_uncommitted=False):
+    """
+    clean up staging directories left by interrupted jobs in root_dirpath (directories locked by
+    a running job are left untouched):
+     - jobs interrupted before their commit are dropped (their outputs were not touched yet),
+     - jobs interrupted during their commit are rolled forward: every page was copied before the commit,
+       staged copies left are renamed to their outputs,
+     - published jobs are rolled forward too (sources are deleted if requested),
+     - in place renames interrupted before they were done are reverted (see RenameJournal).
+
+    :param root_dirpath: directory that may contain staging directories.
+    :param keep: name of a staging directory to leave untouched (eg. the one being resumed).
+    :param keep_uncommitted: leave jobs interrupted before their commit, so that they can be resumed.
+    :return: list of recovered staging directory paths.
+    """
+    recovered = []
+    if not path.isdir(root_dirpath):
+        return recovered
+    for entry in os.scandir(root_dirpath):
+        if not entry.name.startswith(STAGING_PREFIX) or entry.name == keep or not entry.is_dir():
+            continue
+        try:
+            lock = _try_lock(path.join(entry.path, LOCK_FILENAME))
+        except FileNotFoundError:  # removed meanwhile
+            continue
+        if lock is None:  # in use
+            continue
+        records = Journal(path.join(entry.path, JOURNAL_FILENAME)).read()
+        begin = records[0].get('begin') if records else None
+        published = any('published' in r for r in records)
+        committing = any('commit' in r for r in records)
+        if keep_uncommitted and begin is not None and not committing:
+            lock.close()
+            continue
+        try:
+            if records and 'renames' in records[0]:
+                logger.warning(f'reverting interrupted renames in {entry.path}')
+                nb_done = max((record['renamed'] + 1 for record in records if 'renamed' in record), default=0)
+                revert_renames(records[0]['renames'], nb_done)
+            if begin is not None and committing and not published:
+                logger.warning(f'rolling forward interrupted commit in {entry.path}')
+                for i, dst in enumerate(begin['outputs']):
+                    tmp = _tmp_filepath(entry.path, i, dst)
+                    if path.exists(tmp):
+                        os.makedirs(path.dirname(dst) or '.', exist_ok=True)
+                        os.replace(tmp, dst)
+                published = True
+            if begin is not None and published and begin['delete']:
+                logger.warning(f'rolling forward interrupted job in {entry.path}')
+                for src in begin['inputs']:
+                    if path.exists(src):
+                        os.remove(src)
+        except OSError as e:  # kept for a later recovery
+            logger.error(f'failed to recover {entry.path}: {e}')
+            lock.close()
+            continue
+        _remove_locked(entry.path, lock)
+        recovered.append(entry.path)
+    return recovered
@@ -0,0 +1,100 @@
+import unittest
+from PageListView import PageListView, diff_rows
+
+
+class FakeTreeview:
+    """ the subset of ttk.Treeview used by PageListView, recording calls. """
+    def __init__(self):
+        self.items = {}
+        self.children = []
+        self.calls = []
+
+    def insert(self, parent, index, text, values):
+        iid = f'I{len(self.calls):03}'
+        self.calls.append('insert')
+        self.items[iid] = (text, tuple(values))
+        self.children.append(iid)
+        return iid
+
+    def delete(self, *iids):
+        self.calls.append('delete')
+        for iid in iids:
+            del self.items[iid]
+            self.children.remove(iid)
+
+    def item(self, iid, text, values):
+        self.calls.append('item')
+        self.items[iid] = (text, tuple(values))
+
+    def get_children(self):
+        return tuple(self.children)
+
+    def set_children(self, parent, *iids):
+        self.calls.append('set_children')
+        self.children = list(iids)
+
+    def after(self, ms, func, *args):
+        func(*args)
+
+    # a window of 3 rows, scrolled by 1
+    def identify_row(self, y):
+        return self.children[1] if len(self.children) > 1 else ''
+
+    def bbox(self, iid):
+        return (0, 0, 100, 20) if iid in self.children[1:4] else ''
+
+    def next(self, iid):
+        i = self.children.index(iid) + 1
+        return self.children[i] if i < len(self.children) else ''
+
+    def selection(self):
+        return tuple(self.children[2:3])
+
+    def displayed(self):
+        return [self.items[iid] for iid in self.children]
+
+
+class TestPageListView(unittest.TestCase):
+    def setUp(self):
+        self._rows = [(f'scan_{i}.jpg', i, f'{i + 1:04}', f'scan_{i}.jpg', f'{5 - i:03}.jpg') for i in range(5)]
+
+    def test_diff(self):
+        displayed = {row[0]: row for row in self._rows[:3]}
+        new_rows = self._rows[1:]
+        new_rows[0] = new_rows[0][:4] + ('renamed.jpg',)
+        removed, inserted, updated = diff_rows(displayed, new_rows)
+        self.assertListEqual(['scan_0.jpg'], removed)
+        self.assertListEqual(self._rows[3:], inserted)
+        self.assertListEqual([new_rows[0]], updated)
+
+    def test_visible(self):
+        list_view = PageListView(FakeTreeview())
+        list_view.update(self._rows, 0)
+        self.assertListEqual([row[0] for row in self._rows[1:4]], list_view.visible_keys())
+        self.assertListEqual([self._rows[2][0]], list_view.selected_keys())
+
+    def test_update_in_place(self):
+        view = FakeTreeview()
+        list_view = PageListView(view)
+        list_view.update(self._rows, 0)
+        self.assertEqual(5, view.calls.count('insert'))
+        renamed = [row[:4] + ('renamed_' + row[4],) for row in self._rows]
+        view.calls.clear()
+        list_view.update(renamed)
+        self.assertListEqual(['item'] * 5, view.calls)
+        self.assertListEqual([(row[1], row[2:]) for row in renamed], view.displayed())
+
+    def test_sort_moves(self):
+        view = FakeTreeview()
+        list_view = PageListView(view)
+        list_view.update(self._rows, 0)
+        view.calls.clear()
+        list_view.sort(3)
+        self.assertListEqual([(row[1], row[2:]) for row in reversed(self._rows)], view.displayed())
+        list_view.sort(0)
+        self.assertListEqual(['set_children'] * 2, view.calls)
+        self.assertListEqual([(row[1], row[2:]) for row in self._rows], view.displayed())
+
+
+if __name__ == '__main__':
+    unittest.main()
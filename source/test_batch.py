@@ -0,0 +1,60 @@
+import unittest
+import os
+import os.path as path
+import json
+import tempfile
+from benchmark import generate_scan_tree
+from batch import load_batch, run_batch, group_overlapping
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self._root = self._tmp.name
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_run_batch(self):
+        generate_scan_tree(path.join(self._root, 'alice'), 8, nb_sessions=1)
+        generate_scan_tree(path.join(self._root, 'bob'), 8, nb_sessions=2)
+        os.makedirs(path.join(self._root, 'carol'))
+        open(path.join(self._root, 'carol', 'Numérisation_20190101.jpg'), 'w').close()
+        batch_filepath = path.join(self._root, 'batch.json')
+        with open(batch_filepath, 'w') as f:
+            json.dump({'defaults': {'pattern': '{page:02}.{ext}'},
+                       'roots': [{'input': path.join(self._root, 'alice'), 'output': path.join(self._root, 'out')},
+                                 {'input': path.join(self._root, 'bob'), 'sessions': True},
+                                 path.join(self._root, 'carol')]}, f)
+        roots = load_batch(batch_filepath)
+        self.assertEqual('{page:02}.{ext}', roots[2]['pattern'])
+        summary = run_batch(roots, max_roots=2)
+        self.assertListEqual(['ok', 'ok', 'failed'], [report['status'] for report in summary['roots']])
+        self.assertEqual(17, summary['totals']['files'])
+        self.assertEqual(16 * 1024, summary['totals']['bytes'])
+        self.assertEqual(8, len([f for f in os.listdir(path.join(self._root, 'out')) if not f.startswith('.')]))
+        self.assertEqual(2, len(summary['roots'][1]['sessions']))
+
+        with open(batch_filepath, 'w') as f:
+            json.dump([{'input': 'x', 'typo': 1}], f)
+        with self.assertRaises(KeyError):
+            load_batch(batch_filepath)
+        # both roots would write out/001.jpg, ...
+        with open(batch_filepath, 'w') as f:
+            json.dump({'defaults': {'output': path.join(self._root, 'out')}, 'roots': ['a', 'b']}, f)
+        with self.assertRaises(ValueError):
+            load_batch(batch_filepath)
+
+    def test_overlapping_roots(self):
+        roots = [{'input': '/scans/alice', 'output': '/archive'},
+                 {'input': '/scans/bob', 'output': '/archive/bob'},
+                 {'input': '/scans/carol', 'output': None},
+                 {'input': '/scans', 'output': '/other'}]
+        self.assertListEqual([[0, 1]], group_overlapping(roots[:2]))
+        self.assertListEqual([[0, 1], [2]], group_overlapping(roots[:3]))
+        # the last root chains all others
+        self.assertListEqual([[0, 1, 2, 3]], group_overlapping(roots))
+
+
+if __name__ == '__main__':
+    unittest.main()
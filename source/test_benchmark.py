@@ -0,0 +1,25 @@
+import unittest
+import tempfile
+from core import populate_pages, sort_policy
+from benchmark import generate_scan_tree, find_regressions
+from duplicates import find_duplicates
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_generate_scan_tree(self):
+        with tempfile.TemporaryDirectory() as root:
+            filepaths = generate_scan_tree(root, 40, file_size=10, nb_sessions=2)
+            self.assertEqual(40, len(filepaths))
+            self.assertListEqual(sorted(filepaths), populate_pages(root))
+            self.assertEqual(40, len(sort_policy(filepaths, True, True, True)))
+            # pages differ: none is taken for a duplicate
+            self.assertDictEqual({}, find_duplicates(filepaths))
+
+    def test_find_regressions(self):
+        baseline = {'10': {'sort_policy': 1.0, 'rename_files': 1.0}}
+        results = {'10': {'sort_policy': 1.1, 'rename_files': 2.0}, '100': {'sort_policy': 5.0}}
+        self.assertListEqual([('10', 'rename_files', 2.0, 1.0)], find_regressions(results, baseline, 0.25))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+import os
+import os.path as path
+import tempfile
+from blankpage import BlankCache, find_blank_pages, get_executor
+from config import is_pil_available
+
+
+class TestBlankPage(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self._root = self._tmp.name
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_cache(self):
+        filepath = path.join(self._root, 'page.jpg')
+        with open(filepath, 'wb') as f:
+            f.write(b'X')
+        cache_filepath = path.join(self._root, 'cache', 'blankscores.json')
+        cache = BlankCache(cache_filepath)
+        cache.set(filepath, os.stat(filepath), 0.)
+        cache.save()
+        cache = BlankCache(cache_filepath)
+        cache.load()
+        self.assertEqual(0., cache.get(filepath, os.stat(filepath)))
+        # cached scores only: nothing to decode
+        self.assertSetEqual({0}, find_blank_pages([filepath], cache=cache))
+        # a changed file is scored again
+        with open(filepath, 'ab') as f:
+            f.write(b'X')
+        self.assertIsNone(cache.get(filepath, os.stat(filepath)))
+
+    @unittest.skipUnless(is_pil_available(), 'needs PIL')
+    def test_find_blank_pages(self):
+        from PIL import Image, ImageDraw
+        filepaths = []
+        for i in range(4):
+            image = Image.new('L', (1200, 1600), 250)
+            if i % 2 == 0:
+                ImageDraw.Draw(image).rectangle((100, 100, 1100, 400), fill=20)
+            filepaths.append(path.join(self._root, f'page_{i}.jpg'))
+            image.save(filepaths[-1])
+        self.assertSetEqual({1, 3}, find_blank_pages(filepaths, max_workers=2))
+        # worker processes are reused by the next refresh
+        executor = get_executor(2)
+        self.assertSetEqual({1, 3}, find_blank_pages(filepaths, max_workers=2))
+        self.assertIs(executor, get_executor(2))
+
+
+if __name__ == '__main__':
+    unittest.main()
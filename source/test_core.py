@@ -1,6 +1,16 @@
 import unittest
 from core import *
 import os.path as path
+import os
+import tempfile
+import threading
+import struct
+import json
+import unittest.mock
+from pdfwriter import read_jpeg_info, write_pdf
+from manifest import load_manifest, verify_manifest
+from profiling import Profile
+from staging import Staging, RenameJournal, STAGING_PREFIX, JOURNAL_FILENAME
 
 
 class TestSorting(unittest.TestCase):
@@ -46,6 +56,451 @@ class TestSorting(unittest.TestCase):
         self.assertListEqual(result[::2], self._samples[::2])
         self.assertListEqual(result[1::2], list(reversed(self._samples[1::2])))
 
+    def test_policy_same_as_chain(self):
+        for numbering in [False, True]:
+            for flip in [False, True]:
+                for backward in [False, True]:
+                    expected = sort_lexicographical(list(reversed(self._samples)))
+                    if numbering:
+                        expected = sort_brother_numbering(expected)
+                    if flip:
+                        expected = sort_flip_recto_verso(expected)
+                    if backward:
+                        expected = sort_backward_verso(expected)
+                    result = sort_policy(list(reversed(self._samples)), numbering, flip, backward)
+                    self.assertListEqual(expected, result)
+
+    def test_parse_page(self):
+        page = parse_page('C:\\scan\\test\\Numérisation_20190527_10 (2).jpg')
+        self.assertEqual(10, page.page)
+        self.assertEqual(2, page.batch)
+        page = parse_page('/scan/Numérisation_20190527.jpg')
+        self.assertEqual(('Numérisation_20190527', 1, 1), page[1:4])
+
+    def test_auto(self):
+        def scanned(order, times=None):
+            # pages named (page, batch), given in scan order (one per second, unless times are given)
+            return [make_page(f'/scan/Numérisation_20190527_{p} ({b}).jpg' if b == 2 else
+                              f'/scan/Numérisation_20190527_{p}.jpg',
+                              {'base': 'Numérisation_20190527', 'page': p, 'batch': b}, mtime=t * 10**9)
+                    for t, (p, b) in zip(times or range(len(order)), order)]
+        # rectos, then the stack turned over
+        stack = scanned([(1, 1), (2, 1), (3, 1), (1, 2), (2, 2), (3, 2)])
+        self.assertEqual((True, True), detect_recto_verso(stack))
+        result = sort_pages(stack, True, AUTO_SORTING, AUTO_SORTING)
+        self.assertListEqual([(1, 1), (3, 2), (2, 1), (2, 2), (3, 1), (1, 2)], [(p.page, p.batch) for p in result])
+        # duplex feeder
+        duplex = scanned([(1, 1), (1, 2), (2, 1), (2, 2)])
+        self.assertEqual((True, False), detect_recto_verso(duplex))
+        # mixed up
+        with self.assertRaises(ValueError):
+            detect_recto_verso(scanned([(1, 1), (1, 2), (2, 2), (2, 1)]))
+        with self.assertRaises(ValueError):
+            detect_recto_verso([page._replace(mtime=0) for page in duplex])
+        # batches starting at the same time
+        with self.assertRaises(ValueError):
+            detect_recto_verso(scanned([(1, 1), (1, 2), (2, 1), (2, 2)], [0, 0, 0, 2]))
+        # a verso written at the same time as the last recto
+        with self.assertRaises(ValueError):
+            detect_recto_verso(scanned([(1, 1), (2, 1), (1, 2), (2, 2)], [0, 1, 1, 2]))
+
+
+class TestOutputPattern(unittest.TestCase):
+    def test_same_as_format(self):
+        filepaths = ['/scan/Numérisation_20190527.jpg', '/scan/Numérisation_20190527 (2).jpg']
+        outputs = get_output_filepaths(filepaths, '/out', '{page:03d}_{basename}.{ext}')
+        self.assertListEqual(['/out/001_Numérisation_20190527.jpg', '/out/002_Numérisation_20190527 (2).jpg'], outputs)
+
+    def test_fields(self):
+        self.assertSetEqual({'page', 'ext'}, compile_output_pattern('out', '{page:03d}.{ext}').fields)
+        with self.assertRaises(KeyError):
+            compile_output_pattern('out', '{unknown}')
+        with self.assertRaises(IndexError):
+            compile_output_pattern('out', '{}')
+        with self.assertRaises(ValueError):
+            compile_output_pattern('out', '{page:03s}')
+
+    def test_duplicates(self):
+        outputs = get_output_filepaths(['a.jpg', 'b.jpg', 'c.png'], 'out', '{yyyy}.{ext}')
+        self.assertDictEqual({outputs[0]: [0, 1]}, find_duplicate_outputs(outputs))
+        with self.assertRaises(ValueError):
+            rename_files(['a.jpg', 'b.jpg', 'c.png'], outputs)
+
+
+def make_jpeg_header(width, height, dpi=300):
+    """ jpeg headers only: enough to be embedded, not to be decoded. """
+    app0 = b'JFIF\0\x01\x01\x01' + struct.pack('>HH', dpi, dpi) + b'\0\0'
+    sof0 = struct.pack('>BHHB', 8, height, width, 3) + b'\x01\x22\x00\x02\x11\x01\x03\x11\x01'
+    return (b'\xff\xd8' + b'\xff\xe0' + struct.pack('>H', len(app0) + 2) + app0
+            + b'\xff\xc0' + struct.pack('>H', len(sof0) + 2) + sof0 + b'\xff\xd9')
+
+
+class TestPdf(unittest.TestCase):
+    def test_write_pdf(self):
+        with tempfile.TemporaryDirectory() as root:
+            filepaths = []
+            for i in range(3):
+                filepaths.append(path.join(root, f'{i}.jpg'))
+                with open(filepaths[-1], 'wb') as f:
+                    f.write(make_jpeg_header(600 + i, 300))
+            self.assertEqual((600, 300, 3, 300, 300, False), read_jpeg_info(filepaths[0]))
+            pdf_filepath = path.join(root, 'out.pdf')
+            digest = write_pdf(filepaths, pdf_filepath, checksum='sha256')
+            self.assertEqual(hash_file(pdf_filepath), digest)
+            with open(pdf_filepath, 'rb') as f:
+                pdf = f.read()
+        self.assertIn(b'/Count 3', pdf)
+        self.assertEqual(3, pdf.count(make_jpeg_header(600, 300)[:20]))
+        # every xref entry points to its object
+        xref = pdf[pdf.rindex(b'\nxref\n') + 1:].split(b'\n')
+        for object_id, entry in enumerate(xref[3:3 + 11], start=1):
+            offset = int(entry[:10])
+            self.assertTrue(pdf[offset:].startswith(f'{object_id} 0 obj'.encode()))
+
+
+class TestScanIndex(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self._root = self._tmp.name
+        os.makedirs(path.join(self._root, 'sub'))
+        for filepath in ['Numérisation_20190527.jpg', 'Numérisation_20190527 (2).jpg',
+                         'sub/Numérisation_20190528_2.jpg', 'notes.txt']:
+            open(path.join(self._root, filepath), 'w').close()
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_same_as_walk(self):
+        expected = sorted(path.join(p, f)
+                          for p, _, fs in os.walk(self._root) for f in fs
+                          if windows_scan_naming_convention.match(f))
+        self.assertListEqual(expected, populate_pages(self._root))
+
+    def test_persistent_incremental(self):
+        cache_filepath = path.join(self._root, 'cache', 'index.json')
+        index = ScanIndex(windows_scan_naming_convention, cache_filepath)
+        self.assertEqual(3, len(populate_pages(self._root, index)))
+        # pretend directories are old enough to be trusted
+        for dirpath in [self._root, path.join(self._root, 'sub')]:
+            os.utime(dirpath, ns=(10**18, 10**18))
+        populate_pages(self._root, index)
+        index.save()
+        reloaded = ScanIndex(windows_scan_naming_convention, cache_filepath)
+        reloaded.load()
+        self.assertEqual(3, len(populate_pages(self._root, reloaded)))
+        open(path.join(self._root, 'sub', 'Numérisation_20190528_3.jpg'), 'w').close()
+        self.assertEqual(4, len(populate_pages(self._root, reloaded)))
+
+    def test_file_changed(self):
+        index = ScanIndex(windows_scan_naming_convention)
+        for dirpath in [self._root, path.join(self._root, 'sub')]:
+            os.utime(dirpath, ns=(10**18, 10**18))
+        filepath = path.join(self._root, 'Numérisation_20190527.jpg')
+
+        def scanned_size(**kwargs):
+            return next(p.size for p in scan_pages(self._root, index, **kwargs) if p.filepath == filepath)
+
+        # writing in place does not change the directory mtime: a file just written is stat'ed again
+        scan_pages(self._root, index)
+        with open(filepath, 'ab') as f:
+            f.write(b'more')
+        self.assertEqual(4, scanned_size())
+        # an older file is not, unless asked
+        os.utime(filepath, ns=(10**18, 10**18))
+        self.assertEqual(4, scanned_size())
+        with open(filepath, 'ab') as f:
+            f.write(b'more')
+        self.assertEqual(4, scanned_size())
+        self.assertEqual(8, scanned_size(fresh=True))
+
+    def test_missing_root(self):
+        self.assertListEqual([], populate_pages(path.join(self._root, 'missing')))
+
+
+class TestRenameFiles(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self._root = self._tmp.name
+        self._inputs = []
+        for i in range(6):
+            filepath = path.join(self._root, f'Numérisation_20190527_{i + 1}.jpg')
+            with open(filepath, 'wb') as f:
+                f.write(bytes([i]) * (1000 * i))
+            self._inputs.append(filepath)
+        self._outputs = [path.join(self._root, 'out', f'{i:03}.jpg') for i in range(6)]
+        os.makedirs(path.join(self._root, 'out'))
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_copy(self):
+        progresses = []
+        rename_files(self._inputs, self._outputs, max_workers=3, progress=progresses.append)
+        for i, o in zip(self._inputs, self._outputs):
+            with open(i, 'rb') as fi, open(o, 'rb') as fo:
+                self.assertEqual(fi.read(), fo.read())
+        self.assertEqual(6, max(p.files_done for p in progresses))
+        self.assertEqual(sum(1000 * i for i in range(6)), max(p.bytes_done for p in progresses))
+
+    def test_all_or_nothing(self):
+        os.remove(self._inputs[3])
+        with self.assertRaises(FileNotFoundError):
+            rename_files(self._inputs, self._outputs)
+        self.assertListEqual([], [f for f in os.listdir(path.join(self._root, 'out')) if not f.startswith('.')])
+
+    def test_cancel(self):
+        cancel = threading.Event()
+        cancel.set()
+        with self.assertRaises(InterruptedError):
+            rename_files(self._inputs, self._outputs, cancel=cancel)
+        with self.assertRaises(InterruptedError):
+            scan_pages(self._root, cancel=cancel)
+
+    def test_resume(self):
+        # page 3 cannot be read: a directory in place of the file
+        moved_away = self._inputs[3] + '.bak'
+        os.rename(self._inputs[3], moved_away)
+        os.mkdir(self._inputs[3])
+        with self.assertRaises(FileNotFoundError):
+            rename_files(self._inputs, self._outputs, max_workers=1)
+        os.rmdir(self._inputs[3])
+        os.rename(moved_away, self._inputs[3])
+        progresses = []
+        rename_files(self._inputs, self._outputs, progress=progresses.append)
+        # only the missing page is copied again
+        self.assertLessEqual(max(p.files_total for p in progresses), 3)
+        self.assertListEqual([path.basename(f) for f in self._outputs], sorted(os.listdir(path.join(self._root, 'out'))))
+
+    def test_recover_interrupted(self):
+        # left by a crashed job, that had renamed its first page
+        interrupted_dirpath = path.join(self._root, 'out', STAGING_PREFIX + 'crashed')
+        os.makedirs(interrupted_dirpath)
+        with open(path.join(interrupted_dirpath, JOURNAL_FILENAME), 'w') as f:
+            f.write(json.dumps({'begin': {'inputs': self._inputs[4:], 'outputs': self._outputs[4:], 'delete': False}}))
+            f.write('\n{"commit": true}\n')
+        open(self._outputs[4], 'w').close()
+        open(path.join(interrupted_dirpath, '00001.jpg'), 'w').close()
+        # a job still running on the same output
+        staging = Staging(self._inputs, self._outputs)
+        staging.open()
+        with self.assertRaises(BlockingIOError):
+            Staging(self._inputs, self._outputs).open()
+        # another job on the same output rolls the interrupted one forward, only
+        rename_files(self._inputs[:2], self._outputs[:2])
+        self.assertFalse(path.exists(interrupted_dirpath))
+        self.assertTrue(path.exists(self._outputs[4]))
+        self.assertTrue(path.exists(self._outputs[5]))
+        self.assertTrue(path.isdir(staging.dirpath))
+        staging.close()
+        self.assertFalse(path.exists(staging.dirpath))
+
+    def test_crash_during_commit(self):
+        class Crash(BaseException):
+            pass
+
+        replace = os.replace
+        moves = []
+
+        def crashing_replace(src, dst):
+            if path.dirname(src) != path.dirname(dst):  # a staged copy published
+                if len(moves) == 3:
+                    raise Crash()
+                moves.append(dst)
+            replace(src, dst)
+
+        output_dirpath = path.join(self._root, 'out')
+        plan = make_plan(scan_pages(self._root), self._root, output_dirpath, '{page:03}.{ext}',
+                         delete_after_success=True)
+        contents = {}
+        for entry in plan['files']:
+            with open(path.join(self._root, entry['source']), 'rb') as f:
+                contents[entry['destination']] = f.read()
+        with unittest.mock.patch('core.same_filesystem', return_value=False):
+            with unittest.mock.patch('os.replace', crashing_replace), self.assertRaises(Crash):
+                apply_plan(plan)
+            self.assertEqual(3, len(moves))
+            # the next run publishes the pages staged by the crashed one, instead of removing the others
+            self.assertDictEqual({'copied': 0, 'up_to_date': 6}, apply_plan(plan))
+        for destination, content in contents.items():
+            with open(path.join(output_dirpath, destination), 'rb') as f:
+                self.assertEqual(content, f.read())
+        self.assertFalse(any(path.exists(filepath) for filepath in self._inputs))
+
+    def test_checksum_manifest(self):
+        rename_files(self._inputs, self._outputs, checksum=True)
+        manifest_filepath = path.join(self._root, 'out', MANIFEST_FILENAME)
+        manifest = load_manifest(manifest_filepath)
+        self.assertEqual(hash_file(self._inputs[2]), manifest[self._outputs[2]]['hash'])
+        self.assertEqual(6, len(verify_manifest(manifest_filepath)['unchanged']))
+        # same size, different content
+        with open(self._outputs[2], 'r+b') as f:
+            f.write(b'X')
+        report = verify_manifest(manifest_filepath)
+        self.assertListEqual([self._outputs[2]], report['corrupted'])
+        self.assertEqual(5, len(report['unchanged']) + len(report['ok']))
+        os.remove(self._outputs[3])
+        self.assertListEqual([self._outputs[3]], verify_manifest(manifest_filepath)['missing'])
+
+    def test_checksum_inplace(self):
+        digests = [hash_file(filepath) for filepath in self._inputs]
+        rename_files(self._inputs, self._outputs, delete_after_success=True, checksum=True)
+        manifest = load_manifest(path.join(self._root, 'out', MANIFEST_FILENAME))
+        self.assertListEqual(digests, [manifest[output]['hash'] for output in self._outputs])
+        self.assertFalse(any(path.exists(filepath) for filepath in self._inputs))
+
+    def test_checksum_keeps_changed_originals(self):
+        def progress(copy_progress):  # an original changes once copied, keeping its size
+            if copy_progress.files_done == copy_progress.files_total:
+                with open(self._inputs[2], 'r+b') as f:
+                    f.write(b'X')
+
+        with unittest.mock.patch('core.same_filesystem', return_value=False):
+            with self.assertRaisesRegex(FileNotFoundError, 'originals are kept'):
+                rename_files(self._inputs, self._outputs, delete_after_success=True, progress=progress,
+                             checksum=True)
+        self.assertTrue(all(path.exists(filepath) for filepath in self._inputs))
+
+    def test_checksum_verify_reads_copies_only(self):
+        hashed = []
+
+        def recording_hash_files(filepaths, max_workers=DEFAULT_MAX_WORKERS):
+            hashed.extend(filepaths)
+            return hash_files(filepaths, max_workers)
+
+        with unittest.mock.patch('core.same_filesystem', return_value=False), \
+                unittest.mock.patch('core.hash_files', recording_hash_files):
+            rename_files(self._inputs, self._outputs, delete_after_success=True, checksum=True)
+        self.assertListEqual(self._outputs, hashed)
+        self.assertFalse(any(path.exists(filepath) for filepath in self._inputs))
+
+    def test_inplace_cycle(self):
+        contents = []
+        for i in self._inputs:
+            with open(i, 'rb') as f:
+                contents.append(f.read())
+        # rotate names: every destination is the name of another source
+        outputs = self._inputs[1:] + self._inputs[:1]
+        rename_files(self._inputs, outputs, delete_after_success=True)
+        self.assertEqual(6, len([f for f in os.listdir(self._root) if f.endswith('.jpg')]))
+        for content, o in zip(contents, outputs):
+            with open(o, 'rb') as fo:
+                self.assertEqual(content, fo.read())
+
+    def test_inplace_interrupted(self):
+        outputs = self._inputs[1:] + self._inputs[:1]
+        replace = os.replace
+        calls = []
+
+        def interrupted_replace(src, dst):
+            calls.append(dst)
+            if len(calls) == 4:
+                raise KeyboardInterrupt()
+            replace(src, dst)
+
+        # Ctrl+C: renames already done are reverted
+        with unittest.mock.patch('os.replace', interrupted_replace), self.assertRaises(KeyboardInterrupt):
+            rename_files(self._inputs, outputs, delete_after_success=True)
+        self.assertListEqual(sorted(path.basename(f) for f in self._inputs),
+                             sorted(f for f in os.listdir(self._root) if f.endswith('.jpg')))
+        # killed: the journal left is reverted by the next job on the same output,
+        # including the last rename, done but not recorded yet
+        renames = plan_renames(self._inputs, outputs)
+        journal = RenameJournal(self._root, renames)
+        journal.open()
+        for i, (src, dst) in enumerate(renames[:8]):
+            os.replace(src, dst)
+            if i < 7:
+                journal.mark_renamed(i)
+        journal.release()
+        self.assertLess(len(scan_pages(self._root)), 6)
+        self.assertListEqual([journal.dirpath], recover_staging(self._root))
+        self.assertEqual(6, len(scan_pages(self._root)))
+        self.assertListEqual(sorted(path.basename(f) for f in self._inputs),
+                             sorted(f for f in os.listdir(self._root) if f.endswith('.jpg')))
+
+    def test_plan_renames(self):
+        renames = plan_renames(['a', 'b', 'c'], ['b', 'a', 'd'])
+        self.assertEqual(5, len(renames))
+        self.assertIn(('c', 'd'), renames)
+        with self.assertRaises(ValueError):
+            plan_renames(['a', 'b'], ['c', 'c'])
+
+    def test_sessions(self):
+        # a second session, with an odd number of pages, in a sub directory
+        os.makedirs(path.join(self._root, 'sub'))
+        for name in ['Numérisation_20190528.jpg', 'Numérisation_20190528 (2).jpg', 'Numérisation_20190528_2.jpg']:
+            open(path.join(self._root, 'sub', name), 'w').close()
+        pages = scan_pages(self._root)
+        self.assertEqual(2, len(split_sessions(pages)))
+        output_dirpath = path.join(self._root, 'out')
+        report = rectoverso_sessions(self._root, output_dirpath, '{page:03}.{ext}')
+        self.assertListEqual(['Numérisation_20190527', path.join('sub', 'Numérisation_20190528')],
+                             [session['session'] for session in report])
+        self.assertListEqual(['ok', 'failed'], [session['status'] for session in report])
+        self.assertEqual(6, len([f for f in os.listdir(path.join(output_dirpath, 'Numérisation_20190527'))
+                                 if not f.startswith('.')]))
+
+    def test_plan_apply(self):
+        output_dirpath = path.join(self._root, 'out')
+        plan = make_plan(scan_pages(self._root), self._root, output_dirpath, '{page:03}.{ext}')
+        plan_filepath = path.join(self._root, 'plan.json')
+        save_plan(plan, plan_filepath)
+        plan = load_plan(plan_filepath)
+        self.assertListEqual([f'{i:03}.jpg' for i in range(1, 7)], sorted(f['destination'] for f in plan['files']))
+        self.assertDictEqual({'copied': 6, 'up_to_date': 0}, apply_plan(plan))
+        # only what is missing is copied again
+        os.remove(path.join(output_dirpath, '002.jpg'))
+        self.assertDictEqual({'copied': 1, 'up_to_date': 5}, apply_plan(plan))
+        with open(self._inputs[0], 'ab') as f:
+            f.write(b'changed')
+        with self.assertRaises(ValueError):
+            apply_plan(plan)
+
+    def test_plan_reordered(self):
+        # pages of the same size, so that only what each output is made of tells them apart
+        for filepath in self._inputs:
+            with open(filepath, 'wb') as f:
+                f.write(make_jpeg_header(600, 300))
+        output_dirpath = path.join(self._root, 'out')
+        plan = make_plan(scan_pages(self._root), self._root, output_dirpath, '{page:03}.{ext}')
+        self.assertDictEqual({'copied': 6, 'up_to_date': 0}, apply_plan(plan))
+        self.assertDictEqual({'copied': 0, 'up_to_date': 6}, apply_plan(plan))
+        files = plan['files']
+        files[0]['destination'], files[1]['destination'] = files[1]['destination'], files[0]['destination']
+        self.assertDictEqual({'copied': 2, 'up_to_date': 4}, apply_plan(plan))
+        # a pdf written again in another page order
+        pdf_filepath = path.join(output_dirpath, 'out.pdf')
+        plan = make_plan(scan_pages(self._root), self._root, output_dirpath, None, pdf_filepath=pdf_filepath)
+        self.assertDictEqual({'copied': 6, 'up_to_date': 0}, apply_plan(plan))
+        self.assertDictEqual({'copied': 0, 'up_to_date': 6}, apply_plan(plan))
+        plan['files'].reverse()
+        self.assertDictEqual({'copied': 6, 'up_to_date': 0}, apply_plan(plan))
+
+    def test_plan_duplicates(self):
+        # a sheet fed twice
+        copy_filepath = path.join(self._root, 'Numérisation_20190527_7.jpg')
+        with open(self._inputs[2], 'rb') as fi, open(copy_filepath, 'wb') as fo:
+            fo.write(fi.read())
+        output_dirpath = path.join(self._root, 'out')
+        plan = make_plan(scan_pages(self._root), self._root, output_dirpath, '{page:03}.{ext}', False, False, False)
+        self.assertListEqual([path.basename(self._inputs[2])],
+                             [f['duplicate_of'] for f in plan['files'] if f['duplicate_of']])
+        self.assertEqual(7, sum(1 for f in plan['files'] if f['destination']))
+        plan = make_plan(scan_pages(self._root), self._root, output_dirpath, '{page:03}.{ext}', False, False, False,
+                         skip_duplicates=True)
+        self.assertListEqual([f'{i:03}.jpg' for i in range(1, 7)],
+                             [f['destination'] for f in plan['files'] if f['destination']])
+        self.assertListEqual([(path.basename(copy_filepath), 'duplicate')],
+                             [(f['source'], f['skipped']) for f in plan['files'] if f['skipped']])
+
+    def test_profile(self):
+        with Profile() as profile:
+            rename_files(self._inputs, self._outputs)
+        phases = profile.report()['phases']
+        self.assertEqual(6, phases['copy']['files'])
+        self.assertEqual(sum(1000 * i for i in range(6)), phases['copy']['bytes'])
+        self.assertIn('move', phases)
+
 
 if __name__ == '__main__':
     unittest.main()
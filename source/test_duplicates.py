@@ -0,0 +1,34 @@
+import unittest
+import os.path as path
+import tempfile
+from duplicates import HEAD_TAIL_BYTES, find_duplicates
+
+
+class TestFindDuplicates(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def write(self, name, content):
+        filepath = path.join(self._tmp.name, name)
+        with open(filepath, 'wb') as f:
+            f.write(content)
+        return filepath
+
+    def test_small(self):
+        filepaths = [self.write('a', b'page 1'), self.write('b', b'page 2'), self.write('c', b'page 1'),
+                     self.write('d', b'longer page'), self.write('e', b''), self.write('f', b'')]
+        self.assertDictEqual({2: 0}, find_duplicates(filepaths))
+
+    def test_large(self):
+        head, tail = b'h' * HEAD_TAIL_BYTES, b't' * HEAD_TAIL_BYTES
+        filepaths = [self.write('a', head + b'1' * 100 + tail), self.write('b', head + b'2' * 100 + tail),
+                     self.write('c', head + b'1' * 100 + tail), self.write('d', head + b'1' * 100 + tail)]
+        # same head and tail, only the full hash tells them apart
+        self.assertDictEqual({2: 0, 3: 0}, find_duplicates(filepaths, max_workers=2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+import os
+import os.path as path
+import time
+import tempfile
+import threading
+import socket
+import stat
+import http.client
+from benchmark import generate_scan_tree
+from jobqueue import FINISHED, JobQueue, roots_overlap, make_server, submit_job, get_job, wait_job
+
+
+class TestJobQueue(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self._root = self._tmp.name
+        for name in ['alice', 'bob']:
+            generate_scan_tree(path.join(self._root, name), 8, nb_sessions=1)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def wait(self, queue, job_ids):
+        for _ in range(200):
+            jobs = [queue.get(job_id) for job_id in job_ids]
+            if all(job['status'] in FINISHED for job in jobs):
+                return jobs
+            time.sleep(0.05)
+        self.fail('jobs did not finish.')
+
+    def test_roots_overlap(self):
+        self.assertTrue(roots_overlap('/scans/alice', '/scans/alice/'))
+        self.assertTrue(roots_overlap('/scans', '/scans/alice'))
+        self.assertFalse(roots_overlap('/scans/alice', '/scans/alicia'))
+
+    def test_same_roots_serialized(self):
+        queue = JobQueue(max_jobs=4, paused=True)  # to schedule them all at once
+        alice, bob = path.join(self._root, 'alice'), path.join(self._root, 'bob')
+        jobs = [queue.submit({'input': alice, 'output': path.join(self._root, 'out1')}),
+                queue.submit({'input': alice, 'output': path.join(self._root, 'out2')}),
+                queue.submit({'input': bob})]
+        self.assertListEqual(['queued'] * 3, [queue.get(job['id'])['status'] for job in jobs])
+        queue.resume()
+        jobs = self.wait(queue, [job['id'] for job in jobs])
+        self.assertListEqual(['ok'] * 3, [job['status'] for job in jobs])
+        self.assertLessEqual(jobs[0]['finished'], jobs[1]['started'])
+        self.assertLessEqual(jobs[2]['started'], jobs[0]['finished'])  # bob did not wait
+        self.assertEqual(8, len([f for f in os.listdir(path.join(self._root, 'out2')) if not f.startswith('.')]))
+        queue.close()
+
+    def test_persistent(self):
+        jobs_filepath = path.join(self._root, 'state', 'jobs.json')
+        queue = JobQueue(jobs_filepath, paused=True)  # as if the service stopped before running it
+        job = queue.submit({'input': path.join(self._root, 'alice'), 'output': path.join(self._root, 'out')})
+        with self.assertRaises(ValueError):
+            queue.submit({'input': 'relative'})
+        with self.assertRaises(KeyError):
+            queue.submit({'input': self._root, 'typo': 1})
+        queue.close()
+        restarted = JobQueue(jobs_filepath)
+        restarted.load()
+        self.assertEqual('ok', self.wait(restarted, [job['id']])[0]['status'])
+        restarted.close()
+
+    def serve(self, address):
+        queue = JobQueue()
+        server = make_server(queue, 'secret', address)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(queue.close)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server.server_address
+
+    def check_service(self, address):
+        job = submit_job({'input': path.join(self._root, 'bob'), 'sessions': True}, address, 'secret')
+        job = wait_job(job['id'], address, 'secret', poll_interval=0.05)
+        self.assertEqual('ok', job['status'])
+        self.assertEqual(8, job['report']['files'])
+        with self.assertRaises(ValueError):
+            submit_job({'input': 'relative'}, address, 'secret')
+        with self.assertRaisesRegex(ValueError, 'token'):
+            get_job(job['id'], address, 'wrong')
+
+    @unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'no unix sockets')
+    def test_service_unix(self):
+        address = self.serve(path.join(self._root, 'state', 'jobs.sock'))
+        self.assertEqual(0o600, stat.S_IMODE(os.stat(address).st_mode))
+        self.check_service(address)
+
+    def test_service_tcp(self):
+        address = self.serve(('127.0.0.1', 0))
+        self.check_service(address)
+        headers = {'Authorization': 'Bearer secret'}
+        for extra_headers, code in [({'Host': 'evil.example:80'}, 403), ({'Content-Type': 'text/plain'}, 415)]:
+            connection = http.client.HTTPConnection(*address)
+            connection.request('POST', '/jobs', b'{}', dict(headers, **extra_headers))
+            self.assertEqual(code, connection.getresponse().status)
+            connection.close()
+
+if __name__ == '__main__':
+    unittest.main()
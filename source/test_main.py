@@ -0,0 +1,58 @@
+import unittest
+import os.path as path
+import subprocess
+import sys
+import tempfile
+from config import read_config, CONFIG_DEFAULTS
+
+MAIN_FILEPATH = path.join(path.dirname(path.abspath(__file__)), '__main__.py')
+# seconds allowed to import everything a headless run needs (interpreter start up excluded)
+HEADLESS_IMPORT_BUDGET = 0.5
+
+
+class TestHeadless(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self._root = self._tmp.name
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_read_config(self):
+        config_filepath = path.join(self._root, 'debrother.ini')
+        self.assertDictEqual(CONFIG_DEFAULTS, read_config(config_filepath))
+        with open(config_filepath, 'w') as f:
+            f.write('[DEFAULT]\npattern = {page:04}\nflip = 0\nmove = 1\n')
+        config = read_config(config_filepath)
+        self.assertEqual('{page:04}', config['pattern'])
+        self.assertFalse(config['flip'])
+        self.assertTrue(config['move'])
+        self.assertTrue(config['numbering'])
+
+    def test_startup(self):
+        input_dirpath = path.join(self._root, 'input')
+        with open(path.join(self._root, 'debrother.ini'), 'w') as f:
+            f.write('[DEFAULT]\npattern = {page:03}.{ext}\nmove = 1\n')
+        for name in ['Numérisation_20190527.jpg', 'Numérisation_20190527 (2).jpg']:
+            with open(path.join(self._root, name), 'wb') as f:
+                f.write(b'X')
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', MAIN_FILEPATH, '--nogui', '-i', self._root,
+             '-o', path.join(self._root, 'out'), '-c', path.join(self._root, 'debrother.ini')],
+            capture_output=True, text=True, timeout=60)
+        self.assertEqual(0, result.returncode, result.stderr)
+        # pattern and move are taken from the config file
+        self.assertTrue(path.isfile(path.join(self._root, 'out', '001.jpg')))
+        self.assertFalse(path.exists(path.join(self._root, 'Numérisation_20190527.jpg')))
+
+        # import time: self [us] | cumulative | imported package (nested ones are indented)
+        modules = [line.split('|') for line in result.stderr.splitlines() if line.startswith('import time:')]
+        names = [name.strip() for _, _, name in modules[1:]]
+        self.assertNotIn('tkinter', names)
+        self.assertNotIn('DebrotherMainWindow', names)
+        total = sum(int(cumulative) for _, cumulative, name in modules[1:] if not name.startswith('  ')) / 1e6
+        self.assertLess(total, HEADLESS_IMPORT_BUDGET)
+
+
+if __name__ == '__main__':
+    unittest.main()
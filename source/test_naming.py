@@ -0,0 +1,65 @@
+import unittest
+import os
+import os.path as path
+import json
+import tempfile
+from unittest.mock import patch
+from naming import NAMING_PROFILES, NamingProfile, NamingMatcher, default_matcher
+from scanindex import ScanIndex
+
+
+class TestNamingMatcher(unittest.TestCase):
+    def test_profiles(self):
+        matcher = NamingMatcher(NAMING_PROFILES)
+        self.assertDictEqual({'base': 'Numérisation_20190527', 'page': '10', 'batch': '2', 'profile': 'brother'},
+                             matcher.match('Numérisation_20190527_10 (2).jpg'))
+        self.assertDictEqual({'base': 'Scanned Document', 'page': '2', 'batch': None, 'profile': 'simple_scan'},
+                             matcher.match('Scanned Document-2.jpg'))
+        self.assertDictEqual({'base': 'out', 'page': '12', 'batch': None, 'profile': 'scanimage'},
+                             matcher.match('out12.pnm'))
+        self.assertIsNone(matcher.match('notes.txt'))
+        # intermediate files of an interrupted rename
+        self.assertIsNone(matcher.match('.debrother-1a2b3c4d-00003.jpg'))
+
+    def test_preferred_profile(self):
+        matcher = NamingMatcher([NamingProfile('numbered', r'(?P<base>.+)-(?P<page>\d+)\.jpg'),
+                                 NamingProfile('single', r'(?P<base>.+)\.jpg')])
+        self.assertDictEqual({'base': 'a', 'page': '2', 'batch': None, 'profile': 'numbered'},
+                             matcher.match('a-2.jpg'))
+        self.assertDictEqual({'base': 'a-2', 'page': None, 'batch': None, 'profile': 'single'},
+                             matcher.match('a-2.jpg', 'single'))
+        # falls back to all profiles
+        self.assertEqual('single', matcher.match('a.jpg', 'numbered')['profile'])
+
+    def test_default(self):
+        with tempfile.TemporaryDirectory() as config_dirpath:
+            with patch.dict(os.environ, XDG_CONFIG_HOME=config_dirpath):
+                default_matcher.cache_clear()
+                self.assertListEqual(['brother'], [profile.name for profile in default_matcher().profiles])
+                self.assertIsNone(default_matcher().match('cover-1.jpg'))
+                os.makedirs(path.join(config_dirpath, 'debrother'))
+                with open(path.join(config_dirpath, 'debrother', 'profiles.json'), 'w') as f:
+                    json.dump(['simple_scan', {'name': 'ads', 'pattern': r'(?P<base>img\d{8})_(?P<page>\d+)\.jpg'}], f)
+                default_matcher.cache_clear()
+                self.assertListEqual(['simple_scan', 'ads', 'brother'],
+                                     [profile.name for profile in default_matcher().profiles])
+            default_matcher.cache_clear()
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            NamingMatcher([NamingProfile('a', r'(?P<num>\d+)')])
+        with self.assertRaises(ValueError):
+            NamingMatcher([NamingProfile('a', r'\d+'), NamingProfile('a', r'\w+')])
+
+    def test_directory_profile(self):
+        with tempfile.TemporaryDirectory() as root:
+            for filename in ['Scanned Document-1.jpg', 'Scanned Document-2.jpg', 'out1.pnm', 'notes.txt']:
+                open(path.join(root, filename), 'w').close()
+            scans = ScanIndex(NamingMatcher(NAMING_PROFILES)).scan(root)
+            self.assertEqual(3, len(scans))
+            self.assertSetEqual({'simple_scan', 'scanimage'}, {fields['profile'] for _, fields, _, _ in scans})
+            self.assertEqual('simple_scan', ScanIndex(NamingMatcher(NAMING_PROFILES))._list_dir(root, None)['profile'])
+
+
+if __name__ == '__main__':
+    unittest.main()
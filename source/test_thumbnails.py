@@ -0,0 +1,49 @@
+import unittest
+import os
+import os.path as path
+import tempfile
+from thumbnails import ThumbnailCache
+from config import is_pil_available
+
+
+@unittest.skipUnless(is_pil_available(), 'needs PIL')
+class TestThumbnailCache(unittest.TestCase):
+    def setUp(self):
+        from PIL import Image
+        self._tmp = tempfile.TemporaryDirectory()
+        self._cache_dirpath = path.join(self._tmp.name, 'cache')
+        self._filepaths = []
+        for i in range(4):
+            filepath = path.join(self._tmp.name, f'{i}.jpg')
+            Image.new('RGB', (800, 1000), (60 * i, 0, 0)).save(filepath)
+            self._filepaths.append(filepath)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_thumbnail(self):
+        from PIL import Image
+        cache = ThumbnailCache(self._cache_dirpath, size=(64, 64))
+        thumbnail_filepath = cache.thumbnail(self._filepaths[0])
+        with Image.open(thumbnail_filepath) as image:
+            self.assertLessEqual(max(image.size), 64)
+        # reused as long as the file is unchanged, even by another cache instance
+        self.assertEqual(thumbnail_filepath, ThumbnailCache(self._cache_dirpath, size=(64, 64)).thumbnail(self._filepaths[0]))
+        st = os.stat(self._filepaths[0])
+        os.utime(self._filepaths[0], ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        self.assertNotEqual(thumbnail_filepath, cache.thumbnail(self._filepaths[0]))
+
+    def test_eviction(self):
+        cache = ThumbnailCache(self._cache_dirpath, size=(64, 64))
+        thumbnail_filepath = cache.thumbnail(self._filepaths[0])
+        thumbnail_size = os.stat(thumbnail_filepath).st_size
+        # room for about 2 thumbnails
+        cache = ThumbnailCache(self._cache_dirpath, max_bytes=int(thumbnail_size * 2.5), size=(64, 64))
+        thumbnail_filepaths = [cache.thumbnail(filepath) for filepath in self._filepaths]
+        self.assertFalse(path.exists(thumbnail_filepaths[0]))
+        self.assertTrue(path.exists(thumbnail_filepaths[-1]))
+        self.assertLessEqual(len(os.listdir(self._cache_dirpath)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
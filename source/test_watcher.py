@@ -0,0 +1,79 @@
+import unittest
+import os
+import os.path as path
+import tempfile
+import threading
+from core import scan_pages
+from watcher import batch_state, make_watcher, watch_folders
+
+
+class TestWatcher(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self._root = self._tmp.name
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _scan(self, filenames, mtime=None):
+        for filename in filenames:
+            filepath = path.join(self._root, filename)
+            with open(filepath, 'w') as f:
+                f.write(filename)
+            if mtime is not None:
+                os.utime(filepath, (mtime, mtime))
+
+    def test_batch_state(self):
+        self._scan(['Numérisation_20190527.jpg', 'Numérisation_20190527_2.jpg'], mtime=1000)
+        self.assertEqual((False, 200), batch_state(scan_pages(self._root), settle_delay=10, now=1100))  # verso?
+        self._scan(['Numérisation_20190527 (2).jpg', 'Numérisation_20190527_2 (2).jpg'], mtime=1000)
+        self.assertEqual((False, 5), batch_state(scan_pages(self._root), settle_delay=10, now=1005))
+        self.assertEqual((True, None), batch_state(scan_pages(self._root), settle_delay=10, now=2000))
+
+    def test_batch_state_single_sided(self):
+        self._scan(['Numérisation_20190527.jpg', 'Numérisation_20190527_2.jpg'], mtime=1000)
+        pages = scan_pages(self._root)
+        self.assertEqual((False, 295), batch_state(pages, settle_delay=10, now=1005, single_sided_delay=300))
+        self.assertEqual((True, None), batch_state(pages, settle_delay=10, now=1300, single_sided_delay=300))
+
+    def test_watcher_wakes_up(self):
+        watcher = make_watcher([self._root], poll_interval=0.05)
+        try:
+            self.assertEqual(set(), watcher.wait(0.01))
+            os.makedirs(path.join(self._root, 'sub'))
+            self.assertEqual({self._root}, watcher.wait(2))
+        finally:
+            watcher.close()
+
+    def test_process_complete_batch(self):
+        self._scan(['Numérisation_20190527.jpg', 'Numérisation_20190527 (2).jpg',
+                    'Numérisation_20190527_2.jpg', 'Numérisation_20190527_2 (2).jpg'], mtime=1000)
+        output_dirpath = path.join(self._root, 'out')
+        watch_folders([self._root], output_dirpath, settle_delay=0, max_runs=1)
+        self.assertListEqual(['001.jpg', '002.jpg', '003.jpg', '004.jpg'],
+                             sorted(f for f in os.listdir(path.join(output_dirpath, 'Numérisation_20190527'))
+                                    if not f.startswith('.')))
+
+    def test_process_new_sessions_only(self):
+        self._scan(['Numérisation_20190527.jpg', 'Numérisation_20190527 (2).jpg'], mtime=1000)
+        output_dirpath = path.join(self._root, 'out')
+        first_filepath = path.join(output_dirpath, 'Numérisation_20190527', '001.jpg')
+        daemon = threading.Thread(target=watch_folders, args=([self._root], output_dirpath),
+                                  kwargs=dict(settle_delay=0, poll_interval=0.05, max_runs=2), daemon=True)
+        daemon.start()
+        for _ in range(100):
+            if path.exists(path.join(output_dirpath, 'Numérisation_20190527', '002.jpg')):
+                break
+            daemon.join(0.05)
+        first = os.stat(first_filepath).st_ino
+        self._scan(['Numérisation_20190528.jpg', 'Numérisation_20190528 (2).jpg'])
+        daemon.join(10)
+        self.assertFalse(daemon.is_alive())
+        self.assertListEqual(['001.jpg', '002.jpg'],
+                             sorted(f for f in os.listdir(path.join(output_dirpath, 'Numérisation_20190528'))
+                                    if not f.startswith('.')))
+        self.assertEqual(first, os.stat(first_filepath).st_ino)  # not processed again
+
+
+if __name__ == '__main__':
+    unittest.main()
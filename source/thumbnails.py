@@ -0,0 +1,117 @@
+import os
+import os.path as path
+import time
+import hashlib
+import threading
+import logging
+from config import default_cache_dirpath as default_root_cache_dirpath
+
+logger = logging.getLogger(__name__)
+
+# bounding box of thumbnails, in pixels
+THUMBNAIL_SIZE = (160, 160)
+# disk space used by the thumbnail cache, least recently used thumbnails are removed beyond
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+# once over budget, remove thumbnails until the cache is back to this ratio of it
+EVICTION_RATIO = 0.9
+
+
+def default_cache_dirpath():
+    """
+    :return: path of the thumbnail cache directory ($XDG_CACHE_HOME/debrother/thumbnails)
+    """
+    return path.join(default_root_cache_dirpath(), 'thumbnails')
+
+
+def make_thumbnail(filepath, thumbnail_filepath, size=THUMBNAIL_SIZE):
+    """
+    write a png thumbnail of an image (png, so that Tk can display it without PIL).
+    Jpeg files are decoded at reduced resolution only (draft mode).
+    """
+    from PIL import Image
+    tmp_filepath = thumbnail_filepath + '.tmp'
+    with Image.open(filepath) as image:
+        image.draft('RGB', size)
+        image.thumbnail(size)
+        image.convert('RGB').save(tmp_filepath, 'PNG')
+    os.replace(tmp_filepath, thumbnail_filepath)
+
+
+class ThumbnailCache:
+    """
+    png thumbnails on disk, one per (path, size, mtime) of the original: a changed file gets a new thumbnail.
+    Each use refreshes the thumbnail mtime, and least recently used ones are removed once the cache
+    gets bigger than max_bytes.
+    """
+    def __init__(self, cache_dirpath, max_bytes=DEFAULT_CACHE_BYTES, size=THUMBNAIL_SIZE):
+        """
+        :param cache_dirpath: directory where thumbnails are kept.
+        :param max_bytes: disk space budget.
+        :param size: thumbnails bounding box (width, height), in pixels.
+        """
+        self._dirpath = cache_dirpath
+        self._max_bytes = max_bytes
+        self._size = size
+        self._entries = None  # key -> [bytes, last used], read from disk on first use
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        self._entries = {}
+        try:
+            with os.scandir(self._dirpath) as it:
+                for entry in it:
+                    if entry.name.endswith('.png'):
+                        st = entry.stat()
+                        self._entries[entry.name[:-4]] = [st.st_size, st.st_mtime]
+        except FileNotFoundError:
+            pass
+        self._total = sum(size for size, _ in self._entries.values())
+
+    def _key(self, filepath, st):
+        width, height = self._size
+        key = f'{path.abspath(filepath)}\0{st.st_size}\0{st.st_mtime_ns}\0{width}x{height}'
+        return hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest()
+
+    def thumbnail(self, filepath):
+        """
+        :param filepath: path to an image file.
+        :return: path to its png thumbnail, generated if not cached yet.
+        """
+        key = self._key(filepath, os.stat(filepath))
+        thumbnail_filepath = path.join(self._dirpath, key + '.png')
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            entry = self._entries.get(key)
+        if entry is not None:
+            now = time.time()
+            try:
+                os.utime(thumbnail_filepath, (now, now))
+                entry[1] = now
+                return thumbnail_filepath
+            except FileNotFoundError:  # removed behind our back
+                pass
+
+        os.makedirs(self._dirpath, exist_ok=True)
+        make_thumbnail(filepath, thumbnail_filepath, self._size)
+        with self._lock:
+            if key in self._entries:
+                self._total -= self._entries[key][0]
+            self._entries[key] = [os.stat(thumbnail_filepath).st_size, time.time()]
+            self._total += self._entries[key][0]
+            if self._total > self._max_bytes:
+                self._evict()
+        return thumbnail_filepath
+
+    def _evict(self):
+        for key in sorted(self._entries, key=lambda k: self._entries[k][1]):
+            if self._total <= self._max_bytes * EVICTION_RATIO:
+                break
+            size, _ = self._entries.pop(key)
+            self._total -= size
+            try:
+                os.remove(path.join(self._dirpath, key + '.png'))
+            except FileNotFoundError:
+                pass
+        logger.debug('thumbnail cache: %d thumbnails, %d bytes.', len(self._entries), self._total)
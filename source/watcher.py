@@ -0,0 +1,247 @@
+import os
+import os.path as path
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+from collections import defaultdict
+from core import scan_pages, split_sessions, process_sessions
+from naming import default_matcher
+from scanindex import ScanIndex
+
+logger = logging.getLogger(__name__)
+
+# inotify(7) flags
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct('iIII')
+
+# a batch is complete when its files did not change for that long (seconds)
+DEFAULT_SETTLE_DELAY = 10.
+# a session without any verso page (single sided, or a naming profile without batch number) is complete
+# when its files did not change for that long (seconds): long enough to turn the sheets over
+DEFAULT_SINGLE_SIDED_DELAY = 300.
+# period of the stat polling, when inotify is not available (seconds)
+DEFAULT_POLL_INTERVAL = 5.
+
+
+class InotifyWatcher:
+    """
+    watch directory trees with linux inotify: wait() blocks (no cpu) until something changes.
+    """
+    def __init__(self, roots):
+        libc_name = ctypes.util.find_library('c')
+        if not sys.platform.startswith('linux') or not libc_name:
+            raise OSError(errno.ENOSYS, 'inotify not available')
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._watches = {}  # wd -> (root, dirpath)
+        for root in roots:
+            self._add_tree(root, root)
+
+    def close(self):
+        os.close(self._fd)
+
+    def _add_watch(self, root, dirpath):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(dirpath), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f'inotify_add_watch failed on {dirpath}')
+        self._watches[wd] = (root, dirpath)
+
+    def _add_tree(self, root, dirpath):
+        self._add_watch(root, dirpath)
+        for p, dirnames, _ in os.walk(dirpath):
+            for dirname in dirnames:
+                self._add_watch(root, path.join(p, dirname))
+
+    def wait(self, timeout=None):
+        """
+        :param timeout: maximum time to wait in seconds (None: forever).
+        :return: set of roots where something changed (empty on timeout).
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        changed = set()
+        try:
+            buffer = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, name_len = EVENT_HEADER.unpack_from(buffer, offset)
+            name = buffer[offset + EVENT_HEADER.size: offset + EVENT_HEADER.size + name_len].rstrip(b'\0')
+            offset += EVENT_HEADER.size + name_len
+            if mask & IN_Q_OVERFLOW:  # events lost: check every root
+                changed.update(root for root, _ in self._watches.values())
+                continue
+            if wd not in self._watches:
+                continue
+            root, dirpath = self._watches[wd]
+            changed.add(root)
+            if mask & IN_IGNORED:
+                del self._watches[wd]
+            elif mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                try:
+                    self._add_tree(root, path.join(dirpath, os.fsdecode(name)))
+                except OSError as e:
+                    logger.warning(e)
+        return changed
+
+
+class PollingWatcher:
+    """
+    fallback watcher: periodically stat directories, and report roots where a directory mtime changed.
+    """
+    def __init__(self, roots, poll_interval=DEFAULT_POLL_INTERVAL):
+        self._roots = list(roots)
+        self._poll_interval = poll_interval
+        self._signatures = {root: self._signature(root) for root in self._roots}
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def _signature(root):
+        signature = []
+        for p, _, _ in os.walk(root):
+            try:
+                signature.append((p, os.stat(p).st_mtime_ns))
+            except OSError:
+                pass
+        return signature
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = self._poll_interval if deadline is None else min(self._poll_interval, deadline - time.monotonic())
+            time.sleep(max(0., delay))
+            changed = set()
+            for root in self._roots:
+                signature = self._signature(root)
+                if signature != self._signatures[root]:
+                    self._signatures[root] = signature
+                    changed.add(root)
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+
+def make_watcher(roots, poll_interval=DEFAULT_POLL_INTERVAL):
+    """
+    :return: an InotifyWatcher if available, else a PollingWatcher.
+    """
+    try:
+        return InotifyWatcher(roots)
+    except OSError as e:
+        logger.info(f'inotify not available ({e}): polling every {poll_interval}s.')
+        return PollingWatcher(roots, poll_interval)
+
+
+def batch_state(pages, settle_delay=DEFAULT_SETTLE_DELAY, now=None, single_sided_delay=DEFAULT_SINGLE_SIDED_DELAY):
+    """
+    tells if scan sessions are complete: every session has as many verso (batch 2) as recto pages,
+    and no file changed for settle_delay seconds. A session without any verso page is complete
+    once no file changed for single_sided_delay seconds.
+
+    :param pages: list of Page.
+    :param settle_delay: seconds without change before files are considered complete.
+    :param now: current time (default time.time()).
+    :param single_sided_delay: seconds without change before a session without verso is considered complete.
+    :return: (ready, wait) where wait is the time before the answer may change (None if unknown).
+    """
+    if not pages:
+        return False, None
+    counts = defaultdict(lambda: [0, 0])
+    for page in pages:
+        if page.batch in (1, 2):
+            counts[page.base][page.batch - 1] += 1
+    delay = settle_delay
+    for recto, verso in counts.values():
+        if not verso:
+            delay = max(delay, single_sided_delay)
+        elif recto != verso:
+            return False, None  # wait for the rest of the verso batch
+    try:
+        last_change = max(os.stat(page.filepath).st_mtime for page in pages)
+    except OSError:  # files moving around: check again later
+        return False, settle_delay
+    now = time.time() if now is None else now
+    remaining = last_change + delay - now
+    if remaining > 0:
+        return False, remaining
+    return True, None
+
+
+def watch_folders(roots, output_dirpath=None, output_filepattern='{page:03d}.{ext}',
+                  settle_delay=DEFAULT_SETTLE_DELAY, poll_interval=DEFAULT_POLL_INTERVAL,
+                  max_runs=None, single_sided_delay=DEFAULT_SINGLE_SIDED_DELAY, **options):
+    """
+    daemon: watch scanner drop folders, and process each scan session as soon as it is complete,
+    in its own output directory (see core.process_sessions). A session is processed once:
+    pages added to it afterwards are ignored.
+
+    :param roots: list of input directories.
+    :param output_dirpath: output directory (default: each input directory).
+        With several inputs, each one gets its own sub directory.
+    :param output_filepattern: output file name syntax (within a session).
+    :param settle_delay: seconds without change before a batch is considered complete.
+    :param poll_interval: period of the stat polling, when inotify is not available.
+    :param max_runs: stop after that many processed sessions (default: run forever).
+    :param single_sided_delay: seconds without change before a session without verso is considered complete.
+    :param options: other process_sessions parameters (sorting, delete_after_success, ...).
+    """
+    roots = [path.abspath(root) for root in roots]
+    scan_index = ScanIndex(default_matcher())
+    done = defaultdict(set)  # root -> sessions (dirpath, base) already processed
+    nb_runs = 0
+    watcher = make_watcher(roots, poll_interval)
+    logger.info(f'watching {len(roots)} folders.')
+    try:
+        pending = set(roots)
+        while max_runs is None or nb_runs < max_runs:
+            next_check = None
+            for root in sorted(pending):
+                pending.discard(root)
+                ready = {}  # complete sessions -> pages
+                for session, session_pages in split_sessions(scan_pages(root, scan_index)).items():
+                    if session in done[root]:
+                        continue
+                    complete, wait = batch_state(session_pages, settle_delay, single_sided_delay=single_sided_delay)
+                    if complete:
+                        ready[session] = session_pages
+                    elif wait is not None:
+                        pending.add(root)
+                        next_check = wait if next_check is None else min(next_check, wait)
+                    if max_runs is not None and nb_runs + len(ready) >= max_runs:
+                        break
+                if not ready:
+                    continue
+                output = root if output_dirpath is None else \
+                    output_dirpath if len(roots) == 1 else path.join(output_dirpath, path.basename(root))
+                done[root].update(ready)
+                pages = [page for session_pages in ready.values() for page in session_pages]
+                reports = process_sessions(pages, root, output, output_filepattern, **options)
+                for report in reports:
+                    logger.info(f'session {report["session"]} {report["status"]}: {report["files"]} pages.')
+                nb_runs += len(reports)
+            if max_runs is not None and nb_runs >= max_runs:
+                break
+            pending |= watcher.wait(next_check)
+    finally:
+        watcher.close()